@@ -0,0 +1,390 @@
+"""
+In-process benchmark for the processing pipeline.
+
+Runs clean_data, generate_data, vectorize_data, enrich_data and /api/process against synthetic
+datasets, with a local mock of the Cerebras API and the offline search stub, and records
+latency percentiles, throughput and peak memory as JSON. Compare a run against a saved
+baseline to catch performance regressions:
+
+    python benchmark.py --rows 10000 100000 --output bench.json
+    python benchmark.py --rows 10000 100000 --baseline bench.json
+
+With --startup it also times worker boot (import, startup hooks and the first request) and
+its memory, for a bare worker and for one that preloads the heavy modules and models.
+
+Exits with status 1 when a result is slower or uses more memory than the baseline allows.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+# Keep benchmark caches, indexes and results out of the real data directory
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="datasanity-bench-"))
+os.environ.setdefault("ENRICH_BACKEND", "stub")
+# Repeated /api/process runs would otherwise be answered from the stage cache
+os.environ.setdefault("STAGE_CACHE", "0")
+
+import numpy as np
+import pandas as pd
+
+from embedding_backends import EMBED_BACKEND, EMBED_BACKENDS, REFERENCE_BACKEND
+from ingest import peak_rss_mb
+
+STAGES = ("clean", "generate", "embed", "enrich", "process")
+DEFAULT_PROCESS_PROMPT = "Clean this dataset and enrich the ambiguous fields"
+HASH_EMBEDDING_MODEL = "bench-hashing-encoder"
+# Modules a bare worker should not have imported; a warm worker preloads them
+HEAVY_MODULES = ("faiss", "httpx", "sentence_transformers", "torch")
+
+# Run in a fresh interpreter: time from importing the app until it has served "/". The test
+# client (and the httpx it uses) is imported first, so its modules are neither timed nor reported.
+STARTUP_SCRIPT = """
+import json, sys, time
+from fastapi.testclient import TestClient
+harness = set(sys.modules)
+start = time.perf_counter()
+import main
+with TestClient(main.app) as client:
+    client.get("/")
+    seconds = time.perf_counter() - start
+from ingest import peak_rss_mb
+print(json.dumps({"seconds": seconds, "peak_rss_mb": peak_rss_mb(),
+                  "loaded": [name for name in %r if name in sys.modules and name not in harness]}))
+""" % (HEAVY_MODULES,)
+
+_CITIES = ["New York", "London", "Paris", "Tokyo", "Sydney", "Berlin", "Toronto", "Madrid", "Mumbai", "Seoul"]
+_OCCUPATIONS = ["Engineer", "Doctor", "Teacher", "Designer", "Accountant", "Nurse", "Lawyer", "Chef"]
+_WORDS = ["quick", "reliable", "late", "payment", "customer", "order", "returned", "damaged", "great", "slow",
+          "support", "refund", "delivery", "excellent", "poor", "price", "quality", "again", "never", "always"]
+
+
+def synthetic_dataset(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Mixed-dtype data with the usual problems: missing values, exact duplicates,
+    near-duplicate text, inconsistent casing and numeric outliers.
+    """
+    rng = np.random.default_rng(seed)
+    words = rng.choice(np.array(_WORDS, dtype=object), (rows, 6))
+    notes = words[:, 0] + " " + words[:, 1] + " " + words[:, 2] + " " + words[:, 3] + " " + words[:, 4] + " " + words[:, 5]
+    df = pd.DataFrame({
+        "id": np.arange(rows, dtype=np.int64),
+        "name": pd.array(np.char.add("person ", rng.integers(0, max(rows // 3, 1), rows).astype(str)), dtype="string"),
+        "city": pd.array(rng.choice(np.array(_CITIES + [c.lower() for c in _CITIES[:3]], dtype=object), rows), dtype="string"),
+        "occupation": pd.array(rng.choice(np.array(_OCCUPATIONS, dtype=object), rows), dtype="string"),
+        "age": pd.array(rng.integers(18, 80, rows), dtype="Int64"),
+        "score": rng.normal(50, 15, rows),
+        "active": rng.random(rows) < 0.7,
+        "signup": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500, rows), unit="D"),
+        "note": pd.array(notes, dtype="string"),
+    })
+    df.loc[rng.random(rows) < 0.03, "age"] = None
+    df.loc[rng.random(rows) < 0.02, "city"] = None
+    df.loc[rng.random(rows) < 0.01, "score"] = 1e6
+    # About 2% of the rows repeat an earlier row exactly
+    take = np.arange(rows)
+    duplicates = np.flatnonzero(rng.random(rows) < 0.02)
+    duplicates = duplicates[duplicates > 0]
+    take[duplicates] = rng.integers(0, duplicates)
+    df = df.iloc[take].reset_index(drop=True)
+    return df
+
+
+class HashingEncoder:
+    """
+    Deterministic stand-in for a SentenceTransformer: 64-dimensional vectors from a hash of
+    the text, so embedding benchmarks do not need model weights or a GPU.
+    """
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        out = np.empty((len(texts), 64), dtype=np.float32)
+        for i, text in enumerate(texts):
+            digest = hashlib.blake2b(str(text).encode("utf-8"), digest_size=64).digest()
+            out[i] = np.frombuffer(digest, dtype=np.uint8)
+        return (out - 127.5) / 127.5
+
+    def parameters(self):
+        return []
+
+
+class MockLLM:
+    """
+    Local HTTP server speaking the chat completions API: cleaning prompts get their dataset
+    echoed back, generation prompts get the requested number of rows, anything else a short note.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._lock:
+                    mock.calls += 1
+                    call = mock.calls
+                if mock.latency:
+                    time.sleep(mock.latency)
+                content = mock.respond(body["messages"][0]["content"], call)
+                out = json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="mock-llm", daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def respond(self, prompt: str, call: int) -> str:
+        requested = re.search(r"Return exactly (\d+) new rows as CSV with this header:\n(.*)\nExample rows:\n(.*?)This is batch",
+                              prompt, flags=re.DOTALL)
+        if requested:
+            count, header, examples = int(requested.group(1)), requested.group(2), requested.group(3)
+            samples = [line.split(",") for line in examples.splitlines()[1:] if line] or [header.split(",")]
+            # Make each row unique by tagging its first text field (or replacing a numeric first field)
+            text_field = next((j for j, value in enumerate(samples[0]) if not _is_number(value)), None)
+            lines = [header]
+            for i in range(count):
+                row = list(samples[i % len(samples)])
+                if text_field is None:
+                    row[0] = str(call * 1000000 + i)
+                else:
+                    row[text_field] = f"{row[text_field]} {call}-{i}"
+                lines.append(",".join(row))
+            return "```csv\n" + "\n".join(lines) + "\n```"
+        dataset = re.search(r"Dataset:\n(.*?)\n\nUser Instructions", prompt, flags=re.DOTALL)
+        if dataset:
+            return "Cleaned data:\n```csv\n" + dataset.group(1) + "\n```\nRationale: no changes needed."
+        return "Summary: the data looks consistent."
+
+    def close(self):
+        self.server.shutdown()
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets the VmHWM high-water mark of this process
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 4)
+
+
+def measure(run: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """
+    Call run() repeat times. Returns per-call seconds, p50/p95 and the peak RSS over all calls.
+    """
+    seconds = []
+    _reset_peak_rss()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(round(time.perf_counter() - start, 4))
+    return {"seconds": seconds, "p50": _percentile(seconds, 50), "p95": _percentile(seconds, 95),
+            "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def measure_startup(repeat: int, embed_model: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Boot time and peak memory of a bare worker (heavy modules imported on first use) and of a
+    warm one (PRELOAD_MODULES and, with embed_model, EMBED_PRELOAD_MODELS set), each in a new process.
+    """
+    variants = {
+        "startup_bare": {"PRELOAD_MODULES": ""},
+        "startup_warm": {"PRELOAD_MODULES": ",".join(HEAVY_MODULES), "EMBED_PRELOAD_MODELS": embed_model or ""},
+    }
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for stage, env in variants.items():
+        runs = []
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=backend_dir, env={**os.environ, **env},
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        seconds = [round(run["seconds"], 4) for run in runs]
+        results.append({"stage": stage, "rows": 0, "seconds": seconds, "p50": _percentile(seconds, 50),
+                        "p95": _percentile(seconds, 95), "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+                        "loaded_modules": runs[-1]["loaded"]})
+    return results
+
+
+def build_stages(args: argparse.Namespace) -> Dict[str, Callable[[pd.DataFrame], Callable[[], Any]]]:
+    """
+    For each stage, a function taking the dataset and returning the call to time.
+    """
+    from fastapi.testclient import TestClient
+
+    from cerebras_client import cerebras_client
+    from embedding_cache import get_embedding_cache
+    from enrichment import enrichment_client
+    from main import app
+    from routes.clean import clean_data
+    from routes.embed import vectorize_data
+    from routes.enrich import enrich_data
+    from routes.generate import generate_data
+
+    client = TestClient(app)
+    embed_model = HASH_EMBEDDING_MODEL if args.hash_embeddings else args.embed_model
+
+    def fresh(call: Callable[[], Any]) -> Callable[[], Any]:
+        # Every timed call starts with empty LLM, embedding and search lookup caches, so repeats do real work
+        def run():
+            cerebras_client.cache.clear()
+            get_embedding_cache().clear()
+            enrichment_client.clear_cache()
+            return call()
+        return run
+
+    index_names = (f"bench_{number}" for number in itertools.count())
+
+    def process(df: pd.DataFrame) -> Callable[[], Any]:
+        payload = df.to_csv(index=False).encode("utf-8")
+
+        def run():
+            response = client.post("/api/process", data={"prompt": args.process_prompt},
+                                   files={"file": ("bench.csv", payload, "text/csv")})
+            response.raise_for_status()
+        return fresh(run)
+
+    return {
+        "clean": lambda df: fresh(lambda: clean_data(df, "Clean this dataset")),
+        "generate": lambda df: fresh(lambda: generate_data(f"generate {len(df)} examples", None,
+                                                           {"mode": args.generate_mode, "count": len(df)})),
+        "embed": lambda df: fresh(lambda: vectorize_data(df, "Vectorize this dataset", embed_model,
+                                                         index_name=next(index_names), backend=args.embed_backend)),
+        "enrich": lambda df: fresh(lambda: enrich_data(df, "Enrich this dataset", {"backend": "stub"})),
+        "process": process,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions against the baseline: p50 latency or peak memory above baseline * (1 + tolerance).
+    """
+    previous = {(r["stage"], r["rows"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result["stage"], result["rows"]))
+        if before is None:
+            continue
+        for metric in ("p50", "peak_rss_mb"):
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{result['stage']} @ {result['rows']} rows: {metric} "
+                                   f"{result[metric]} vs baseline {before[metric]}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the DataSanity processing pipeline in-process.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000], help="dataset sizes, e.g. 10000 1000000 10000000")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage and size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds the mock LLM takes per call")
+    parser.add_argument("--max-embed-rows", type=int, default=200000, help="cap on rows embedded per run")
+    parser.add_argument("--hash-embeddings", action="store_true", help="use a hashing encoder instead of a real model")
+    parser.add_argument("--embed-model", default=None, help="sentence-transformers model for the embed stage")
+    parser.add_argument("--embed-backend", default=EMBED_BACKEND, choices=EMBED_BACKENDS,
+                        help="inference backend for the embed stage")
+    parser.add_argument("--generate-mode", default="auto", choices=["auto", "llm", "local"])
+    parser.add_argument("--process-prompt", default=DEFAULT_PROCESS_PROMPT)
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown/memory growth vs the baseline")
+    parser.add_argument("--startup", action="store_true", help="also measure bare and warm worker boot time and memory")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    mock = MockLLM(args.llm_latency)
+    from cerebras_client import cerebras_client
+    from model_registry import model_registry
+    cerebras_client.base_url = mock.base_url
+    cerebras_client.rate_per_second = 0
+    if args.hash_embeddings:
+        # Under the benchmarked backend and the fp32 one it is compared against
+        for backend in {args.embed_backend, REFERENCE_BACKEND}:
+            model_registry.register(HASH_EMBEDDING_MODEL, HashingEncoder(), backend=backend)
+    runners = build_stages(args)
+
+    results = []
+    if args.startup:
+        for result in measure_startup(args.repeat, args.embed_model):
+            results.append(result)
+            print(f"  {result['stage']:<13} p50 {result['p50']:>8.3f}s  p95 {result['p95']:>8.3f}s  "
+                  f"peak RSS {result['peak_rss_mb']:>8.1f} MB  loaded: {', '.join(result['loaded_modules']) or 'none'}")
+    for rows in args.rows:
+        start = time.perf_counter()
+        dataset = synthetic_dataset(rows, args.seed)
+        print(f"Dataset: {rows} rows, {dataset.memory_usage(deep=True).sum() / 2 ** 20:.0f} MB "
+              f"(built in {time.perf_counter() - start:.1f}s)")
+        for stage in stages:
+            df = dataset.head(args.max_embed_rows) if stage == "embed" else dataset
+            calls_before = mock.calls
+            stats = measure(runners[stage](df), args.repeat)
+            result = {"stage": stage, "rows": rows, "rows_processed": len(df),
+                      "rows_per_second": int(len(df) / stats["p50"]) if stats["p50"] else None,
+                      "llm_calls": (mock.calls - calls_before) // args.repeat, **stats}
+            results.append(result)
+            print(f"  {stage:<9} p50 {result['p50']:>8.3f}s  p95 {result['p95']:>8.3f}s  "
+                  f"{result['rows_per_second'] or 0:>10} rows/s  peak RSS {result['peak_rss_mb']:>8.1f} MB")
+        del dataset
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    mock.close()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
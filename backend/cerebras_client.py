@@ -1,57 +1,268 @@
-import httpx
-import json
-from typing import Optional, Dict, Any
+import asyncio
+import copy
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from llm_cache import ResponseCache
+from lazy_imports import lazy_import
+
+# Imported on first use (or at startup via PRELOAD_MODULES)
+httpx = lazy_import("httpx")
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter: `rate` requests per second with bursts up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
 
 class CerebrasClient:
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or "YOUR_CEREBRAS_API_KEY"
-        self.base_url = "https://api.cerebras.ai/v1"
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 max_concurrency: Optional[int] = None, rate_per_second: Optional[float] = None,
+                 max_retries: Optional[int] = None, timeout: Optional[float] = None):
+        self.api_key = api_key or os.getenv("CEREBRAS_API_KEY", "YOUR_CEREBRAS_API_KEY")
+        self.base_url = base_url or os.getenv("CEREBRAS_BASE_URL", "https://api.cerebras.ai/v1")
         self.model = "llama2-13b"
-    
-    def generate(self, prompt: str, max_tokens: int = 512) -> Dict[str, Any]:
+        self.max_concurrency = max_concurrency or int(os.getenv("CEREBRAS_MAX_CONCURRENCY", "8"))
+        self.rate_per_second = rate_per_second if rate_per_second is not None else float(os.getenv("CEREBRAS_RATE_PER_SEC", "10"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("CEREBRAS_MAX_RETRIES", "3"))
+        self.timeout = timeout or float(os.getenv("CEREBRAS_TIMEOUT", "30"))
+
+        # The pooled AsyncClient, semaphore and rate limiter all live on one background event
+        # loop, so sync callers and callers on any other loop share the same connections
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.cache = ResponseCache()
+
+    def generate(self, prompt: str, max_tokens: int = 512, timeout: Optional[float] = None,
+                 use_cache: bool = True) -> Dict[str, Any]:
         """
         Generate text using Cerebras API.
+        Blocking wrapper around agenerate for existing sync callers.
+        """
+        coro = self._generate(prompt, max_tokens, timeout, use_cache)
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    async def agenerate(self, prompt: str, max_tokens: int = 512, timeout: Optional[float] = None,
+                        use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Generate text using Cerebras API without blocking the caller's event loop.
+        """
+        coro = self._generate(prompt, max_tokens, timeout, use_cache)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()))
+
+    def generate_many(self, prompts: List[str], max_tokens: int = 512,
+                      concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Generate completions for several prompts concurrently, at most `concurrency` at a time
+        (within the client-wide limit). Blocking; results are returned in prompt order.
+        """
+        coro = self._generate_many(prompts, max_tokens, concurrency)
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss/collapsed counts and the latency saved by the response cache.
+        """
+        return self.cache.snapshot()
+
+    async def _generate(self, prompt: str, max_tokens: int, timeout: Optional[float],
+                        use_cache: bool) -> Dict[str, Any]:
+        if not use_cache:
+            result, _ = await self._call(prompt, max_tokens, timeout)
+            return result
+
+        key = ResponseCache.key(self.model, prompt, max_tokens)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Identical concurrent requests wait for the one call already in flight
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            start = time.perf_counter()
+            try:
+                result = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The call we were waiting on was cancelled by its own caller; make our own
+                return await self._generate(prompt, max_tokens, timeout, use_cache)
+            self.cache.record_collapsed(time.perf_counter() - start)
+            # Every waiter gets its own copy of the one response
+            return copy.deepcopy(result)
+
+        inflight = asyncio.get_running_loop().create_future()
+        self._inflight[key] = inflight
+        try:
+            start = time.perf_counter()
+            result, from_api = await self._call(prompt, max_tokens, timeout)
+            if from_api:
+                self.cache.put(key, result, time.perf_counter() - start)
+            inflight.set_result(result)
+            return result
+        except BaseException:
+            # Cancelled: release the requests waiting on this call instead of leaving them hanging
+            if not inflight.done():
+                inflight.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _generate_many(self, prompts: List[str], max_tokens: int,
+                             concurrency: Optional[int]) -> List[Dict[str, Any]]:
+        limit = asyncio.Semaphore(concurrency or self.max_concurrency)
+
+        async def bounded(prompt: str) -> Dict[str, Any]:
+            async with limit:
+                return await self._generate(prompt, max_tokens, None, True)
+
+        return await asyncio.gather(*(bounded(prompt) for prompt in prompts))
+
+    async def _call(self, prompt: str, max_tokens: int, timeout: Optional[float]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Make one (retrying) API call. Returns (result, whether it is a real completion).
         """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        
+
         data = {
             "model": self.model,
-            "prompt": prompt,
+            "messages": [{"role": "user", "content": prompt}],
             "max_tokens": max_tokens
         }
-        
+
         try:
-            # In a real implementation, we would call the Cerebras API
-            # For this MVP, we'll return a simulated response
-            response = httpx.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30.0
-            )
-            
-            # Simulate API response for MVP
+            async with self._semaphore:
+                response = await self._post_with_retries(headers, data, timeout or self.timeout)
+
+            content = _completion_text(response)
+            if content is not None:
+                return {"success": True, "response": content, "data": content}, True
+
+            # Simulate API response for MVP when no completion is returned
             return {
                 "success": True,
                 "response": f"Simulated Cerebras API response for prompt: {prompt[:100]}...",
                 "data": "Placeholder data based on the prompt"
-            }
-            
+            }, False
+
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e),
                 "response": None
-            }
-    
+            }, False
+
+    async def _post_with_retries(self, headers: Dict[str, str], data: Dict[str, Any], timeout: float) -> "httpx.Response":
+        """
+        POST with exponential backoff (plus jitter) on 429/5xx and transport errors,
+        honouring Retry-After when the server sends it.
+        """
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            try:
+                response = await self._http.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=headers,
+                    json=data,
+                    timeout=timeout
+                )
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    if response.status_code in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After")
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * (2 ** attempt)
+            delay += random.uniform(0, delay / 2)
+            logger.warning("Cerebras request failed, retrying in %.2fs (attempt %d)", delay, attempt + 1)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="cerebras-client", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _setup(self):
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=self.timeout,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(self.rate_per_second)
+
+    def close(self):
+        """
+        Close pooled connections and stop the background loop.
+        """
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._http.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
     def set_model(self, model: str):
         """
         Set the model to use for generation.
         """
         self.model = model
 
+
+def _completion_text(response: "httpx.Response") -> Optional[str]:
+    """
+    Extract the completion text from a chat completions response, if there is one.
+    """
+    if not response.is_success:
+        return None
+    try:
+        return response.json()["choices"][0]["message"]["content"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
 # Global instance of the Cerebras client
-cerebras_client = CerebrasClient()
\ No newline at end of file
+cerebras_client = CerebrasClient()
@@ -0,0 +1,438 @@
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+CLEAN_CHUNK_ROWS = int(os.getenv("CLEAN_CHUNK_ROWS", "100000"))
+NEAR_DUP_THRESHOLD = float(os.getenv("CLEAN_NEAR_DUP_THRESHOLD", "0.9"))
+LLM_CLEAN_BATCH_TOKENS = int(os.getenv("LLM_CLEAN_BATCH_TOKENS", "2000"))
+LLM_CLEAN_CONCURRENCY = int(os.getenv("LLM_CLEAN_CONCURRENCY", "4"))
+LLM_CLEAN_MAX_ROWS = int(os.getenv("LLM_CLEAN_MAX_ROWS", "200"))
+
+MISSING_STRATEGIES = ("drop", "keep", "mean", "median", "mode", "constant")
+OUTLIER_METHODS = ("iqr", "zscore", "none")
+DEFAULT_OUTLIER_K = {"iqr": 1.5, "zscore": 3.0}
+OUTLIER_COLUMN = "is_outlier"
+# How the LLM sees the data: a 10-row preview, every row in batches, or a representative sample
+LLM_MODES = ("preview", "batches", "sample")
+SAMPLE_METHODS = ("stratified", "cluster")
+
+MINHASH_PERMUTATIONS = 64
+SHINGLE_CHARS = 5
+MAX_BUCKET_SIZE = 256
+# Reservoir size per numeric column for medians and quartiles; exact below this many values
+STATS_SAMPLE_SIZE = 100000
+MODE_MAX_VALUES = 10000
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def parse_clean_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fill in defaults for the cleaning options and validate them, e.g.
+    {"missing": {"Age": "median", "City": "constant:Unknown", "*": "drop"},
+     "near_dup_threshold": 0.9, "text_columns": ["Name"], "group_columns": ["City"], "outliers": "iqr", "outlier_k": 1.5,
+     "llm": "sample", "sample": "cluster", "llm_max_rows": 200, "key": "id"}
+    """
+    params = dict(params or {})
+    missing = params.get("missing", "drop")
+    if isinstance(missing, str):
+        missing = {"*": missing}
+    missing = {"*": "drop", **missing}
+    for column, strategy in missing.items():
+        if strategy.split(":", 1)[0] not in MISSING_STRATEGIES:
+            raise ValueError(f"Unknown missing-value strategy for {column}: {strategy}")
+
+    outliers = params.get("outliers", "iqr")
+    if outliers not in OUTLIER_METHODS:
+        raise ValueError(f"outliers must be one of {', '.join(OUTLIER_METHODS)}")
+
+    llm = params.get("llm", "preview")
+    if llm not in LLM_MODES:
+        raise ValueError(f"llm must be one of {', '.join(LLM_MODES)}")
+    sample = params.get("sample", "stratified")
+    if sample not in SAMPLE_METHODS:
+        raise ValueError(f"sample must be one of {', '.join(SAMPLE_METHODS)}")
+
+    return {
+        "missing": missing,
+        "near_dup_threshold": float(params.get("near_dup_threshold", NEAR_DUP_THRESHOLD)),
+        "text_columns": params.get("text_columns"),
+        "group_columns": params.get("group_columns"),
+        "outliers": outliers,
+        "outlier_k": float(params.get("outlier_k", DEFAULT_OUTLIER_K.get(outliers, 0))),
+        "chunk_rows": int(params.get("chunk_rows", CLEAN_CHUNK_ROWS)),
+        "llm": llm,
+        "sample": sample,
+        "key": params.get("key"),
+        "strata": params.get("strata"),
+        "embed_model": params.get("embed_model"),
+        "llm_max_rows": int(params.get("llm_max_rows", LLM_CLEAN_MAX_ROWS)),
+        "llm_batch_tokens": int(params.get("llm_batch_tokens", LLM_CLEAN_BATCH_TOKENS)),
+        "llm_concurrency": int(params.get("llm_concurrency", LLM_CLEAN_CONCURRENCY)),
+    }
+
+
+def frame_chunks(df: pd.DataFrame, chunk_rows: int = CLEAN_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _text_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns if pd.api.types.is_string_dtype(df[c]) or df[c].dtype == object]
+
+
+class _ColumnStats:
+    """
+    Streaming statistics for one column: running moments and a uniform reservoir sample
+    for numeric columns, bounded value counts when the column is imputed with its mode.
+    """
+
+    def __init__(self, numeric: bool, rng: np.random.Generator, counts: bool = False):
+        self.numeric = numeric
+        self.counts = counts
+        self.rng = rng
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.sample = np.empty(0)
+        self.value_counts = pd.Series(dtype="int64")
+
+    def update(self, values: pd.Series):
+        values = values.dropna()
+        if values.empty:
+            return
+        if self.numeric:
+            array = values.to_numpy(dtype="float64")
+            self._sample(array)
+            self.total += array.sum()
+            self.total_sq += np.square(array).sum()
+        if self.counts:
+            self.value_counts = self.value_counts.add(values.value_counts(), fill_value=0)
+            if len(self.value_counts) > MODE_MAX_VALUES:
+                # Keep the most frequent values only; the mode of very high-cardinality columns is approximate
+                self.value_counts = self.value_counts.nlargest(MODE_MAX_VALUES)
+        self.count += len(values)
+
+    def _sample(self, array: np.ndarray):
+        # Vectorized reservoir sampling (Algorithm R): fill the reservoir, then each later
+        # value replaces a random slot with probability STATS_SAMPLE_SIZE / position
+        filled = max(0, min(STATS_SAMPLE_SIZE - len(self.sample), len(array)))
+        if filled:
+            self.sample = np.concatenate([self.sample, array[:filled]])
+        rest = array[filled:]
+        if not len(rest):
+            return
+        positions = self.count + filled + np.arange(len(rest))
+        slots = (self.rng.random(len(rest)) * (positions + 1)).astype(np.int64)
+        keep = slots < STATS_SAMPLE_SIZE
+        self.sample[slots[keep]] = rest[keep]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else float("nan")
+
+    @property
+    def std(self) -> float:
+        if self.count < 2:
+            return 0.0
+        return float(np.sqrt(max(self.total_sq / self.count - self.mean ** 2, 0.0)))
+
+    def quantile(self, q: float) -> float:
+        return float(np.quantile(self.sample, q)) if len(self.sample) else float("nan")
+
+    def mode(self) -> Any:
+        return self.value_counts.idxmax() if len(self.value_counts) else None
+
+
+class _NearDuplicateIndex:
+    """
+    MinHash signatures over character shingles, bucketed with LSH bands. Candidates that
+    share a band are confirmed by their estimated Jaccard similarity before a row is dropped.
+    """
+
+    def __init__(self, threshold: float, permutations: int = MINHASH_PERMUTATIONS, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.threshold = threshold
+        self.a = rng.integers(1, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+        self.bands, self.rows = _lsh_bands(threshold, permutations)
+        self.band_mixers = rng.integers(1, np.iinfo(np.uint64).max, self.rows, dtype=np.uint64)
+        self.buckets = [dict() for _ in range(self.bands)]
+        # Signatures of kept rows, grown by doubling so candidates can be compared in one step
+        self.signatures = np.empty((1024, permutations), dtype=np.uint64)
+        self.size = 0
+
+    def signatures_for(self, texts: List[str]) -> np.ndarray:
+        """
+        MinHash signature per text, shape (len(texts), permutations). Texts without shingles
+        get an all-max signature and are skipped by the caller.
+        """
+        all_shingles = []
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            shingles = {text[j:j + SHINGLE_CHARS] for j in range(max(len(text) - SHINGLE_CHARS + 1, 1))} if text else ()
+            lengths[i] = len(shingles)
+            all_shingles.extend(shingles)
+        # Keyed hash rather than hash(), which is salted per process, so signatures match across runs and workers
+        hashes = pd.util.hash_array(np.array(all_shingles, dtype=object)) & _MAX_HASH
+        signatures = np.full((len(texts), len(self.a)), _MAX_HASH, dtype=np.uint64)
+        present = lengths > 0
+        if not len(hashes):
+            return signatures
+        offsets = np.concatenate([[0], np.cumsum(lengths[present])[:-1]])
+        for p in range(len(self.a)):
+            permuted = ((self.a[p] * hashes + self.b[p]) % _MERSENNE_PRIME) & _MAX_HASH
+            signatures[present, p] = np.minimum.reduceat(permuted, offsets)
+        return signatures
+
+    def add_or_match(self, signatures: np.ndarray, groups: np.ndarray, skip: np.ndarray) -> np.ndarray:
+        """
+        Return a mask of rows that near-duplicate an earlier row (in this or a previous chunk);
+        the other rows are added to the index. Only rows in the same group (the fingerprint
+        of their group_columns, all zeros when there are none) can match.
+        """
+        band_keys = (signatures.reshape(len(signatures), self.bands, self.rows) * self.band_mixers).sum(axis=2)
+        band_keys ^= groups[:, None]
+        duplicate = np.zeros(len(signatures), dtype=bool)
+        for i in range(len(signatures)):
+            if skip[i]:
+                continue
+            keys = band_keys[i].tolist()
+            candidates = set()
+            for band, key in enumerate(keys):
+                candidates.update(self.buckets[band].get(key, ()))
+            if candidates:
+                candidate_ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                similarity = (self.signatures[candidate_ids] == signatures[i]).mean(axis=1)
+                if similarity.max() >= self.threshold:
+                    duplicate[i] = True
+                    continue
+            self._add(signatures[i], keys)
+        return duplicate
+
+    def _add(self, signature: np.ndarray, keys: List[int]):
+        if self.size == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        row_id = self.size
+        self.signatures[row_id] = signature
+        self.size += 1
+        for band, key in enumerate(keys):
+            bucket = self.buckets[band].setdefault(key, [])
+            # Very common band values (boilerplate text) stop growing, bounding the comparisons per row
+            if len(bucket) < MAX_BUCKET_SIZE:
+                bucket.append(row_id)
+
+
+def _lsh_bands(threshold: float, permutations: int):
+    """
+    Pick (bands, rows per band) whose LSH S-curve threshold (1/b)^(1/r) lies just below
+    the similarity threshold, so true near-duplicates almost always share a band.
+    """
+    options = [(b, permutations // b) for b in range(1, permutations + 1) if permutations % b == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold * 0.9]
+    if not below:
+        return options[-1]
+    return max(below, key=lambda option: (1 / option[0]) ** (1 / option[1]))
+
+
+class CleaningEngine:
+    """
+    Chunked cleaning: exact dedup with a set of row fingerprints, near-duplicate removal
+    with MinHash/LSH over text columns, per-column missing-value strategies and outlier
+    flagging. Statistics for imputation and outliers come from a first streaming pass,
+    so only the fingerprints and signatures are kept in memory, never the data itself.
+    """
+
+    def __init__(self, params: Optional[Dict[str, Any]] = None):
+        self.config = parse_clean_params(params)
+        self.stats: Dict[str, _ColumnStats] = {}
+        self.fitted_rows = 0
+        self.seen_fingerprints = set()
+        self.near_duplicates = None
+        self.report = {
+            "initial_rows": 0, "exact_duplicates": 0, "near_duplicates": 0, "dropped_missing": 0,
+            "imputed": {}, "outliers": {}, "final_rows": 0, "chunks": 0, "seconds": 0.0,
+        }
+
+    def run(self, make_chunks: Callable[[], Iterable[pd.DataFrame]]) -> Iterator[pd.DataFrame]:
+        """
+        Clean the chunks produced by make_chunks and yield the cleaned chunks. make_chunks is
+        called twice when imputation or outlier statistics are needed (one pass to fit them),
+        unless it produced a single chunk, which is then cleaned without being read again.
+        """
+        start = time.perf_counter()
+        chunks = None
+        if self._needs_stats():
+            first, count = None, 0
+            for chunk in make_chunks():
+                self._fit(chunk)
+                # Hold on to the first chunk only: most frames fit in one
+                first, count = (chunk if count == 0 else None), count + 1
+            if count == 1:
+                chunks = [first]
+        for chunk in chunks if chunks is not None else make_chunks():
+            cleaned = self._transform(chunk)
+            self.report["seconds"] = round(time.perf_counter() - start, 3)
+            if len(cleaned):
+                yield cleaned
+
+    def _needs_stats(self) -> bool:
+        strategies = {strategy.split(":", 1)[0] for strategy in self.config["missing"].values()}
+        return bool(strategies & {"mean", "median", "mode"}) or self.config["outliers"] != "none"
+
+    def _fit(self, chunk: pd.DataFrame):
+        if not self.fitted_rows:
+            self.stats = self._stat_columns(chunk)
+        for column, stats in self.stats.items():
+            stats.update(chunk[column])
+        self.fitted_rows += len(chunk)
+
+    def _stat_columns(self, chunk: pd.DataFrame) -> Dict[str, _ColumnStats]:
+        """
+        Statistics to collect: moments and quantiles for numeric columns imputed with their
+        mean or median or checked for outliers, value counts only for columns imputed with their mode.
+        """
+        rng = np.random.default_rng(0)
+        stats = {}
+        for column in chunk.columns:
+            strategy = self._strategy(column).split(":", 1)[0]
+            numeric = pd.api.types.is_numeric_dtype(chunk[column]) and not pd.api.types.is_bool_dtype(chunk[column])
+            needs_moments = numeric and (strategy in ("mean", "median") or self.config["outliers"] != "none")
+            if needs_moments or strategy == "mode":
+                stats[column] = _ColumnStats(numeric, rng, counts=strategy == "mode")
+        return stats
+
+    def _transform(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        report = self.report
+        report["chunks"] += 1
+        report["initial_rows"] += len(chunk)
+
+        # 1. Exact duplicates, within the chunk and against every earlier chunk
+        fingerprints = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        seen = self.seen_fingerprints
+        keep = ~pd.Series(fingerprints).duplicated().to_numpy()
+        keep &= np.fromiter((f not in seen for f in fingerprints.tolist()), dtype=bool, count=len(fingerprints))
+        seen.update(fingerprints[keep].tolist())
+        report["exact_duplicates"] += int((~keep).sum())
+        chunk = chunk[keep]
+
+        # 2. Near duplicates: similar text columns, and identical group columns if any are given
+        threshold = self.config["near_dup_threshold"]
+        text_columns = [c for c in self.config["text_columns"] or _text_columns(chunk) if c in chunk.columns]
+        if 0 < threshold < 1 and text_columns and len(chunk):
+            if self.near_duplicates is None:
+                self.near_duplicates = _NearDuplicateIndex(threshold)
+            # Cast before filling: categoricals cannot take "" unless it is one of their categories
+            texts = chunk[text_columns[0]].astype(str).fillna("")
+            for column in text_columns[1:]:
+                texts = texts + " " + chunk[column].astype(str).fillna("")
+            texts = texts.str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+            group_columns = [c for c in self.config["group_columns"] or () if c in chunk.columns]
+            groups = pd.util.hash_pandas_object(chunk[group_columns], index=False).to_numpy() if group_columns \
+                else np.zeros(len(chunk), dtype=np.uint64)
+            signatures = self.near_duplicates.signatures_for(texts.tolist())
+            duplicate = self.near_duplicates.add_or_match(signatures, groups, (texts == "").to_numpy())
+            report["near_duplicates"] += int(duplicate.sum())
+            chunk = chunk[~duplicate]
+
+        # 3. Missing values: drop rows missing a "drop" column, then impute the rest
+        chunk = self._handle_missing(chunk)
+
+        # 4. Outliers are flagged, not removed
+        if self.config["outliers"] != "none" and len(chunk):
+            chunk = self._flag_outliers(chunk)
+
+        report["final_rows"] += len(chunk)
+        return chunk
+
+    def _strategy(self, column) -> str:
+        return self.config["missing"].get(column, self.config["missing"]["*"])
+
+    def _handle_missing(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        drop_columns = [c for c in chunk.columns if self._strategy(c) == "drop"]
+        if drop_columns:
+            missing = chunk[drop_columns].isna().any(axis=1)
+            self.report["dropped_missing"] += int(missing.sum())
+            chunk = chunk[~missing]
+
+        fills = {}
+        for column in chunk.columns:
+            strategy = self._strategy(column)
+            if strategy in ("drop", "keep"):
+                continue
+            count = int(chunk[column].isna().sum())
+            if not count:
+                continue
+            value = self._fill_value(column, strategy, chunk[column])
+            if value is None:
+                continue
+            fills[column] = value
+            self.report["imputed"][column] = self.report["imputed"].get(column, 0) + count
+        categorical = {column: chunk[column].cat.add_categories([value]) for column, value in fills.items()
+                       if isinstance(chunk[column].dtype, pd.CategoricalDtype) and value not in chunk[column].cat.categories}
+        if categorical:
+            # Compact categorical columns (see ingest.compact_frame) only take fill values among their categories
+            chunk = chunk.assign(**categorical)
+        return chunk.fillna(fills) if fills else chunk
+
+    def _fill_value(self, column, strategy: str, values: pd.Series) -> Any:
+        name, _, constant = strategy.partition(":")
+        if name == "constant":
+            if pd.api.types.is_numeric_dtype(values):
+                return pd.to_numeric(constant)
+            return constant
+        stats = self.stats.get(column)
+        if stats is None or (name in ("mean", "median") and not stats.numeric):
+            return None
+        value = stats.mean if name == "mean" else stats.quantile(0.5) if name == "median" else stats.mode()
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if pd.api.types.is_integer_dtype(values) and name != "mode":
+            value = int(round(value))
+        return value
+
+    def _flag_outliers(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        k = self.config["outlier_k"]
+        flags = np.zeros(len(chunk), dtype=bool)
+        for column, stats in self.stats.items():
+            if not stats.numeric or column not in chunk.columns or not stats.count:
+                continue
+            if self.config["outliers"] == "iqr":
+                q1, q3 = stats.quantile(0.25), stats.quantile(0.75)
+                low, high = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+            else:
+                low, high = stats.mean - k * stats.std, stats.mean + k * stats.std
+            values = chunk[column].to_numpy(dtype="float64", na_value=np.nan)
+            column_flags = (values < low) | (values > high)
+            if column_flags.any():
+                self.report["outliers"][column] = self.report["outliers"].get(column, 0) + int(column_flags.sum())
+                flags |= column_flags
+        if OUTLIER_COLUMN in chunk.columns:
+            # Already flagged (e.g. cleaning a cleaned file again): keep those flags as well
+            existing = chunk[OUTLIER_COLUMN]
+            if pd.api.types.is_bool_dtype(existing):
+                flags |= existing.fillna(False).to_numpy(dtype=bool)
+            else:
+                flags |= existing.astype(str).str.strip().str.lower().isin(("true", "1", "yes")).to_numpy()
+        return chunk.assign(**{OUTLIER_COLUMN: flags})
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Per-step counts as the bullet lines used in the clean stage summary.
+    """
+    lines = [
+        f"- Initial rows: {report['initial_rows']}",
+        f"- Removed duplicates: {report['exact_duplicates']}",
+        f"- Removed near-duplicates: {report['near_duplicates']}",
+        f"- Removed rows with missing values: {report['dropped_missing']}",
+    ]
+    if report["imputed"]:
+        lines.append("- Imputed values: " + ", ".join(f"{c}={n}" for c, n in report["imputed"].items()))
+    if report["outliers"]:
+        lines.append("- Flagged outliers: " + ", ".join(f"{c}={n}" for c, n in report["outliers"].items()))
+    return "\n".join(lines) + "\n"
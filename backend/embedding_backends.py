@@ -0,0 +1,146 @@
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from lazy_imports import load_module
+
+# Inference backends for the embedding model: PyTorch in fp32, PyTorch with its Linear layers
+# dynamically quantized to int8, or ONNX Runtime with the fp32 or int8-quantized ONNX export
+# (the ONNX ones need `pip install sentence-transformers[onnx]`)
+EMBED_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+# Threads per inference call (0 keeps the library default, usually one per core)
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+# Padded tokens per batch: texts are sorted by length and short ones go in larger batches (0 turns it off).
+# Small batches are faster on CPU (they stay in cache); large ones suit GPUs
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "2048"))
+# int8-quantized ONNX file within the model repository, for the onnx_int8 backend
+EMBED_ONNX_INT8_FILE = os.getenv("EMBED_ONNX_INT8_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+# Rows also encoded with the fp32 torch backend to report agreement and speedup (0 turns it off)
+EMBED_COMPARE_ROWS = int(os.getenv("EMBED_COMPARE_ROWS", "256"))
+
+# Upper bound on rows per batch however short the texts are
+MAX_BATCH_ROWS = 1024
+# Rough characters per token, to size batches without tokenizing every text twice
+CHARS_PER_TOKEN = 4
+REFERENCE_BACKEND = "torch"
+
+
+def load_model(model_name: str, device: str, backend: str):
+    """
+    Load a SentenceTransformer model for one of EMBED_BACKENDS.
+    """
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    SentenceTransformer = load_module("sentence_transformers").SentenceTransformer
+    if backend.startswith("onnx"):
+        try:
+            ort = load_module("onnxruntime")
+        except ImportError as e:
+            raise RuntimeError(f"The {backend} backend needs `pip install sentence-transformers[onnx]`") from e
+        options = ort.SessionOptions()
+        if EMBED_THREADS:
+            options.intra_op_num_threads = EMBED_THREADS
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        if backend == "onnx_int8":
+            model_kwargs["file_name"] = EMBED_ONNX_INT8_FILE
+        return SentenceTransformer(model_name, device=device, backend="onnx", model_kwargs=model_kwargs)
+
+    torch = load_module("torch")
+    if EMBED_THREADS and torch.get_num_threads() != EMBED_THREADS:
+        # Process-wide: applies to every torch model in this worker
+        torch.set_num_threads(EMBED_THREADS)
+    model = SentenceTransformer(model_name, device=device)
+    if backend == "torch_int8":
+        if device != "cpu":
+            raise ValueError("The torch_int8 backend runs on CPU only")
+        # int8 weights and activations for the Linear layers (most of a transformer's compute), on CPU
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def cache_model_name(model_name: str, backend: str) -> str:
+    """
+    Name vectors are cached under in the embedding cache. Vectors from another backend differ
+    slightly, so they are kept apart from the fp32 reference ones.
+    """
+    return model_name if backend == REFERENCE_BACKEND else f"{model_name}:{backend}"
+
+
+def length_batches(texts: List[str], batch_size: int, batch_tokens: int = EMBED_BATCH_TOKENS,
+                   max_seq_length: Optional[int] = None) -> List[np.ndarray]:
+    """
+    Split text positions into batches of similar length, longest first, so little of each
+    batch is padding. With batch_tokens set, a batch holds as many rows as fit in that many
+    padded tokens (its longest text times rows, up to MAX_BATCH_ROWS); otherwise batch_size rows.
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(-lengths, kind="stable")
+    if not batch_tokens:
+        return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    tokens = lengths // CHARS_PER_TOKEN + 2
+    if max_seq_length:
+        tokens = np.minimum(tokens, max_seq_length)
+    batches = []
+    start = 0
+    while start < len(order):
+        rows = int(min(max(batch_tokens // tokens[order[start]], 1), MAX_BATCH_ROWS))
+        batches.append(order[start:start + rows])
+        start += rows
+    return batches
+
+
+def encode_batches(model, texts: List[str], batches: List[np.ndarray],
+                   on_progress: Optional[Callable[[int], None]] = None) -> np.ndarray:
+    """
+    Encode texts batch by batch (see length_batches) into one float32 array in input order.
+    on_progress(rows done) is called about every 5% of the batches.
+    """
+    vectors = None
+    done = 0
+    report_every = max(len(batches) // 20, 1)
+    for number, batch in enumerate(batches, 1):
+        # Progress goes through on_progress; the library's own bar would print one line per batch
+        encoded = model.encode([texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False)
+        encoded = np.asarray(encoded, dtype=np.float32)
+        if vectors is None:
+            vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[batch] = encoded
+        done += len(batch)
+        if on_progress and (number % report_every == 0 or number == len(batches)):
+            on_progress(done)
+    return vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+
+
+def compare_backends(encode: Callable[[List[str]], np.ndarray], reference: Callable[[List[str]], np.ndarray],
+                     texts: List[str]) -> Dict[str, Any]:
+    """
+    Encode a sample with a backend and with the fp32 reference. Returns the cosine agreement of
+    their vectors (mean and minimum over rows) and the backend's speedup over the reference.
+    """
+    # Once unmeasured, so neither side pays for first-call setup in the timing
+    encode(texts[:1])
+    reference(texts[:1])
+    start = time.perf_counter()
+    vectors = encode(texts)
+    seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = reference(texts)
+    reference_seconds = time.perf_counter() - start
+    cosine = np.sum(_normalize(vectors) * _normalize(expected), axis=1)
+    return {
+        "rows": len(texts),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        "rows_per_second": round(len(texts) / seconds, 1) if seconds > 0 else None,
+        "reference_rows_per_second": round(len(texts) / reference_seconds, 1) if reference_seconds > 0 else None,
+        "speedup": round(reference_seconds / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from storage import data_path
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+# Eviction trims the cache to this fraction of max_entries, so it does not run on every insert
+EVICT_TO_FRACTION = 0.9
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before hashing so whitespace-only edits still hit the cache.
+    """
+    return " ".join(str(text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, hash of the normalized text).
+    Vectors are stored as float32 blobs in SQLite and evicted least-recently-used
+    first once the cache grows past max_entries.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH") or data_path("embedding_cache.sqlite3")
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "5000000"))
+        self._lock = threading.Lock()
+        # Upper bound on the entry count: counted once, then advanced by every insert
+        # (replacements overcount), so the table is only counted again when it may be over budget
+        self._count_bound: Optional[int] = None
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model_name: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached vectors for the given hashes. Missing hashes are absent from the result.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(hashes), _SQL_BATCH):
+                chunk = hashes[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model_name, *chunk],
+                ).fetchall()
+                hit = [h for h, _ in rows]
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+                if hit:
+                    # One statement per batch of hits
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND hash IN ({','.join('?' * len(hit))})",
+                        [now, model_name, *hit],
+                    )
+            if found:
+                self._conn.commit()
+        return found
+
+    def put_many(self, model_name: str, items: List[Tuple[str, np.ndarray]]):
+        """
+        Store vectors for the given hashes and evict the oldest entries if over budget.
+        """
+        now = time.time()
+        rows = [
+            (model_name, h, int(vec.shape[0]), np.asarray(vec, dtype=np.float32).tobytes(), now)
+            for h, vec in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, dim, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if self._count_bound is None:
+                self._count_bound = self._count_locked()
+            else:
+                self._count_bound += len(rows)
+            if self._count_bound > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def encode(self, encode_fn: Callable[[List[str]], np.ndarray], model_name: str,
+               texts: List[str]) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """
+        Return embeddings for texts, only sending cache misses to encode_fn in one batched call.
+        Identical texts within one call are encoded once.
+        """
+        hashes = [text_hash(t) for t in texts]
+        cached = self.get_many(model_name, list(set(hashes)))
+
+        # Encode each distinct missing text once
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        encode_seconds = 0.0
+        if missing:
+            start = time.perf_counter()
+            new_vectors = encode_fn(list(missing.values()))
+            encode_seconds = time.perf_counter() - start
+            new_vectors = np.asarray(new_vectors, dtype=np.float32)
+            new_items = list(zip(missing.keys(), new_vectors))
+            self.put_many(model_name, new_items)
+            cached.update(new_items)
+
+        embeddings = np.vstack([cached[h] for h in hashes]) if hashes else np.zeros((0, 0), dtype=np.float32)
+        hits = sum(1 for h in hashes if h not in missing)
+        stats = {
+            "hits": hits,
+            "misses": len(hashes) - hits,
+            "encoded": len(missing),
+            "encode_seconds": encode_seconds,
+        }
+        return embeddings, stats
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count_bound = 0
+
+    def _count_locked(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _evict_locked(self):
+        count = self._count_locked()
+        if count > self.max_entries:
+            overflow = count - int(self.max_entries * EVICT_TO_FRACTION)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+            count -= overflow
+        self._count_bound = count
+
+
+# Global instance of the embedding cache, opened on first use
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
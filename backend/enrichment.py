@@ -0,0 +1,404 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import pandas as pd
+
+from cerebras_client import RETRY_STATUS_CODES, TokenBucket
+from progress import ProgressCallback, current_reporter
+from storage import data_path
+from lazy_imports import lazy_import
+
+# Imported on first use (or at startup via PRELOAD_MODULES)
+httpx = lazy_import("httpx")
+
+logger = logging.getLogger(__name__)
+
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "8"))
+ENRICH_RATE_PER_SEC = float(os.getenv("ENRICH_RATE_PER_SEC", "5"))
+ENRICH_MAX_RETRIES = int(os.getenv("ENRICH_MAX_RETRIES", "2"))
+ENRICH_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT", "10"))
+ENRICH_CACHE_TTL = float(os.getenv("ENRICH_CACHE_TTL", str(7 * 86400)))
+# Distinct values looked up per column (the most frequent ones when a column has more)
+ENRICH_MAX_VALUES = int(os.getenv("ENRICH_MAX_VALUES", "1000"))
+DEFAULT_QUERY = "{value} {column}"
+CONTEXT_CHARS = 300
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class SearchBackend:
+    """
+    One web search API. search() returns {"context", "source"} for the top result,
+    None when there is no result, and raises on request failures.
+    """
+    name = "base"
+    # Remote APIs go through the shared rate limit and retries; local backends skip both
+    rate_limited = True
+
+    async def search(self, http: "httpx.AsyncClient", query: str) -> Optional[Dict[str, str]]:
+        raise NotImplementedError
+
+
+class ExaBackend(SearchBackend):
+    name = "exa"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def search(self, http: "httpx.AsyncClient", query: str) -> Optional[Dict[str, str]]:
+        response = await http.post(
+            "https://api.exa.ai/search",
+            headers={"x-api-key": self.api_key},
+            json={"query": query, "numResults": 1, "contents": {"text": {"maxCharacters": CONTEXT_CHARS}}},
+        )
+        response.raise_for_status()
+        results = response.json().get("results") or []
+        if not results:
+            return None
+        return {"context": results[0].get("text") or results[0].get("title") or "", "source": results[0].get("url")}
+
+
+class SerperBackend(SearchBackend):
+    name = "serper"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def search(self, http: "httpx.AsyncClient", query: str) -> Optional[Dict[str, str]]:
+        response = await http.post(
+            "https://google.serper.dev/search",
+            headers={"X-API-KEY": self.api_key},
+            json={"q": query, "num": 1},
+        )
+        response.raise_for_status()
+        body = response.json()
+        graph = body.get("knowledgeGraph") or {}
+        if graph.get("description"):
+            return {"context": graph["description"], "source": graph.get("descriptionLink") or graph.get("website")}
+        organic = body.get("organic") or []
+        if not organic:
+            return None
+        return {"context": organic[0].get("snippet") or organic[0].get("title") or "", "source": organic[0].get("link")}
+
+
+class BraveBackend(SearchBackend):
+    name = "brave"
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def search(self, http: "httpx.AsyncClient", query: str) -> Optional[Dict[str, str]]:
+        response = await http.get(
+            "https://api.search.brave.com/res/v1/web/search",
+            headers={"X-Subscription-Token": self.api_key, "Accept": "application/json"},
+            params={"q": query, "count": 1},
+        )
+        response.raise_for_status()
+        results = (response.json().get("web") or {}).get("results") or []
+        if not results:
+            return None
+        return {"context": results[0].get("description") or results[0].get("title") or "", "source": results[0].get("url")}
+
+
+class StubBackend(SearchBackend):
+    """
+    Offline backend with deterministic results, for tests and environments without a search API key.
+    ENRICH_STUB_LATENCY adds a simulated per-lookup delay in seconds.
+    """
+    name = "stub"
+    rate_limited = False
+
+    def __init__(self, latency: Optional[float] = None):
+        self.latency = latency if latency is not None else float(os.getenv("ENRICH_STUB_LATENCY", "0"))
+
+    async def search(self, http: "httpx.AsyncClient", query: str) -> Optional[Dict[str, str]]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {"context": f"Search results for '{query}' (offline stub)", "source": f"https://example.com/search?q={quote(query)}"}
+
+
+BACKENDS = ("stub", "exa", "serper", "brave")
+
+
+def make_backend(name: Optional[str] = None) -> SearchBackend:
+    """
+    The named backend, or by default the first one with an API key configured (else the stub).
+    """
+    name = name or os.getenv("ENRICH_BACKEND")
+    keys = {"exa": os.getenv("EXA_API_KEY"), "serper": os.getenv("SERPER_API_KEY"), "brave": os.getenv("BRAVE_API_KEY")}
+    if name is None:
+        name = next((backend for backend, key in keys.items() if key), "stub")
+    if name not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    if name == "stub":
+        return StubBackend()
+    if not keys[name]:
+        raise ValueError(f"{name.upper()}_API_KEY is not set")
+    return {"exa": ExaBackend, "serper": SerperBackend, "brave": BraveBackend}[name](keys[name])
+
+
+def parse_enrich_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fill in defaults for the enrichment options and validate them, e.g.
+    {"columns": ["City", "Occupation"], "backend": "stub", "query": "{value} {column}"}
+    """
+    params = dict(params or {})
+    columns = params.get("columns")
+    if isinstance(columns, str):
+        columns = [c.strip() for c in columns.split(",") if c.strip()]
+    backend = params.get("backend")
+    if backend is not None and backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    query = params.get("query", DEFAULT_QUERY)
+    if "{value}" not in query:
+        raise ValueError("query must contain {value}")
+    return {
+        "columns": columns,
+        "backend": backend,
+        "query": query,
+        "max_values": int(params.get("max_values", ENRICH_MAX_VALUES)),
+        "concurrency": int(params.get("concurrency", ENRICH_CONCURRENCY)),
+    }
+
+
+def choose_columns(df: pd.DataFrame, max_values: int) -> List[str]:
+    """
+    Default columns to enrich: text columns with at most max_values distinct values
+    (categories, places, job titles), else the text column with the fewest.
+    """
+    candidates = []
+    for column in df.columns:
+        if pd.api.types.is_string_dtype(df[column]) or df[column].dtype == object:
+            candidates.append((df[column].nunique(), column))
+    chosen = [column for unique, column in candidates if 0 < unique <= max_values]
+    if not chosen and candidates:
+        chosen = [min(candidates, key=lambda c: c[0])[1]]
+    return chosen
+
+
+class EnrichmentCache:
+    """
+    Persistent lookup cache keyed by (backend, normalized query) with a TTL. Queries without
+    a result are cached too, so they are not searched again; failed lookups are not cached.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl_seconds: Optional[float] = None):
+        self.path = path or data_path("enrich_cache.sqlite3")
+        self.ttl_seconds = ttl_seconds or ENRICH_CACHE_TTL
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookups ("
+            " key TEXT PRIMARY KEY, result TEXT, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(backend: str, query: str) -> str:
+        normalized = " ".join(query.lower().split())
+        return hashlib.sha256(f"{backend}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[Dict[str, str]]]:
+        found = {}
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH):
+                chunk = keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, result FROM lookups WHERE key IN ({placeholders}) AND created >= ?",
+                    [*chunk, cutoff],
+                ).fetchall()
+                for key, result in rows:
+                    found[key] = json.loads(result) if result is not None else None
+        return found
+
+    def put_many(self, items: List[Tuple[str, Optional[Dict[str, str]]]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO lookups (key, result, created) VALUES (?, ?, ?)",
+                [(key, json.dumps(result) if result is not None else None, now) for key, result in items],
+            )
+            self._conn.execute("DELETE FROM lookups WHERE created < ?", (now - self.ttl_seconds,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM lookups")
+            self._conn.commit()
+
+
+class EnrichmentClient:
+    """
+    Runs search lookups concurrently (bounded and rate limited) on one background event
+    loop, like the Cerebras client, so every request shares the same connections and limits.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, rate_per_second: Optional[float] = None):
+        self.max_concurrency = max_concurrency or ENRICH_CONCURRENCY
+        self.rate_per_second = rate_per_second if rate_per_second is not None else ENRICH_RATE_PER_SEC
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._bucket: Optional[TokenBucket] = None
+        self._cache: Optional[EnrichmentCache] = None
+
+    async def alookup_many(self, backend: SearchBackend, queries: List[str], concurrency: Optional[int] = None,
+                           progress: Optional[ProgressCallback] = None) -> Tuple[Dict[str, Optional[Dict[str, str]]], Dict[str, Any]]:
+        """
+        Look up each distinct query once, from the cache where possible, calling progress (from
+        the client's loop) as searches complete.
+        Returns ({query: result or None}, stats); failed queries are absent from the results.
+        """
+        coro = self._lookup_many(backend, queries, concurrency, progress)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()))
+
+    async def _lookup_many(self, backend: SearchBackend, queries: List[str], concurrency: Optional[int],
+                           progress: Optional[ProgressCallback]) -> Tuple[Dict[str, Optional[Dict[str, str]]], Dict[str, Any]]:
+        queries = list(dict.fromkeys(queries))
+        keys = {query: EnrichmentCache.key(backend.name, query) for query in queries}
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self._cache.get_many, list(keys.values()))
+        results = {query: cached[keys[query]] for query in queries if keys[query] in cached}
+        missing = [query for query in queries if query not in results]
+
+        limit = asyncio.Semaphore(concurrency or self.max_concurrency)
+        errors = []
+        done = 0
+        # Report about every 5% of the searches
+        report_every = max(len(missing) // 20, 1)
+
+        async def lookup(query: str):
+            nonlocal done
+            async with limit, self._semaphore:
+                try:
+                    return query, await self._search_with_retries(backend, query)
+                except Exception as e:
+                    errors.append(str(e) or type(e).__name__)
+                    return query, False
+                finally:
+                    done += 1
+                    if progress and (done % report_every == 0 or done == len(missing)):
+                        progress({"phase": "lookups", "rows": done, "total": len(missing)})
+
+        found = []
+        for query, result in await asyncio.gather(*(lookup(query) for query in missing)):
+            if result is not False:
+                results[query] = result
+                found.append((keys[query], result))
+        if found:
+            await loop.run_in_executor(None, self._cache.put_many, found)
+
+        stats = {"queries": len(queries), "cache_hits": len(cached), "lookups": len(missing),
+                 "failed": len(missing) - len(found), "errors": sorted(set(errors))}
+        return results, stats
+
+    async def _search_with_retries(self, backend: SearchBackend, query: str) -> Optional[Dict[str, str]]:
+        if not backend.rate_limited:
+            return await backend.search(self._http, query)
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            try:
+                return await backend.search(self._http, query)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES or attempt >= ENRICH_MAX_RETRIES:
+                    raise
+            except httpx.TransportError:
+                if attempt >= ENRICH_MAX_RETRIES:
+                    raise
+            delay = 0.5 * (2 ** attempt)
+            logger.warning("Search request failed, retrying in %.2fs (attempt %d)", delay, attempt + 1)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def clear_cache(self):
+        """
+        Drop every cached lookup, e.g. so benchmark repeats search again.
+        """
+        self._ensure_loop()
+        self._cache.clear()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="enrichment-client", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _setup(self):
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=ENRICH_TIMEOUT,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(self.rate_per_second)
+        self._cache = EnrichmentCache()
+
+
+async def enrich_frame(df: pd.DataFrame, columns: List[str], backend: SearchBackend,
+                       config: Dict[str, Any]) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Look up the distinct values of each column once and join the results back onto df as
+    <column>_context and <column>_source columns. Returns (df with the new columns, report).
+    """
+    start = time.perf_counter()
+    queries = {}
+    skipped = 0
+    for column in columns:
+        counts = df[column].dropna().astype(str).str.strip()
+        counts = counts[counts != ""].value_counts()
+        skipped += max(len(counts) - config["max_values"], 0)
+        for value in counts.index[:config["max_values"]]:
+            queries[(column, value)] = config["query"].format(value=value, column=column)
+
+    results, stats = await enrichment_client.alookup_many(backend, list(queries.values()), config["concurrency"],
+                                                          current_reporter())
+
+    added = {}
+    for column in columns:
+        values = df[column].astype("string").str.strip()
+        mapping = {value: results.get(query) for (name, value), query in queries.items() if name == column}
+        added[f"{column}_context"] = values.map({v: r["context"] for v, r in mapping.items() if r}).astype("string")
+        added[f"{column}_source"] = values.map({v: r["source"] for v, r in mapping.items() if r}).astype("string")
+    # The original columns are shared with df (copy-on-write), only the new ones are allocated
+    enriched = df.assign(**added)
+
+    report = {"backend": backend.name, "columns": columns, "distinct_values": len(queries),
+              "skipped_values": skipped, "seconds": round(time.perf_counter() - start, 3), **stats}
+    return enriched, report
+
+
+def format_enrich_report(report: Dict[str, Any]) -> str:
+    """
+    Lookup counts as bullet lines for the enrich stage summary.
+    """
+    lines = [
+        f"- Search backend: {report['backend']}",
+        f"- Distinct values looked up: {report['distinct_values']} "
+        f"({report['cache_hits']} cached, {report['lookups']} searched, {report['failed']} failed)",
+    ]
+    if report["skipped_values"]:
+        lines.append(f"- Values not looked up (over the per-column limit): {report['skipped_values']}")
+    lines.append(f"- Lookup time: {report['seconds']}s")
+    for error in report["errors"]:
+        lines.append(f"- Error: {error}")
+    return "\n".join(lines) + "\n"
+
+
+# Global instance of the enrichment client
+enrichment_client = EnrichmentClient()
@@ -0,0 +1,348 @@
+import asyncio
+import math
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cerebras_client import cerebras_client
+from llm_cleaning import parse_csv_response
+from prompt_templates import CompiledTemplate, estimate_tokens
+
+GENERATE_CALL_TOKENS = int(os.getenv("GENERATE_CALL_TOKENS", "2000"))
+GENERATE_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", "8"))
+# "auto" mode asks the LLM for up to this many rows and samples locally beyond it
+GENERATE_LLM_MAX_ROWS = int(os.getenv("GENERATE_LLM_MAX_ROWS", "5000"))
+GENERATE_MAX_ROWS = int(os.getenv("GENERATE_MAX_ROWS", "10000000"))
+GENERATE_CHUNK_ROWS = int(os.getenv("GENERATE_CHUNK_ROWS", "50000"))
+GENERATE_MAX_ROUNDS = 3
+
+GENERATE_MODES = ("auto", "llm", "local")
+CATEGORY_MAX_VALUES = 50
+FIT_SAMPLE_ROWS = 100000
+TEXT_VOCAB_SIZE = 5000
+# Extra rows requested from the LLM to make up for invalid and duplicate rows
+OVERSAMPLE = 1.1
+
+# Used when no file is uploaded: the columns of the original example output, with enough
+# distinct names, cities and occupations for the local sampler to produce millions of unique rows
+_FIRST_NAMES = ["John", "Jane", "Bob", "Alice", "Charlie", "Maria", "David", "Sofia", "James", "Emma",
+                "Liam", "Olivia", "Noah", "Ava", "Lucas", "Mia", "Ethan", "Chloe", "Mateo", "Aisha"]
+_LAST_NAMES = ["Doe", "Smith", "Johnson", "Brown", "Davis", "Garcia", "Miller", "Wilson", "Moore", "Taylor",
+               "Anderson", "Thomas", "Lee", "Martin", "Clark", "Lewis", "Walker", "Young", "Khan", "Singh"]
+_CITIES = ["New York", "London", "Paris", "Tokyo", "Sydney", "Berlin", "Toronto", "Madrid", "Mumbai", "Seoul",
+           "Chicago", "Dublin", "Rome", "Lisbon", "Austin", "Vienna", "Oslo", "Cairo", "Lima", "Nairobi"]
+_OCCUPATIONS = ["Engineer", "Doctor", "Teacher", "Designer", "Accountant", "Nurse", "Lawyer", "Chef", "Pilot",
+                "Writer", "Analyst", "Architect", "Pharmacist", "Electrician", "Photographer", "Scientist",
+                "Plumber", "Manager", "Developer", "Consultant"]
+_DEFAULT_ROWS = len(_FIRST_NAMES) * len(_LAST_NAMES)
+DEFAULT_SAMPLE = pd.DataFrame({
+    "Name": [f"{_FIRST_NAMES[i % 20]} {_LAST_NAMES[(i + i // 20) % 20]}" for i in range(_DEFAULT_ROWS)],
+    "Age": [18 + (i * 7) % 48 for i in range(_DEFAULT_ROWS)],
+    "City": [_CITIES[(i * 3) % 20] for i in range(_DEFAULT_ROWS)],
+    "Occupation": [_OCCUPATIONS[(i * 11) % 20] for i in range(_DEFAULT_ROWS)],
+})
+
+
+def parse_generate_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fill in defaults for the generation options and validate them, e.g.
+    {"mode": "local", "count": 50000, "seed": 7, "concurrency": 8}
+    """
+    params = dict(params or {})
+    mode = params.get("mode", "auto")
+    if mode not in GENERATE_MODES:
+        raise ValueError(f"mode must be one of {', '.join(GENERATE_MODES)}")
+    count = params.get("count")
+    return {
+        "mode": mode,
+        "count": min(int(count), GENERATE_MAX_ROWS) if count is not None else None,
+        "seed": int(params.get("seed", 0)),
+        "concurrency": int(params.get("concurrency", GENERATE_CONCURRENCY)),
+        "call_tokens": int(params.get("call_tokens", GENERATE_CALL_TOKENS)),
+        "chunk_rows": int(params.get("chunk_rows", GENERATE_CHUNK_ROWS)),
+    }
+
+
+def infer_schema(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Column kinds, null fractions and fitted value distributions of df, used both to
+    validate LLM output and to drive the local sampler.
+    """
+    if len(df) > FIT_SAMPLE_ROWS:
+        df = df.sample(n=FIT_SAMPLE_ROWS, random_state=0)
+    columns = []
+    for name in df.columns:
+        values = df[name]
+        present = values.dropna()
+        column = {"name": str(name), "null_fraction": float(values.isna().mean()) if len(values) else 0.0}
+        if pd.api.types.is_bool_dtype(values):
+            column.update(kind="bool", p_true=float(present.astype(bool).mean()) if len(present) else 0.5)
+        elif pd.api.types.is_integer_dtype(values) or pd.api.types.is_float_dtype(values):
+            kind = "int" if pd.api.types.is_integer_dtype(values) else "float"
+            column.update(kind=kind, quantiles=_quantiles(present.to_numpy(dtype="float64")))
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            column.update(kind="datetime", quantiles=_quantiles(present.astype("int64").to_numpy(dtype="float64")))
+        else:
+            present = present.astype(str)
+            counts = present.value_counts(normalize=True)
+            if len(counts) <= CATEGORY_MAX_VALUES:
+                column.update(kind="category", values=counts.index.tolist(), probs=counts.to_numpy().tolist())
+            else:
+                words = present.str.split()
+                vocab = words.explode().value_counts(normalize=True).head(TEXT_VOCAB_SIZE)
+                lengths = words.str.len().value_counts(normalize=True)
+                column.update(kind="text", vocab=vocab.index.tolist(), vocab_probs=(vocab / vocab.sum()).tolist(),
+                              lengths=lengths.index.astype(int).tolist(), length_probs=lengths.to_numpy().tolist())
+        columns.append(column)
+    return {"columns": columns, "sample_csv": df.head(5).to_csv(index=False)}
+
+
+def _quantiles(values: np.ndarray) -> List[float]:
+    if not len(values):
+        return [0.0, 0.0]
+    return np.quantile(values, np.linspace(0, 1, 101)).tolist()
+
+
+DEFAULT_SCHEMA = infer_schema(DEFAULT_SAMPLE)
+
+
+def sample_frame(schema: Dict[str, Any], n: int, rng: np.random.Generator, noisy: bool = False) -> pd.DataFrame:
+    """
+    Draw n rows from the fitted per-column distributions with vectorized NumPy sampling:
+    inverse-CDF interpolation for numbers and dates, weighted choice for categories and words.
+    Deterministic for a given generator state.
+    """
+    data = {}
+    for column in schema["columns"]:
+        kind = column["kind"]
+        if kind in ("int", "float", "datetime"):
+            quantiles = np.asarray(column["quantiles"])
+            values = np.interp(rng.random(n), np.linspace(0, 1, len(quantiles)), quantiles)
+            if kind == "int":
+                values = pd.array(np.round(values).astype("int64"), dtype="Int64")
+            elif kind == "datetime":
+                values = pd.to_datetime(values.astype("int64"))
+            else:
+                values = pd.array(values, dtype="float64")
+        elif kind == "bool":
+            values = pd.array(rng.random(n) < column["p_true"], dtype="boolean")
+        elif kind == "category":
+            values = pd.array(rng.choice(np.array(column["values"], dtype=object), n, p=_normalized(column["probs"])), dtype="string")
+        else:
+            values = pd.array(_sample_text(column, n, rng), dtype="string")
+        series = pd.Series(values)
+        if column["null_fraction"] > 0:
+            series = series.mask(rng.random(n) < column["null_fraction"])
+        data[column["name"]] = series
+    frame = pd.DataFrame(data)
+    return _add_noise(frame, rng) if noisy else frame
+
+
+def _normalized(probs: List[float]) -> np.ndarray:
+    probs = np.asarray(probs, dtype="float64")
+    return probs / probs.sum()
+
+
+def _sample_text(column: Dict[str, Any], n: int, rng: np.random.Generator) -> np.ndarray:
+    if not column["vocab"]:
+        return np.full(n, "", dtype=object)
+    vocab = np.array(column["vocab"], dtype=object)
+    lengths = rng.choice(np.array(column["lengths"]), n, p=_normalized(column["length_probs"]))
+    longest = max(int(lengths.max()), 1)
+    words = rng.choice(vocab, (n, longest), p=_normalized(column["vocab_probs"]))
+    text = words[:, 0].copy()
+    for j in range(1, longest):
+        extend = lengths > j
+        text[extend] = text[extend] + " " + words[extend, j]
+    return text
+
+
+def _add_noise(frame: pd.DataFrame, rng: np.random.Generator, rate: float = 0.1) -> pd.DataFrame:
+    """
+    Corrupt about `rate` of the cells: stray whitespace and casing in text, dropped numbers.
+    """
+    frame = frame.copy()
+    for name in frame.columns:
+        hit = rng.random(len(frame)) < rate
+        if pd.api.types.is_string_dtype(frame[name]):
+            noisy = frame.loc[hit, name]
+            frame.loc[hit, name] = np.where(rng.random(hit.sum()) < 0.5, " " + noisy.str.upper(), noisy.str.lower() + " ")
+        elif pd.api.types.is_numeric_dtype(frame[name]) and not pd.api.types.is_bool_dtype(frame[name]):
+            frame.loc[hit, name] = None
+    return frame
+
+
+def validate_rows(raw: pd.DataFrame, schema: Dict[str, Any]) -> Tuple[Optional[pd.DataFrame], int]:
+    """
+    Coerce LLM rows (all strings) to the schema's dtypes. Rows with values of the wrong type,
+    or missing values in columns that are never missing, are rejected.
+    Returns (valid rows or None if a column is missing, rejected count).
+    """
+    names = [column["name"] for column in schema["columns"]]
+    if any(name not in raw.columns for name in names):
+        return None, len(raw)
+    valid = np.ones(len(raw), dtype=bool)
+    data = {}
+    for column in schema["columns"]:
+        text = raw[column["name"]].astype(str).str.strip()
+        empty = (text == "").to_numpy()
+        kind = column["kind"]
+        if kind in ("int", "float"):
+            parsed = pd.to_numeric(text.where(~empty), errors="coerce")
+            bad = parsed.isna().to_numpy() & ~empty
+            if kind == "int":
+                bad |= ~empty & (np.mod(parsed.fillna(0).to_numpy(), 1) != 0)
+                parsed = parsed.where(~bad).round().astype("Int64")
+            values = parsed
+        elif kind == "bool":
+            values = text.str.lower().map({"true": True, "false": False, "1": True, "0": False, "yes": True, "no": False})
+            bad = values.isna().to_numpy() & ~empty
+            values = values.astype("boolean")
+        elif kind == "datetime":
+            values = pd.to_datetime(text.where(~empty), errors="coerce")
+            bad = values.isna().to_numpy() & ~empty
+        else:
+            values = text.where(~empty).astype("string")
+            bad = np.zeros(len(text), dtype=bool)
+        if column["null_fraction"] == 0:
+            bad |= empty
+        valid &= ~bad
+        data[column["name"]] = values.reset_index(drop=True)
+    frame = pd.DataFrame(data)[valid].reset_index(drop=True)
+    return frame, int((~valid).sum())
+
+
+def normalize_dtypes(frame: pd.DataFrame, schema: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Give every generated chunk the same dtypes, so chunks can be written to one Parquet file.
+    """
+    dtypes = {"int": "Int64", "float": "float64", "bool": "boolean", "datetime": "datetime64[ns]",
+              "category": "string", "text": "string"}
+    return frame.astype({c["name"]: dtypes[c["kind"]] for c in schema["columns"] if c["kind"] in dtypes})
+
+
+class _Deduplicator:
+    def __init__(self):
+        self.seen = set()
+
+    def filter(self, frame: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+        """
+        Drop rows already produced (in this chunk or an earlier one). Returns (new rows, dropped count).
+        """
+        if frame.empty:
+            return frame, 0
+        fingerprints = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+        keep = ~pd.Series(fingerprints).duplicated().to_numpy()
+        keep &= np.fromiter((f not in self.seen for f in fingerprints.tolist()), dtype=bool, count=len(fingerprints))
+        self.seen.update(fingerprints[keep].tolist())
+        return frame[keep], int((~keep).sum())
+
+
+def _call_prompt(template: CompiledTemplate, prompt: str, schema: Dict[str, Any], rows: int, batch: int, batches: int) -> str:
+    header = ",".join(column["name"] for column in schema["columns"])
+    instructions = (
+        f"{prompt}\n\nReturn exactly {rows} new rows as CSV with this header:\n{header}\n"
+        f"Example rows:\n{schema['sample_csv']}"
+        f"This is batch {batch + 1} of {batches}; do not repeat the example rows."
+    )
+    return template.render(prompt=instructions)
+
+
+async def generate_chunks(template: CompiledTemplate, prompt: str, count: int, schema: Dict[str, Any], config: Dict[str, Any],
+                          stats: Dict[str, Any], noisy: bool = False) -> AsyncIterator[pd.DataFrame]:
+    """
+    Yield validated, deduplicated chunks of generated rows as they arrive, until count rows.
+    LLM calls are sized to the token budget and run concurrently; rows still missing after
+    GENERATE_MAX_ROUNDS (or when the LLM is unavailable, or in local mode) come from the local sampler.
+    """
+    dedup = _Deduplicator()
+    produced = 0
+    mode = config["mode"]
+    if mode == "auto":
+        mode = "llm" if count <= GENERATE_LLM_MAX_ROWS else "local"
+    stats.update(mode=mode, calls=0, failed_calls=0, invalid_rows=0, duplicates=0, llm_rows=0, local_rows=0, errors=[])
+
+    if mode == "llm":
+        row_tokens = max(estimate_tokens(schema["sample_csv"]) // max(schema["sample_csv"].count("\n") - 1, 1), 1)
+        rows_per_call = max(1, (config["call_tokens"] - 64) // row_tokens)
+        limit = asyncio.Semaphore(config["concurrency"])
+        batch = 0
+
+        async def call(text: str) -> Dict[str, Any]:
+            async with limit:
+                return await cerebras_client.agenerate(text, max_tokens=config["call_tokens"])
+
+        for _ in range(GENERATE_MAX_ROUNDS):
+            missing = count - produced
+            if missing <= 0:
+                break
+            calls = math.ceil(missing * OVERSAMPLE / rows_per_call)
+            prompts = [_call_prompt(template, prompt, schema, rows_per_call, batch + i, batch + calls) for i in range(calls)]
+            batch += calls
+            tasks = [asyncio.ensure_future(call(text)) for text in prompts]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    response = await next_done
+                    stats["calls"] += 1
+                    if not response["success"]:
+                        stats["failed_calls"] += 1
+                        stats["errors"].append(response["error"])
+                        continue
+                    names = [column["name"] for column in schema["columns"]]
+                    raw = parse_csv_response(response.get("data") or "", names, names[0])
+                    chunk, invalid = validate_rows(raw, schema) if raw is not None else (None, 0)
+                    stats["invalid_rows"] += invalid
+                    if chunk is None:
+                        stats["failed_calls"] += 1
+                        continue
+                    chunk, duplicates = dedup.filter(normalize_dtypes(chunk, schema))
+                    stats["duplicates"] += duplicates
+                    chunk = chunk.iloc[:count - produced]
+                    if len(chunk):
+                        produced += len(chunk)
+                        stats["llm_rows"] += len(chunk)
+                        yield chunk
+                    if produced >= count:
+                        break
+            finally:
+                # Calls still running once enough rows have arrived are not needed
+                for task in tasks:
+                    task.cancel()
+            if stats["failed_calls"] == stats["calls"]:
+                # The LLM is unavailable; do not retry the same failing calls
+                break
+
+    # Local sampling: the requested mode, or the fallback for rows the LLM did not deliver
+    rng = np.random.default_rng(config["seed"])
+    loop = asyncio.get_running_loop()
+    empty_chunks = 0
+    while produced < count and empty_chunks < 3:
+        size = min(config["chunk_rows"], count - produced)
+        chunk = await loop.run_in_executor(None, sample_frame, schema, size, rng, noisy)
+        chunk, duplicates = dedup.filter(normalize_dtypes(chunk, schema))
+        stats["duplicates"] += duplicates
+        chunk = chunk.iloc[:count - produced]
+        # Stop if the fitted distributions cannot produce any more distinct rows
+        empty_chunks = empty_chunks + 1 if chunk.empty else 0
+        if len(chunk):
+            produced += len(chunk)
+            stats["local_rows"] += len(chunk)
+            yield chunk
+    stats["errors"] = sorted(set(stats["errors"]))
+
+
+def format_generation_stats(stats: Dict[str, Any]) -> str:
+    """
+    Generation counts as bullet lines for the generate stage summary.
+    """
+    lines = [
+        f"- Generated rows: {stats['rows']} ({stats['llm_rows']} from the LLM, {stats['local_rows']} sampled locally)",
+        f"- Mode: {stats['mode']}",
+    ]
+    if stats["calls"]:
+        lines.append(f"- LLM calls: {stats['calls']} ({stats['failed_calls']} without usable output)")
+    lines.append(f"- Rejected rows: {stats['invalid_rows']} invalid, {stats['duplicates']} duplicates")
+    lines.append(f"- Throughput: {stats['rows_per_second']} rows/s in {stats['seconds']}s")
+    return "\n".join(lines) + "\n"
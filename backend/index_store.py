@@ -0,0 +1,454 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from metadata_store import MetadataStore, metadata_path
+from storage import data_path
+from lazy_imports import lazy_import
+
+# Imported on first use (or at startup via PRELOAD_MODULES)
+faiss = lazy_import("faiss")
+
+DEFAULT_INDEX_NAME = "default"
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+INDEX_TYPES = ["flat", "ivf_flat", "ivf_pq", "hnsw"]
+# Stored vector precision for flat, IVF-Flat and HNSW indexes: float16 halves index memory,
+# int8 (a scalar quantizer trained on the first chunk) quarters it; IVF-PQ has its own codes
+VECTOR_PRECISIONS = {"float32": None, "float16": "QT_fp16", "int8": "QT_8bit"}
+INDEX_PRECISION = os.getenv("INDEX_PRECISION", "float32")
+
+# Defaults for the automatic index policy and ANN parameters
+INDEX_MEMORY_MB = float(os.getenv("INDEX_MEMORY_MB", "1024"))
+FLAT_MAX_ROWS = int(os.getenv("INDEX_FLAT_MAX_ROWS", "50000"))
+HNSW_MAX_ROWS = int(os.getenv("INDEX_HNSW_MAX_ROWS", "2000000"))
+DEFAULT_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+DEFAULT_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+TRAIN_POINTS_PER_LIST = 64
+MAX_TRAIN_POINTS = 200000
+
+
+def sanitize_index_name(name: Optional[str]) -> str:
+    """
+    Turn a dataset or file name into a safe index directory name.
+    """
+    if not name:
+        return DEFAULT_INDEX_NAME
+    stem = os.path.splitext(os.path.basename(name))[0]
+    cleaned = re.sub(r"[^A-Za-z0-9_.-]+", "_", stem).strip("._")
+    return cleaned or DEFAULT_INDEX_NAME
+
+
+class StoredIndex:
+    """
+    A loaded index version: the FAISS IndexIDMap plus the sorted id -> content-hash map
+    used to tell new, changed and unchanged rows apart.
+    """
+
+    def __init__(self, name: str, index, ids: np.ndarray, hashes: np.ndarray, manifest: Dict[str, Any]):
+        self.name = name
+        self.index = index
+        self.ids = ids
+        self.hashes = hashes
+        self.manifest = manifest
+        # Positions in the index of removed vectors an index without remove_ids (HNSW) still
+        # holds; compact() drops them in one rebuild, and IndexStore.save compacts first
+        self.stale: Optional[np.ndarray] = None
+
+    @property
+    def version(self) -> int:
+        return self.manifest.get("version", 0)
+
+    def diff(self, ids: np.ndarray, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return boolean masks (is_new, is_changed) for the given rows against this version.
+        """
+        if len(self.ids) == 0:
+            return np.ones(len(ids), dtype=bool), np.zeros(len(ids), dtype=bool)
+        pos = np.clip(np.searchsorted(self.ids, ids), 0, len(self.ids) - 1)
+        exists = self.ids[pos] == ids
+        changed = exists & (self.hashes[pos] != hashes)
+        return ~exists, changed
+
+    def upsert(self, ids: np.ndarray, hashes: np.ndarray, vectors: np.ndarray):
+        """
+        Replace vectors for existing ids and append the rest.
+        """
+        self.remove(ids)
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype="float32"), ids.astype("int64"))
+        merged_ids = np.concatenate([self.ids, ids])
+        merged_hashes = np.concatenate([self.hashes, hashes])
+        order = np.argsort(merged_ids, kind="stable")
+        self.ids, self.hashes = merged_ids[order], merged_hashes[order]
+
+    def remove(self, ids: np.ndarray) -> int:
+        """
+        Remove the given ids from the index and the id map. Returns the number removed.
+        """
+        present = np.isin(self.ids, ids)
+        if not present.any():
+            return 0
+        try:
+            removed = self.index.remove_ids(np.ascontiguousarray(self.ids[present], dtype="int64"))
+        except RuntimeError:
+            # HNSW does not support removal: mark the vectors stale rather than rebuilding per call
+            removed = self._mark_stale(self.ids[present])
+        self.ids, self.hashes = self.ids[~present], self.hashes[~present]
+        return int(removed)
+
+    def compact(self) -> int:
+        """
+        Rebuild the index without its stale vectors, if any. Returns the number dropped.
+        """
+        if self.stale is None:
+            return 0
+        inner = self.index.index
+        all_ids = faiss.vector_to_array(self.index.id_map)
+        keep = ~self._stale_mask(len(all_ids))
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        rebuilt = faiss.clone_index(inner)
+        rebuilt.reset()
+        index = faiss.IndexIDMap(rebuilt)
+        index.add_with_ids(np.ascontiguousarray(vectors[keep]), all_ids[keep])
+        self.index = index
+        self.stale = None
+        return int((~keep).sum())
+
+    def _mark_stale(self, ids: np.ndarray) -> int:
+        all_ids = faiss.vector_to_array(self.index.id_map)
+        stale = self._stale_mask(len(all_ids))
+        # An id replaced earlier in this build also sits at a stale position; count only its live one
+        hit = np.isin(all_ids, ids) & ~stale
+        self.stale = stale | hit
+        return int(hit.sum())
+
+    def _stale_mask(self, size: int) -> np.ndarray:
+        mask = np.zeros(size, dtype=bool)
+        if self.stale is not None:
+            mask[:len(self.stale)] = self.stale
+        return mask
+
+
+class IndexStore:
+    """
+    Named, per-dataset FAISS indexes persisted under DATA_DIR/indexes/<name>/.
+    Every save writes a new version (vNNNNNN.faiss + vNNNNNN.ids.npz) and then atomically
+    swaps the CURRENT manifest, so readers never see a half-written index.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.dirname(data_path("indexes", "_"))
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._readers: Dict[str, Tuple[int, Any, Dict[str, Any]]] = {}
+
+    def index_dir(self, name: str) -> str:
+        return os.path.join(self.root, sanitize_index_name(name))
+
+    @contextmanager
+    def lock(self, name: str):
+        """
+        Serialize writers of one index across threads and worker processes.
+        """
+        name = sanitize_index_name(name)
+        with self._locks_guard:
+            thread_lock = self._locks.setdefault(name, threading.Lock())
+        os.makedirs(self.index_dir(name), exist_ok=True)
+        with thread_lock:
+            with open(os.path.join(self.index_dir(name), ".lock"), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def manifest(self, name: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.index_dir(name), "CURRENT.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def current_index_path(self, name: str) -> Optional[str]:
+        manifest = self.manifest(name)
+        if manifest is None:
+            return None
+        return os.path.join(self.index_dir(name), manifest["index_file"])
+
+    def load(self, name: str) -> Optional[StoredIndex]:
+        """
+        Load the current version of an index, or None if it does not exist yet.
+        """
+        manifest = self.manifest(name)
+        if manifest is None:
+            return None
+        index_dir = self.index_dir(name)
+        index = faiss.read_index(os.path.join(index_dir, manifest["index_file"]))
+        apply_search_params(index, manifest.get("index_params", {}))
+        with np.load(os.path.join(index_dir, manifest["ids_file"])) as id_map:
+            ids, hashes = id_map["ids"], id_map["hashes"]
+        return StoredIndex(sanitize_index_name(name), index, ids, hashes, manifest)
+
+    def open_for_search(self, name: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """
+        Return (index, manifest) for querying the current version of an index.
+        The index file is memory-mapped read-only, so worker processes share the page cache
+        instead of each holding a private copy; the open index is reused until a new version lands.
+        """
+        name = sanitize_index_name(name)
+        manifest = self.manifest(name)
+        if manifest is None:
+            return None
+        with self._locks_guard:
+            cached = self._readers.get(name)
+            if cached is not None and cached[0] == manifest["version"]:
+                return cached[1], cached[2]
+
+        path = os.path.join(self.index_dir(name), manifest["index_file"])
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped; fall back to a regular read
+            index = faiss.read_index(path)
+        apply_search_params(index, manifest.get("index_params", {}))
+
+        with self._locks_guard:
+            self._readers[name] = (manifest["version"], index, manifest)
+        return index, manifest
+
+    def create(self, name: str, dimension: int, model_name: str, index_type: str = "flat",
+               train_vectors: Optional[np.ndarray] = None, params: Optional[Dict[str, Any]] = None) -> StoredIndex:
+        """
+        Create a new, empty (unsaved) index, training it on train_vectors for IVF types.
+        """
+        inner, params = build_ann_index(index_type, dimension, train_vectors, params or {})
+        manifest = {"version": 0, "dimension": dimension, "model": model_name,
+                    "index_type": index_type, "index_params": params}
+        empty = np.zeros(0, dtype="int64")
+        return StoredIndex(sanitize_index_name(name), faiss.IndexIDMap(inner), empty, empty.copy(), manifest)
+
+    def save(self, stored: StoredIndex, extra: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Write stored as the next version and make it current. Returns the new version number.
+        Callers should hold lock(stored.name).
+        """
+        stored.compact()
+        index_dir = self.index_dir(stored.name)
+        os.makedirs(index_dir, exist_ok=True)
+        current = self.manifest(stored.name)
+        version = (current["version"] if current else 0) + 1
+        index_file = f"v{version:06d}.faiss"
+        ids_file = f"v{version:06d}.ids.npz"
+
+        faiss.write_index(stored.index, os.path.join(index_dir, index_file + ".tmp"))
+        os.replace(os.path.join(index_dir, index_file + ".tmp"), os.path.join(index_dir, index_file))
+        with open(os.path.join(index_dir, ids_file + ".tmp"), "wb") as f:
+            np.savez(f, ids=stored.ids, hashes=stored.hashes)
+        os.replace(os.path.join(index_dir, ids_file + ".tmp"), os.path.join(index_dir, ids_file))
+
+        manifest = dict(stored.manifest)
+        manifest.update(extra or {})
+        manifest.update({
+            "version": version,
+            "index_file": index_file,
+            "ids_file": ids_file,
+            "count": int(stored.index.ntotal),
+            "updated_at": time.time(),
+        })
+        manifest_tmp = os.path.join(index_dir, "CURRENT.json.tmp")
+        with open(manifest_tmp, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest_tmp, os.path.join(index_dir, "CURRENT.json"))
+        stored.manifest = manifest
+
+        self._prune(index_dir, version)
+        return version
+
+    def delete_rows(self, name: str, ids: List[int]) -> int:
+        """
+        Remove rows by stable row ID and save a new version. Returns the number removed.
+        """
+        with self.lock(name):
+            stored = self.load(name)
+            if stored is None:
+                return 0
+            removed = stored.remove(np.asarray(ids, dtype="int64"))
+            if removed:
+                self.save(stored)
+                metadata = MetadataStore(metadata_path(self.index_dir(name)))
+                try:
+                    metadata.delete(ids)
+                    metadata.commit()
+                finally:
+                    metadata.close()
+            return removed
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.root):
+            return []
+        indexes = []
+        for name in sorted(os.listdir(self.root)):
+            manifest = self.manifest(name)
+            if manifest is not None:
+                indexes.append({"name": name, **manifest})
+        return indexes
+
+    def _prune(self, index_dir: str, version: int):
+        # Keep the last few versions so readers of an older version are not cut off mid-read
+        for filename in os.listdir(index_dir):
+            match = re.match(r"v(\d+)\.", filename)
+            if match and int(match.group(1)) <= version - INDEX_KEEP_VERSIONS:
+                path = os.path.join(index_dir, filename)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+
+def choose_index_type(n_rows: int, dimension: int, memory_budget_mb: Optional[float] = None) -> str:
+    """
+    Pick an index type from the expected row count and memory budget:
+    exact search while it is cheap, HNSW while vectors plus graph fit in memory,
+    IVF-Flat while raw vectors fit, and IVF-PQ (compressed codes) beyond that.
+    """
+    budget = (memory_budget_mb or INDEX_MEMORY_MB) * 1024 * 1024
+    flat_bytes = n_rows * dimension * 4
+    hnsw_bytes = flat_bytes + n_rows * DEFAULT_HNSW_M * 2 * 4
+    if n_rows <= FLAT_MAX_ROWS:
+        return "flat"
+    if n_rows <= HNSW_MAX_ROWS and hnsw_bytes <= budget:
+        return "hnsw"
+    if flat_bytes <= budget:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def default_ann_params(index_type: str, n_rows: int, dimension: int,
+                       memory_budget_mb: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Default nlist/nprobe/M/PQ sizes for an index of n_rows vectors.
+    """
+    if index_type == "hnsw":
+        return {"M": DEFAULT_HNSW_M, "efConstruction": 2 * DEFAULT_HNSW_M, "efSearch": DEFAULT_EF_SEARCH}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = int(np.clip(4 * np.sqrt(max(n_rows, 1)), 1, 65536))
+        params = {"nlist": nlist, "nprobe": max(1, min(nlist, nlist // 16 or 1, 128))}
+        if index_type == "ivf_pq":
+            # Largest number of 8-bit sub-quantizers that divides the dimension and fits the budget
+            budget = (memory_budget_mb or INDEX_MEMORY_MB) * 1024 * 1024
+            bytes_per_vector = max(4, int(budget / max(n_rows, 1)) - 8)
+            divisors = [m for m in range(1, dimension + 1) if dimension % m == 0 and m <= min(bytes_per_vector, 64)]
+            params["pq_m"] = divisors[-1] if divisors else 1
+        return params
+    return {}
+
+
+def build_ann_index(index_type: str, dimension: int, train_vectors: Optional[np.ndarray],
+                    params: Dict[str, Any]) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Build (and train, for IVF types and int8 vectors) an empty index. Returns (index, effective params).
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    n_train = 0 if train_vectors is None else len(train_vectors)
+    params = {**default_ann_params(index_type, n_train, dimension), **params}
+    if index_type != "ivf_pq":
+        params.setdefault("precision", INDEX_PRECISION)
+        if params["precision"] not in VECTOR_PRECISIONS:
+            raise ValueError(f"Unknown vector precision: {params['precision']} (expected one of {', '.join(VECTOR_PRECISIONS)})")
+    qtype = VECTOR_PRECISIONS.get(params.get("precision"))
+    if qtype is not None:
+        qtype = getattr(faiss.ScalarQuantizer, qtype)
+
+    if index_type == "flat":
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_L2) if qtype is not None else faiss.IndexFlatL2(dimension)
+        train_points = MAX_TRAIN_POINTS
+    elif index_type == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dimension, qtype, int(params["M"]))
+        else:
+            index = faiss.IndexHNSWFlat(dimension, int(params["M"]))
+        index.hnsw.efConstruction = int(params["efConstruction"])
+        train_points = MAX_TRAIN_POINTS
+    else:
+        # IVF needs at least one training point per list; cap lists to what the sample supports
+        params["nlist"] = int(max(1, min(params["nlist"], n_train // 39 or 1)))
+        params["nprobe"] = int(min(params["nprobe"], params["nlist"]))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat" and qtype is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, params["nlist"], qtype, faiss.METRIC_L2)
+        elif index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, params["nlist"], faiss.METRIC_L2)
+        else:
+            # 8-bit codebooks need ~39 * 256 training points; use fewer bits for small samples
+            params.setdefault("pq_nbits", int(np.clip(np.floor(np.log2(max(n_train, 1) / 39)), 1, 8)))
+            index = faiss.IndexIVFPQ(quantizer, dimension, params["nlist"], int(params["pq_m"]), int(params["pq_nbits"]))
+        train_points = params["nlist"] * TRAIN_POINTS_PER_LIST
+
+    if not index.is_trained:
+        # Train on a random sample rather than every vector
+        sample_size = min(n_train, MAX_TRAIN_POINTS, train_points)
+        sample = train_vectors[np.random.default_rng(0).choice(n_train, size=sample_size, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype="float32"))
+    apply_search_params(index, params)
+    return index, params
+
+
+def apply_search_params(index, params: Dict[str, Any]):
+    """
+    Apply query-time parameters (nprobe / efSearch) to an index, unwrapping IndexIDMap.
+    """
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if "nprobe" in params and hasattr(inner, "nprobe"):
+        inner.nprobe = int(params["nprobe"])
+    if "efSearch" in params and hasattr(inner, "hnsw"):
+        inner.hnsw.efSearch = int(params["efSearch"])
+
+
+def evaluate_recall(template, vectors: np.ndarray, k: int = 10, n_queries: int = 100,
+                    max_base: int = 10000) -> Optional[float]:
+    """
+    Estimate recall@k of an (empty, trained) index configuration against exact search.
+    A sample of vectors is indexed by both a flat index and a copy of template, and
+    held-out queries (not part of the indexed sample) are compared.
+    """
+    if len(vectors) < n_queries + k:
+        n_queries = len(vectors) // 5
+    if n_queries == 0 or len(vectors) - n_queries < k:
+        return None
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(vectors))
+    queries = np.ascontiguousarray(vectors[order[:n_queries]], dtype="float32")
+    base = np.ascontiguousarray(vectors[order[n_queries:n_queries + max_base]], dtype="float32")
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, k)
+
+    approx = faiss.clone_index(template)
+    approx.reset()
+    approx.add(base)
+    _, found = approx.search(queries, k)
+
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / (n_queries * k)
+
+
+def hash_to_id(hex_digest: str) -> int:
+    """
+    Map a hex digest to a positive int64 usable as a FAISS id.
+    """
+    return int(hex_digest[:15], 16)
+
+
+# Global instance of the index store
+index_store = IndexStore()
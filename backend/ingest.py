@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from storage import data_path
+from telemetry import bind, span
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+CSV_BLOCK_BYTES = int(os.getenv("CSV_BLOCK_BYTES", str(16 * 1024 * 1024)))
+# 1 shrinks parsed frames at ingest: downcast numbers, categoricals for repetitive strings
+INGEST_COMPACT = os.getenv("INGEST_COMPACT", "1") == "1"
+# Strings become categoricals when at most this fraction of their values are distinct
+CATEGORY_MAX_RATIO = float(os.getenv("INGEST_CATEGORY_MAX_RATIO", "0.5"))
+
+
+async def spool_upload(upload) -> Tuple[str, str]:
+    """
+    Copy an UploadFile to a temporary file on disk in fixed-size chunks, so the payload
+    is never held in memory as one bytes object, hashing it on the way.
+    Returns (path, content fingerprint); callers remove the file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=os.path.dirname(data_path("uploads", "_")))
+    digest = hashlib.blake2b(digest_size=16)
+    with os.fdopen(fd, "wb") as out:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    return path, digest.hexdigest()
+
+
+def _convert_options(columns: Optional[List[str]]) -> pacsv.ConvertOptions:
+    return pacsv.ConvertOptions(include_columns=columns or [], include_missing_columns=False)
+
+
+def read_csv(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Parse a spooled CSV with the multithreaded Arrow reader (with type inference and
+    optional column pruning) and convert it to pandas without keeping both copies alive.
+    """
+    try:
+        table = pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+            convert_options=_convert_options(columns),
+        )
+    except pa.ArrowInvalid:
+        # Fall back to pandas for files Arrow rejects (e.g. inconsistent row lengths)
+        return pd.read_csv(path, usecols=columns or None)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def iter_batches(path: str, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream a spooled CSV as pandas DataFrames of one Arrow record batch each,
+    for stages that can work chunk by chunk instead of on the whole frame.
+    Integer columns become nullable Int64, so a batch with missing values has the same
+    dtypes as one without.
+    """
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+        convert_options=_convert_options(columns),
+    )
+    for batch in reader:
+        yield batch.to_pandas(types_mapper=_NULLABLE_INTEGERS.get)
+
+
+_NULLABLE_INTEGERS = {
+    pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype(), pa.int64(): pd.Int64Dtype(),
+}
+
+
+def compact_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Shrink df's columns: integers to the smallest integer type that holds them, floats to
+    float32 when that is exact, and repetitive strings to categoricals. A column is only
+    converted if that makes it smaller. Columns are replaced, never written into, so other
+    holders of df are unaffected (and unconverted columns are shared, not copied).
+    Returns (compact frame, memory report with bytes before and after per column).
+    """
+    converted = {}
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        before = int(values.memory_usage(index=False, deep=True))
+        compact = _compact_column(values)
+        after = int(compact.memory_usage(index=False, deep=True)) if compact is not None else before
+        if compact is not None and after < before:
+            converted[name] = compact
+        else:
+            after = before
+        columns[str(name)] = {"dtype": str(converted[name].dtype if name in converted else values.dtype),
+                              "before_bytes": before, "after_bytes": after}
+    if converted:
+        # A shallow copy whose converted columns are swapped out; the caller's frame keeps its own
+        df = df.copy(deep=False)
+        for name, values in converted.items():
+            df[name] = values
+    report = {
+        "before_mb": round(sum(c["before_bytes"] for c in columns.values()) / (1024 * 1024), 2),
+        "after_mb": round(sum(c["after_bytes"] for c in columns.values()) / (1024 * 1024), 2),
+        "columns": columns,
+    }
+    return df, report
+
+
+def _compact_column(values: pd.Series) -> Optional[pd.Series]:
+    """
+    The smaller representation of one column, or None if there is nothing to try.
+    """
+    dtype = values.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return None
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_float_dtype(dtype) and dtype.itemsize > 4:
+        narrow = values.astype("float32")
+        # Only when every value survives the round trip (NaN compares unequal, so check it apart)
+        same = (narrow.to_numpy(dtype="float64") == values.to_numpy(dtype="float64")) | values.isna().to_numpy()
+        return narrow if same.all() else None
+    if pd.api.types.is_string_dtype(dtype) and len(values):
+        if values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            return values.astype("category")
+    return None
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MB.
+    """
+    # Linux: VmHWM, which writing 5 to /proc/self/clear_refs resets (see benchmark.py)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def ingest_upload(upload, columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Spool and parse an uploaded CSV (off the event loop). Returns (frame, ingest stats).
+    """
+    start = time.perf_counter()
+    with span("ingest.spool") as spool_span:
+        path, fingerprint = await spool_upload(upload)
+        spool_span.set(bytes=os.path.getsize(path))
+    try:
+        df, stats = await load_spooled(path, columns)
+    finally:
+        os.remove(path)
+    stats["fingerprint"] = fingerprint
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return df, stats
+
+
+async def load_spooled(path: str, columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Parse a spooled CSV off the event loop, then compact it with compact_frame unless
+    INGEST_COMPACT=0. Returns (frame, ingest stats).
+    """
+    start = time.perf_counter()
+    size = os.path.getsize(path)
+    loop = asyncio.get_running_loop()
+    with span("ingest.parse", bytes=size) as parse_span:
+        df = await loop.run_in_executor(None, bind(read_csv, path, columns))
+        parse_span.set(rows=len(df))
+    memory = None
+    if INGEST_COMPACT:
+        with span("ingest.compact", rows=len(df)):
+            df, memory = await loop.run_in_executor(None, compact_frame, df)
+    stats = {
+        "bytes": size,
+        "rows": len(df),
+        "columns": len(df.columns),
+        "seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if memory is not None:
+        stats["memory"] = memory
+    return df, stats
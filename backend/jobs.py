@@ -0,0 +1,297 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from ingest import load_spooled
+from pipeline import RESULT_KEYS, cached_run, parse_actions, run_clean_file, run_pipeline, streams_from_file
+from progress import set_cancel_event
+from storage import data_path
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+# Seconds between progress writes to the job store; stage starts and finishes are always written
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1.0"))
+
+FINAL_STATUSES = ("done", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite-backed job state, so queued work survives a worker restart.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or data_path("jobs.sqlite3"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " priority INTEGER NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " input_path TEXT,"
+            " progress TEXT NOT NULL,"
+            " results TEXT NOT NULL,"
+            " error TEXT,"
+            " created REAL NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def create(self, prompt: str, options: Dict[str, Any], input_path: Optional[str], priority: int,
+               progress: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex, "status": "queued", "priority": priority, "prompt": prompt,
+            "options": options, "input_path": input_path, "progress": progress, "results": {},
+            "error": None, "created": now, "updated": now,
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, priority, prompt, options, input_path, progress, results, error, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["status"], priority, prompt, json.dumps(options), input_path,
+                 json.dumps(progress), "{}", None, now, now),
+            )
+            self._conn.commit()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, priority, prompt, options, input_path, progress, results, error, created, updated"
+                " FROM jobs WHERE id = ?", (job_id,),
+            ).fetchone()
+        return _row_to_job(row) if row else None
+
+    def update(self, job_id: str, expected_status: Optional[Tuple[str, ...]] = None, **fields) -> bool:
+        """
+        Set fields on a job. With expected_status, only while the job is in one of those
+        statuses, so a concurrent transition (e.g. a cancel) is not overwritten.
+        Returns whether the job was updated.
+        """
+        fields["updated"] = time.time()
+        for key in ("options", "progress", "results"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        condition, params = "id = ?", [job_id]
+        if expected_status:
+            condition += f" AND status IN ({', '.join('?' * len(expected_status))})"
+            params.extend(expected_status)
+        with self._lock:
+            cursor = self._conn.execute(f"UPDATE jobs SET {assignments} WHERE {condition}", (*fields.values(), *params))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def incomplete(self) -> List[Dict[str, Any]]:
+        """
+        Jobs that were queued or running when the process last stopped, in queue order.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status, priority, prompt, options, input_path, progress, results, error, created, updated"
+                " FROM jobs WHERE status IN ('queued', 'running') ORDER BY priority DESC, created ASC"
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+
+def _remove_input(job: Dict[str, Any]):
+    if job["input_path"] and os.path.exists(job["input_path"]):
+        os.remove(job["input_path"])
+
+
+def _row_to_job(row) -> Dict[str, Any]:
+    keys = ["id", "status", "priority", "prompt", "options", "input_path", "progress", "results", "error", "created", "updated"]
+    job = dict(zip(keys, row))
+    for key in ("options", "progress", "results"):
+        job[key] = json.loads(job[key])
+    return job
+
+
+class JobManager:
+    """
+    Bounded local worker pool that runs /api/process pipelines in the background.
+    Jobs are taken highest priority first (FIFO within a priority); submissions are
+    rejected with JobQueueFull once JOB_QUEUE_SIZE jobs are waiting.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.store: Optional[JobStore] = None
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._running: Dict[str, Any] = {}
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the workers and re-enqueue jobs that were queued or running before a restart.
+        """
+        if self._threads:
+            return
+        self.store = JobStore()
+        for job in self.store.incomplete():
+            self.store.update(job["id"], status="queued")
+            self._enqueue(job["id"], job["priority"])
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put((float("inf"), next(self._sequence), None))
+        self._threads = []
+
+    def submit(self, prompt: str, options: Dict[str, Any], input_path: Optional[str], priority: int = 0) -> Dict[str, Any]:
+        self._require_started()
+        if self._queue.qsize() >= self.queue_size:
+            raise JobQueueFull(f"Job queue is full ({self.queue_size} jobs waiting)")
+        progress = {action: {"status": "queued"} for action in parse_actions(prompt)}
+        job = self.store.create(prompt, options, input_path, priority, progress)
+        self._enqueue(job["id"], priority)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._require_started()
+        job = self.store.get(job_id)
+        if job is not None:
+            job["queue_depth"] = self._queue.qsize()
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Jobs waiting in the queue and jobs currently running.
+        """
+        with self._running_lock:
+            running = len(self._running)
+        return {"queued": self._queue.qsize(), "running": running}
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a queued or running job. Running stages stop at their next await point, and
+        work in the stage thread pool at its next chunk (see progress.check_cancelled).
+        """
+        self._require_started()
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINAL_STATUSES:
+            return job
+        if not self.store.update(job_id, expected_status=("queued", "running"), status="cancelled"):
+            # Finished in the meantime
+            return self.store.get(job_id)
+        with self._running_lock:
+            running = self._running.get(job_id)
+        if running is not None:
+            loop, task, cancelled = running
+            cancelled.set()
+            loop.call_soon_threadsafe(task.cancel)
+        return self.store.get(job_id)
+
+    def _require_started(self):
+        if self.store is None:
+            raise RuntimeError("The job manager has not been started; call job_manager.start() first")
+
+    def _enqueue(self, job_id: str, priority: int):
+        # PriorityQueue pops the smallest item, so negate priority for highest-first
+        self._queue.put((-priority, next(self._sequence), job_id))
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                return
+            job = self.store.get(job_id)
+            if job is None:
+                continue
+            if job["status"] != "queued":
+                # Cancelled while waiting in the queue
+                _remove_input(job)
+                continue
+            try:
+                asyncio.run(self._execute(job))
+            except Exception as e:
+                logger.exception("Job %s failed", job_id)
+                self.store.update(job_id, expected_status=("queued", "running"), status="failed", error=str(e))
+            finally:
+                _remove_input(job)
+
+    async def _execute(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        if not self.store.update(job_id, expected_status=("queued",), status="running"):
+            # Cancelled after it was taken off the queue
+            return
+        progress = job["progress"]
+        results = {}
+        last_write = 0.0
+        # Tasks created below (and stage thread work bound to them) inherit the event
+        cancelled = threading.Event()
+        set_cancel_event(cancelled)
+
+        def on_event(event: str, action: str, payload: Dict[str, Any]):
+            # Record per-stage progress and partial results as each stage starts and finishes
+            nonlocal last_write
+            if event == "started":
+                progress[action] = {"status": "running", "started": time.time()}
+            elif event == "finished":
+                failed = isinstance(payload["output"], str) and payload["output"].startswith("Error:")
+                progress[action] = {"status": "failed" if failed else "done", "seconds": payload["seconds"]}
+                results[RESULT_KEYS[action]] = payload["output"]
+            elif event == "progress":
+                progress[action].update({key: payload[key] for key in ("phase", "rows", "total") if key in payload})
+                if time.monotonic() - last_write < JOB_PROGRESS_INTERVAL:
+                    return
+            last_write = time.monotonic()
+            self.store.update(job_id, progress=progress, results=results)
+
+        if job["input_path"] and streams_from_file(job["prompt"]):
+            # Clean-only jobs stream the file instead of loading it
+            task = asyncio.ensure_future(run_clean_file(job["input_path"], job["prompt"], job["options"], on_event))
+        else:
+            cached = await cached_run(job["prompt"], job["options"]) if job["input_path"] else None
+            if cached is not None:
+                # Same data, prompt and options as an earlier run: replay its results
+                self.store.update(job_id, expected_status=("running",), status="done",
+                                  progress={a: {"status": "done"} for a in progress}, results=cached)
+                return
+            df = None
+            if job["input_path"]:
+                df, _ = await load_spooled(job["input_path"], job["options"].get("columns"))
+            task = asyncio.ensure_future(run_pipeline(df, job["prompt"], job["options"], on_event))
+        with self._running_lock:
+            self._running[job_id] = (asyncio.get_running_loop(), task, cancelled)
+        if self.store.get(job_id)["status"] == "cancelled":
+            # Cancelled while the input was being parsed
+            cancelled.set()
+            task.cancel()
+        try:
+            output = await task
+        except asyncio.CancelledError:
+            self.store.update(job_id, status="cancelled", progress=progress, results=results)
+            return
+        finally:
+            with self._running_lock:
+                self._running.pop(job_id, None)
+        self.store.update(job_id, expected_status=("running",), status="done", progress=progress, results=output)
+
+
+# Global instance of the job manager, started with the application
+job_manager = JobManager()
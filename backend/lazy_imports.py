@@ -0,0 +1,73 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Heavy modules to import at startup rather than on first use, e.g. "faiss,httpx,sentence_transformers"
+PRELOAD_MODULES = [name.strip() for name in os.getenv("PRELOAD_MODULES", "").split(",") if name.strip()]
+
+_lock = threading.Lock()
+# Seconds each module took to import through this loader
+_import_seconds: Dict[str, float] = {}
+
+
+class LazyModule:
+    """
+    Stands in for a heavy module (faiss, httpx, ...) and imports it on first attribute
+    access, so a worker that never builds an index or calls an API does not pay for it.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._module or self._load(), attr)
+
+    def _load(self):
+        self._module = load_module(self._name)
+        return self._module
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r} ({'loaded' if self._module else 'not loaded'})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def load_module(name: str):
+    """
+    Import a module, recording how long the first import took.
+    """
+    if name in _import_seconds:
+        return importlib.import_module(name)
+    # Python's import lock already makes concurrent first imports wait for one another
+    with span(f"import.{name}"):
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        seconds = time.perf_counter() - start
+    with _lock:
+        if name not in _import_seconds:
+            _import_seconds[name] = seconds
+            logger.info("Imported %s in %.2fs", name, seconds)
+    return module
+
+
+def preload(names: List[str]):
+    for name in names:
+        load_module(name)
+
+
+def import_stats() -> Dict[str, float]:
+    """
+    {module: import seconds} for the modules loaded so far.
+    """
+    with _lock:
+        return {name: round(seconds, 3) for name, seconds in _import_seconds.items()}
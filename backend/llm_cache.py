@@ -0,0 +1,112 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from storage import data_path
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses keyed by a hash of (model, filled prompt, max_tokens):
+    an in-memory LRU in front of an optional SQLite tier with a TTL.
+    Each entry remembers how long the original call took, so hits can report saved latency.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None,
+                 disk_path: Optional[str] = None, use_disk: Optional[bool] = None):
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_SIZE", "1024"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("LLM_CACHE_TTL", "86400"))
+        use_disk = use_disk if use_disk is not None else os.getenv("LLM_CACHE_DISK", "0") == "1"
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if use_disk:
+            self._conn = sqlite3.connect(disk_path or data_path("llm_cache.sqlite3"), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "collapsed": 0, "saved_seconds": 0.0}
+
+    @staticmethod
+    def key(model: str, prompt: str, max_tokens: int) -> str:
+        payload = json.dumps([model, prompt, max_tokens], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["created"] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._record_hit(entry, "memory_hits")
+                # A copy, so a caller that modifies its response does not change the cached one
+                return copy.deepcopy(entry["response"])
+            if entry is not None:
+                del self._memory[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT response, latency, created FROM responses WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl_seconds),
+                ).fetchone()
+                if row is not None:
+                    entry = {"response": json.loads(row[0]), "latency": row[1], "created": row[2]}
+                    self._put_memory_locked(key, entry)
+                    self._record_hit(entry, "disk_hits")
+                    return copy.deepcopy(entry["response"])
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, response: Dict[str, Any], latency: float):
+        entry = {"response": copy.deepcopy(response), "latency": latency, "created": time.time()}
+        with self._lock:
+            self._put_memory_locked(key, entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, latency, created) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(response), latency, entry["created"]),
+                )
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (entry["created"] - self.ttl_seconds,))
+                self._conn.commit()
+
+    def record_collapsed(self, latency_saved: float = 0.0):
+        with self._lock:
+            self.stats["collapsed"] += 1
+            self.stats["saved_seconds"] += latency_saved
+
+    def clear(self):
+        """
+        Drop every cached response (both tiers); the stats are kept.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._memory)
+            stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        return stats
+
+    def _put_memory_locked(self, key: str, entry: Dict[str, Any]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _record_hit(self, entry: Dict[str, Any], tier: str):
+        self.stats["hits"] += 1
+        self.stats[tier] += 1
+        self.stats["saved_seconds"] += entry["latency"]
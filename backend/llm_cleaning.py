@@ -0,0 +1,290 @@
+import io
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cerebras_client import cerebras_client
+from cleaning import OUTLIER_COLUMN
+from embedding_backends import EMBED_BACKEND, cache_model_name
+from embedding_cache import get_embedding_cache
+from model_registry import model_registry, DEFAULT_MODEL_NAME
+from prompt_templates import CompiledTemplate, estimate_tokens
+from routes.embed import build_combined_text
+from lazy_imports import lazy_import
+
+# Imported on first use (or at startup via PRELOAD_MODULES)
+faiss = lazy_import("faiss")
+
+# Cluster sampling embeds at most this many rows (a uniform sample of larger frames)
+CLUSTER_SAMPLE_ROWS = int(os.getenv("LLM_CLEAN_CLUSTER_ROWS", "20000"))
+
+# Positional key added to each batch when no key column is configured
+ROW_KEY = "_row"
+MAX_STRATA = 100
+
+
+def token_batches(df: pd.DataFrame, budget_tokens: int) -> List[pd.DataFrame]:
+    """
+    Split df into consecutive batches whose CSV rendering fits in budget_tokens.
+    Row sizes are estimated from the string lengths of each column, without rendering the CSV.
+    """
+    if df.empty:
+        return []
+    row_chars = np.full(len(df), len(df.columns), dtype=np.int64)
+    for column in df.columns:
+        row_chars += df[column].astype("string").str.len().fillna(0).to_numpy(dtype=np.int64)
+    row_tokens = row_chars // 4 + 1
+    header_tokens = estimate_tokens(",".join(map(str, df.columns)))
+    room = max(budget_tokens - header_tokens, 1)
+
+    batches = []
+    cumulative = np.cumsum(row_tokens)
+    start, offset = 0, 0
+    while start < len(df):
+        # Last row that still fits; every batch gets at least one row
+        end = max(int(np.searchsorted(cumulative, offset + room, side="right")), start + 1)
+        batches.append(df.iloc[start:end])
+        offset = cumulative[end - 1]
+        start = end
+    return batches
+
+
+def stratified_sample(df: pd.DataFrame, max_rows: int, strata: Optional[str] = None) -> pd.Index:
+    """
+    Flagged outliers first, then a proportional sample of every stratum (at least one row each).
+    Without a strata column, the lowest-cardinality text column with 2-100 values is used.
+    """
+    selected = pd.Index([])
+    if OUTLIER_COLUMN in df.columns:
+        selected = df.index[df[OUTLIER_COLUMN].fillna(False).astype(bool)][:max_rows // 2]
+    rest = df.drop(index=selected)
+    remaining = max_rows - len(selected)
+    if remaining <= 0 or rest.empty:
+        return selected
+
+    if strata is None:
+        candidates = []
+        for column in rest.columns:
+            if pd.api.types.is_string_dtype(rest[column]) or rest[column].dtype == object:
+                unique = rest[column].nunique()
+                if 2 <= unique <= MAX_STRATA:
+                    candidates.append((unique, column))
+        strata = min(candidates)[1] if candidates else None
+
+    if strata is None or strata not in rest.columns:
+        return selected.append(rest.sample(n=min(remaining, len(rest)), random_state=0).index)
+
+    fraction = min(remaining / len(rest), 1.0)
+    picked = []
+    for _, group in rest.groupby(strata, dropna=False, sort=False):
+        size = min(len(group), max(1, int(round(len(group) * fraction))))
+        picked.append(group.sample(n=size, random_state=0).index)
+    sample = picked[0].append(picked[1:]) if picked else pd.Index([])
+    return selected.append(sample[:remaining])
+
+
+def cluster_sample(df: pd.DataFrame, max_rows: int, model_name: Optional[str] = None,
+                   backend: Optional[str] = None) -> pd.Index:
+    """
+    Embed the rows, k-means them into max_rows // 2 clusters and take from each cluster the row
+    nearest its centroid (representative) and the one farthest from it (most anomalous).
+    """
+    model_name = model_name or DEFAULT_MODEL_NAME
+    backend = backend or EMBED_BACKEND
+    pool = df.sample(n=CLUSTER_SAMPLE_ROWS, random_state=0) if len(df) > CLUSTER_SAMPLE_ROWS else df
+    texts = build_combined_text(pool.astype("string"), list(pool.columns)).tolist()
+    model = model_registry.get(model_name, None, backend)
+    embeddings, _ = get_embedding_cache().encode(model.encode, cache_model_name(model_name, backend), texts)
+    vectors = np.ascontiguousarray(embeddings, dtype="float32")
+
+    clusters = max(1, min(max_rows // 2, len(pool)))
+    kmeans = faiss.Kmeans(vectors.shape[1], clusters, niter=20, seed=0)
+    kmeans.train(vectors)
+    distances, labels = kmeans.index.search(vectors, 1)
+    assignments = pd.DataFrame({"cluster": labels[:, 0], "distance": distances[:, 0]}, index=pool.index)
+    grouped = assignments.groupby("cluster")["distance"]
+    picked = pd.Index(grouped.idxmin()).append(pd.Index(grouped.idxmax())).unique()
+    return picked[:max_rows]
+
+
+def parse_csv_response(text: str, columns: List[str], key: str) -> Optional[pd.DataFrame]:
+    """
+    Extract the CSV table from an LLM response (fenced or inline, after any prose) as strings.
+    Returns None if no table with the key column is found.
+    """
+    fenced = re.findall(r"```(?:csv)?\s*\n(.*?)```", text, flags=re.DOTALL)
+    candidates = fenced or [text]
+    for candidate in candidates:
+        lines = candidate.splitlines()
+        header = next((i for i, line in enumerate(lines) if line.strip().strip('"').startswith(key)), None)
+        if header is None:
+            continue
+        try:
+            table = pd.read_csv(io.StringIO("\n".join(lines[header:])), dtype=str, keep_default_na=False,
+                                on_bad_lines="skip", skip_blank_lines=True)
+        except (ValueError, pd.errors.ParserError):
+            continue
+        table.columns = [str(c).strip() for c in table.columns]
+        if key in table.columns:
+            return table[[c for c in table.columns if c in columns or c == key]]
+    return None
+
+
+def merge_corrections(df: pd.DataFrame, corrections: pd.DataFrame, key: str) -> Tuple[int, int]:
+    """
+    Write corrected values into df (in place) for rows matched by key. Values that do not
+    parse as the column's dtype are ignored. Returns (corrected rows, changed cells).
+    """
+    keys = df.index if key == ROW_KEY else pd.Index(df[key].astype(str))
+    corrections = corrections.drop_duplicates(subset=key, keep="first")
+    corrections_keys = corrections[key].astype(str).str.strip()
+    if key == ROW_KEY:
+        corrections_keys = pd.to_numeric(corrections_keys, errors="coerce")
+    positions = keys.get_indexer(corrections_keys)
+    matched = positions >= 0
+    corrections, positions = corrections[matched], positions[matched]
+
+    changed_rows = np.zeros(len(positions), dtype=bool)
+    changed_cells = 0
+    for column in corrections.columns:
+        if column == key or column not in df.columns or pd.api.types.is_bool_dtype(df[column]):
+            continue
+        original = df[column].iloc[positions]
+        values = corrections[column].str.strip()
+        if pd.api.types.is_numeric_dtype(df[column]):
+            parsed = pd.to_numeric(values, errors="coerce")
+            usable = parsed.notna().to_numpy() | (values == "").to_numpy()
+            new = pd.Series(parsed.to_numpy(dtype="float64"), index=original.index)
+            same = (original.to_numpy(dtype="float64", na_value=np.nan) == new.to_numpy()) \
+                | (original.isna().to_numpy() & new.isna().to_numpy())
+            if pd.api.types.is_integer_dtype(df[column]):
+                # Integer columns only take whole-number corrections
+                usable &= new.isna().to_numpy() | (np.mod(new.fillna(0).to_numpy(), 1) == 0)
+        else:
+            usable = np.ones(len(values), dtype=bool)
+            new = pd.Series(values.where(values != "", None).to_numpy(), index=original.index)
+            same = (original.astype("string") == new.astype("string")).fillna(False).to_numpy() \
+                | (original.isna().to_numpy() & new.isna().to_numpy())
+        change = usable & ~same
+        if not change.any():
+            continue
+        _make_room(df, column, new[change])
+        try:
+            df.iloc[positions[change], df.columns.get_loc(column)] = new[change].to_numpy()
+        except (TypeError, ValueError):
+            # The corrected values cannot be stored in this column's dtype
+            continue
+        changed_rows |= change
+        changed_cells += int(change.sum())
+    return int(changed_rows.sum()), changed_cells
+
+
+def _make_room(df: pd.DataFrame, column, values: pd.Series):
+    """
+    Widen a compact column (see ingest.compact_frame) in place so it can hold values: new
+    categories for categoricals, int64/float64 for downcast numbers the values do not fit.
+    """
+    dtype = df[column].dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        added = pd.Index(values.dropna().unique()).difference(dtype.categories)
+        if len(added):
+            df[column] = df[column].cat.add_categories(added)
+    elif isinstance(dtype, np.dtype) and dtype.kind in "iu" and dtype.itemsize < 8:
+        present = values.dropna().to_numpy(dtype="float64")
+        limits = np.iinfo(dtype)
+        if len(present) and (present.min() < limits.min or present.max() > limits.max):
+            df[column] = df[column].astype("int64")
+    elif isinstance(dtype, np.dtype) and dtype.kind == "f" and dtype.itemsize < 8:
+        df[column] = df[column].astype("float64")
+
+
+def llm_clean(df: pd.DataFrame, prompt: str, template: CompiledTemplate, config: Dict[str, Any],
+              max_rows: Optional[int] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Send df (mode "batches") or a representative sample of it (mode "sample") to the LLM in
+    token-budgeted batches, concurrently, and merge the corrected rows back by key.
+    Returns (corrected frame, report).
+    """
+    start = time.perf_counter()
+    df = df.reset_index(drop=True)
+    key = config.get("key") if config.get("key") in df.columns else ROW_KEY
+    report = {"mode": config["llm"], "rows_sent": 0, "batches": 0, "failed_batches": 0,
+              "corrected_rows": 0, "changed_cells": 0, "errors": []}
+
+    rows = df.index
+    if config["llm"] == "sample":
+        budget = config["llm_max_rows"] if max_rows is None else max_rows
+        if budget <= 0 or df.empty:
+            report["seconds"] = 0.0
+            return df, report
+        report["sample"] = config["sample"]
+        if config["sample"] == "cluster":
+            rows = cluster_sample(df, budget, config.get("embed_model")).sort_values()
+        else:
+            rows = stratified_sample(df, budget, config.get("strata")).sort_values()
+
+    to_send = df.loc[rows]
+    if key == ROW_KEY:
+        to_send = to_send.reset_index(names=ROW_KEY)
+    template_tokens = template.tokens + estimate_tokens(prompt)
+    batches = token_batches(to_send, max(config["llm_batch_tokens"] - template_tokens, 1))
+
+    prompts, max_tokens = [], 256
+    for batch in batches:
+        dataset = batch.to_csv(index=False)
+        # Batches are sized to the budget already; rows over it (a single huge row) are not cut
+        prompts.append(template.render(max_tokens=0, dataset=dataset, prompt=prompt))
+        # Room for the corrected rows plus a short rationale
+        max_tokens = max(max_tokens, min(2 * estimate_tokens(dataset) + 256, 4096))
+
+    responses = cerebras_client.generate_many(prompts, max_tokens=max_tokens, concurrency=config["llm_concurrency"])
+    columns = [str(c) for c in to_send.columns]
+    for batch, response in zip(batches, responses):
+        report["batches"] += 1
+        report["rows_sent"] += len(batch)
+        corrections = parse_csv_response(response.get("data") or "", columns, key) if response["success"] else None
+        if corrections is None:
+            report["failed_batches"] += 1
+            if not response["success"]:
+                report["errors"].append(response["error"])
+            continue
+        corrected_rows, changed_cells = merge_corrections(df, corrections, key)
+        report["corrected_rows"] += corrected_rows
+        report["changed_cells"] += changed_cells
+
+    report["errors"] = sorted(set(report["errors"]))
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return df, report
+
+
+def add_llm_report(total: Optional[Dict[str, Any]], part: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Combine the reports of LLM cleaning runs over consecutive chunks.
+    """
+    if total is None:
+        return dict(part)
+    combined = dict(total)
+    for name in ("rows_sent", "batches", "failed_batches", "corrected_rows", "changed_cells", "seconds"):
+        combined[name] = total[name] + part[name]
+    combined["errors"] = sorted(set(total["errors"]) | set(part["errors"]))
+    return combined
+
+
+def format_llm_report(report: Dict[str, Any]) -> str:
+    """
+    LLM cleaning counts as bullet lines for the clean stage summary.
+    """
+    sample = f" ({report['sample']} sample)" if report.get("sample") else ""
+    lines = [
+        f"- LLM rows reviewed: {report['rows_sent']}{sample} in {report['batches']} batches",
+        f"- LLM corrected rows: {report['corrected_rows']} ({report['changed_cells']} cells)",
+    ]
+    if report["failed_batches"]:
+        lines.append(f"- LLM batches without usable output: {report['failed_batches']}")
+    for error in report["errors"]:
+        lines.append(f"- Error: {error}")
+    return "\n".join(lines) + "\n"
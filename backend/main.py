@@ -1,14 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, Request, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import pandas as pd
-import io
-
-from routes.clean import clean_data
-from routes.generate import generate_data
-from routes.embed import vectorize_data
-from routes.enrich import enrich_data
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import os
+import json
+import logging
+import time
+
 from routes.download import router as download_router
+from routes.indexes import router as indexes_router
+from routes.search import router as search_router
+from routes.jobs import router as jobs_router
+from routes.generate import router as generate_router
+from routes.metrics import router as metrics_router
+from lazy_imports import PRELOAD_MODULES, import_stats, preload
+from model_registry import model_registry
+from prompt_templates import prompt_templates
+from stage_cache import stage_cache
+from cerebras_client import cerebras_client
+from index_store import sanitize_index_name
+from embedding_backends import EMBED_BACKENDS
+from cleaning import parse_clean_params
+from generation import parse_generate_params
+from enrichment import parse_enrich_params
+from ingest import load_spooled, spool_upload
+from jobs import job_manager, JobQueueFull
+from pipeline import cached_run, parse_actions, run_clean_file, run_pipeline, stage_executor, streams_from_file
+from telemetry import TELEMETRY_ENABLED, TRACE_HEADER, metrics, span, start_trace
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Media types of /api/process with stream set: server-sent events or newline-delimited JSON
+STREAM_MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
 
 app = FastAPI(title="DataSanity API", description="AI-powered data processing API")
 
@@ -23,46 +47,231 @@ app.add_middleware(
 
 # Include download router
 app.include_router(download_router)
+app.include_router(indexes_router)
+app.include_router(search_router)
+app.include_router(jobs_router)
+app.include_router(generate_router)
+app.include_router(metrics_router)
+
+if TELEMETRY_ENABLED:
+    @app.middleware("http")
+    async def record_request_latency(request: Request, call_next):
+        # Labelled by route template (/api/jobs/{job_id}), not raw path, to keep the series bounded
+        start = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        metrics.request_seconds.observe(time.perf_counter() - start, method=request.method,
+                                        route=route.path if route else "unmatched", status=str(response.status_code))
+        return response
+
+@app.on_event("startup")
+async def preload_models():
+    # Warm the embedding model registry so the first embed request does not pay the load cost
+    preload = [name.strip() for name in os.getenv("EMBED_PRELOAD_MODELS", "").split(",") if name.strip()]
+    if preload:
+        start = time.perf_counter()
+        model_registry.preload(preload)
+        logger.info("Preloaded embedding models %s in %.2fs", preload, time.perf_counter() - start)
+
+@app.on_event("startup")
+async def preload_modules():
+    # Heavy libraries are imported on first use unless listed in PRELOAD_MODULES
+    if PRELOAD_MODULES:
+        start = time.perf_counter()
+        preload(PRELOAD_MODULES)
+        logger.info("Preloaded modules %s in %.2fs", PRELOAD_MODULES, time.perf_counter() - start)
+
+@app.on_event("startup")
+async def load_prompt_templates():
+    # Read and compile the prompt templates once instead of on every request
+    logger.info("Loaded prompt templates %s", prompt_templates.load())
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_manager.start()
+
+@app.on_event("shutdown")
+async def stop_encode_pools():
+    job_manager.stop()
+    model_registry.close_pools()
+    cerebras_client.close()
+    stage_executor.shutdown(wait=False)
 
 @app.get("/")
 async def root():
     return {"message": "DataSanity API is running"}
 
+@app.get("/api/stats")
+async def stats():
+    return {"llm_cache": cerebras_client.cache_stats(), "embedding_models": model_registry.stats(),
+            "stage_cache": stage_cache.snapshot(), "imports": import_stats()}
+
 @app.post("/api/process")
-async def process_data(prompt: str = Form(...), file: UploadFile = File(None)):
-    # Read file if provided
-    df = None
+async def process_data(request: Request, prompt: str = Form(...), file: UploadFile = File(None),
+                       embed_model: str = Form(None), embed_device: str = Form(None),
+                       embed_backend: str = Form(None),
+                       index_name: str = Form(None), id_column: str = Form(None),
+                       index_type: str = Form(None), index_params: str = Form(None),
+                       clean_params: str = Form(None), generate_params: str = Form(None),
+                       enrich_params: str = Form(None),
+                       columns: str = Form(None), background: bool = Form(False),
+                       priority: int = Form(0), stream: str = Form(None)):
+    # With the debug header set, the timed steps of this request are returned under "trace"
+    trace = start_trace() if TELEMETRY_ENABLED and request.headers.get(TRACE_HEADER) == "1" else None
+    
+    # Parse optional ANN index parameters, e.g. '{"nlist": 1024, "nprobe": 16, "M": 32}'
+    try:
+        ann_params = json.loads(index_params) if index_params else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "index_params must be a JSON object"})
+    
+    # Parse optional cleaning options, e.g. '{"missing": {"Age": "median", "*": "drop"}, "outliers": "iqr"}'
+    try:
+        cleaning = json.loads(clean_params) if clean_params else None
+        parse_clean_params(cleaning)
+    except (ValueError, AttributeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid clean_params: {e}"})
+    
+    # Parse optional generation options, e.g. '{"mode": "local", "count": 1000000, "seed": 7}'
+    try:
+        generation = json.loads(generate_params) if generate_params else None
+        parse_generate_params(generation)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid generate_params: {e}"})
+    
+    # Parse optional enrichment options, e.g. '{"columns": ["City"], "backend": "serper"}'
+    try:
+        enrichment = json.loads(enrich_params) if enrich_params else None
+        parse_enrich_params(enrichment)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid enrich_params: {e}"})
+    
+    if embed_backend and embed_backend not in EMBED_BACKENDS:
+        return JSONResponse(status_code=400, content={"error": f"embed_backend must be one of {', '.join(EMBED_BACKENDS)}"})
+    
+    if stream and stream not in STREAM_MEDIA_TYPES:
+        return JSONResponse(status_code=400, content={"error": "stream must be 'sse' or 'ndjson'"})
+    
+    selected = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    options = {
+        "embed_model": embed_model,
+        "embed_device": embed_device,
+        "embed_backend": embed_backend,
+        "index_name": index_name or sanitize_index_name(file.filename if file else None),
+        "id_column": id_column,
+        "index_type": index_type,
+        "index_params": ann_params,
+        "clean_params": cleaning,
+        "generate_params": generation,
+        "enrich_params": enrichment,
+        "columns": selected,
+    }
+    
+    # Spool the upload to disk as it streams in, fingerprinting it for the stage cache
+    input_path = None
+    start = time.perf_counter()
     if file and file.filename:
-        contents = await file.read()
-        df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-    
-    # Parse prompt to determine which actions to take
-    # This is a simplified parser - in a real application, you might use an LLM to parse this
-    actions = []
-    if "clean" in prompt.lower():
-        actions.append("clean")
-    if "generate" in prompt.lower():
-        actions.append("generate")
-    if "vectorize" in prompt.lower() or "embed" in prompt.lower():
-        actions.append("embed")
-    if "enrich" in prompt.lower():
-        actions.append("enrich")
+        with span("ingest.spool") as spool_span:
+            input_path, options["dataset_fingerprint"] = await spool_upload(file)
+            spool_span.set(bytes=os.path.getsize(input_path))
     
-    # Process data based on requested actions
-    results = {}
+    if background:
+        # Queue the work and return a job ID to poll instead of holding the request open
+        try:
+            job = job_manager.submit(prompt, options, input_path, priority)
+        except JobQueueFull as e:
+            if input_path:
+                os.remove(input_path)
+            return JSONResponse(status_code=429, content={"error": str(e)})
+        return JSONResponse(status_code=202, content={"jobId": job["id"], "status": job["status"]})
+    
+    if stream:
+        # Send events as each stage starts, makes progress and finishes, then the full results
+        return StreamingResponse(_stream_events(prompt, options, input_path, start, trace, stream),
+                                 media_type=STREAM_MEDIA_TYPES[stream],
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
     
-    if "clean" in actions:
-        results["cleanedData"] = clean_data(df, prompt) if df is not None else "No data provided for cleaning"
+    return _respond(await _process(prompt, options, input_path, start), trace)
+
+async def _process(prompt: str, options: dict, input_path, start: float, on_event=None) -> dict:
+    """
+    Run the requested actions on the spooled upload (removed afterwards), or replay them from
+    the stage cache. on_event receives the stage events (see pipeline.EventCallback).
+    """
+    if input_path and streams_from_file(prompt):
+        # Clean-only requests stream the spooled file through the cleaning engine instead of loading it
+        try:
+            size = os.path.getsize(input_path)
+            results = await run_clean_file(input_path, prompt, options, on_event)
+        finally:
+            os.remove(input_path)
+        results["ingest"] = {"bytes": size, "streamed": True, "seconds": round(time.perf_counter() - start, 3)}
+        return results
     
-    if "generate" in actions:
-        results["generatedData"] = generate_data(prompt)
+    df = None
+    ingest_stats = None
+    if input_path:
+        try:
+            # A repeat of an earlier run on the same data is answered from the stage cache without parsing
+            results = await cached_run(prompt, options)
+            if results is not None:
+                return results
+            # Parse with Arrow
+            df, ingest_stats = await load_spooled(input_path, options["columns"])
+        finally:
+            os.remove(input_path)
+        ingest_stats["fingerprint"] = options["dataset_fingerprint"]
+        ingest_stats["seconds"] = round(time.perf_counter() - start, 3)
     
-    if "embed" in actions:
-        results["vectorizedData"] = vectorize_data(df, prompt) if df is not None else "No data provided for vectorization"
+    # Process data based on requested actions
+    # Independent actions run concurrently: CPU-bound stages in the stage thread pool,
+    # LLM-bound stages directly on the event loop
+    results = await run_pipeline(df, prompt, options, on_event)
+    if ingest_stats is not None:
+        results["ingest"] = ingest_stats
+    return results
+
+async def _stream_events(prompt: str, options: dict, input_path, start: float, trace, fmt: str):
+    """
+    Run the request in a task and yield its events as they happen: "accepted" (the actions),
+    then "started", "progress" and "finished" per stage, and finally "result" (the same
+    JSON as /api/process returns) or "error".
+    """
+    events: asyncio.Queue = asyncio.Queue()
     
-    if "enrich" in actions:
-        results["enrichedData"] = enrich_data(df, prompt) if df is not None else "No data provided for enrichment"
+    def on_event(event: str, action: str, payload: dict):
+        events.put_nowait((event, {"action": action, **payload}))
     
+    async def run():
+        try:
+            results = await _process(prompt, options, input_path, start, on_event)
+            if trace is not None:
+                results["trace"] = trace
+            events.put_nowait(("result", results))
+        except Exception as e:
+            logger.exception("Streamed request failed")
+            events.put_nowait(("error", {"error": str(e)}))
+    
+    task = asyncio.ensure_future(run())
+    try:
+        yield _format_event("accepted", {"actions": parse_actions(prompt)}, fmt)
+        while True:
+            event, data = await events.get()
+            yield _format_event(event, data, fmt)
+            if event in ("result", "error"):
+                break
+    finally:
+        # Stops the run if the client disconnects
+        task.cancel()
+
+def _format_event(event: str, data: dict, fmt: str) -> str:
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+    return json.dumps({"event": event, "data": data}, default=str) + "\n"
+
+def _respond(results: dict, trace) -> JSONResponse:
+    if trace is not None:
+        results["trace"] = trace
     return JSONResponse(content=results)
 
 if __name__ == "__main__":
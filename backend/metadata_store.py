@@ -0,0 +1,77 @@
+import json
+import os
+import sqlite3
+from typing import Dict, Any, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+class MetadataStore:
+    """
+    Per-index row metadata in SQLite, keyed by vector ID.
+    Each row keeps its combined text and the source row as a JSON document, so a search
+    can look up just the IDs it returned instead of parsing the whole dataset.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, text TEXT, source_row TEXT)"
+        )
+        self._conn.commit()
+
+    def upsert(self, ids: np.ndarray, texts: List[str], df: pd.DataFrame):
+        """
+        Insert or replace metadata for the rows of df. Rows are serialized in one
+        vectorized to_json call rather than row by row. Call commit() to persist.
+        """
+        if len(df) == 0:
+            return
+        source_rows = df.to_json(orient="records", lines=True, date_format="iso").splitlines()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO rows (id, text, source_row) VALUES (?, ?, ?)",
+            zip(ids.tolist(), texts, source_rows),
+        )
+
+    def get(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Return {id: {"id", "text", "source_row"}} for the requested IDs that exist.
+        """
+        ids = [int(i) for i in ids]
+        found = {}
+        for start in range(0, len(ids), _SQL_BATCH):
+            chunk = ids[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(chunk))
+            for row_id, text, source_row in self._conn.execute(
+                f"SELECT id, text, source_row FROM rows WHERE id IN ({placeholders})", chunk
+            ):
+                found[row_id] = {"id": row_id, "text": text, "source_row": json.loads(source_row)}
+        return found
+
+    def delete(self, ids: Iterable[int]):
+        ids = [int(i) for i in ids]
+        for start in range(0, len(ids), _SQL_BATCH):
+            chunk = ids[start:start + _SQL_BATCH]
+            self._conn.execute(f"DELETE FROM rows WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def clear(self):
+        self._conn.execute("DELETE FROM rows")
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def metadata_path(index_dir: str) -> str:
+    return os.path.join(index_dir, "metadata.sqlite3")
@@ -0,0 +1,215 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from embedding_backends import EMBED_BACKEND, load_model
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
+DEFAULT_DEVICE = os.getenv("EMBED_DEVICE", "cpu")
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of SentenceTransformer models.
+    Each (model name, device, backend) is loaded once per worker and evicted
+    least-recently-used first when the memory budget is exceeded.
+    """
+
+    def __init__(self, memory_budget_mb: Optional[float] = None):
+        budget = memory_budget_mb or float(os.getenv("EMBED_MODEL_MEMORY_MB", "2048"))
+        self.memory_budget_bytes = int(budget * 1024 * 1024)
+        self._models: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str, str], threading.Lock] = {}
+        self._pools: Dict[Tuple[str, str, str], Any] = {}
+
+    def get(self, model_name: Optional[str] = None, device: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Return a loaded model, loading it on first use.
+        """
+        model, _ = self.get_with_info(model_name, device, backend)
+        return model
+
+    def get_with_info(self, model_name: Optional[str] = None, device: Optional[str] = None,
+                      backend: Optional[str] = None):
+        """
+        Return (model, info) where info reports whether the model was already warm
+        and how long the load took.
+        """
+        key = (model_name or DEFAULT_MODEL_NAME, device or DEFAULT_DEVICE, backend or EMBED_BACKEND)
+
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return entry["model"], {"warm": True, "load_seconds": 0.0}
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different models can load in parallel,
+        # while concurrent requests for the same model wait for a single load
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    self._models.move_to_end(key)
+                    return entry["model"], {"warm": True, "load_seconds": 0.0}
+
+            # sentence_transformers (and torch) is only imported by workers that embed
+            start = time.perf_counter()
+            model = load_model(*key)
+            load_seconds = time.perf_counter() - start
+            size_bytes = _model_size_bytes(model)
+            logger.info(
+                "Loaded embedding model %s on %s (%s backend) in %.2fs (%.1f MB)",
+                key[0], key[1], key[2], load_seconds, size_bytes / (1024 * 1024),
+            )
+
+            with self._lock:
+                self._models[key] = {"model": model, "size_bytes": size_bytes}
+                evicted_pools = self._evict_locked(keep=key)
+            _stop_pools(evicted_pools)
+
+        return model, {"warm": False, "load_seconds": load_seconds}
+
+    def get_pool(self, model_name: Optional[str] = None, device: Optional[str] = None, processes: int = 2,
+                 backend: Optional[str] = None):
+        """
+        Return (model, pool) where pool is a multi-process encode pool started once and
+        reused across requests.
+        """
+        key = (model_name or DEFAULT_MODEL_NAME, device or DEFAULT_DEVICE, backend or EMBED_BACKEND)
+        model = self.get(*key)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                return model, pool
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Spawning the workers takes seconds: do it under the model's load lock only, so other
+        # models (and stats()) are not held up, while concurrent callers share one pool
+        with load_lock:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is not None:
+                    return model, pool
+            pool = model.start_multi_process_pool(target_devices=[key[1]] * processes)
+            logger.info("Started %d-process encode pool for %s on %s", processes, key[0], key[1])
+            with self._lock:
+                self._pools[key] = pool
+                if key not in self._models:
+                    # Evicted while the pool started; the pool holds it, so track it again
+                    self._models[key] = {"model": model, "size_bytes": _model_size_bytes(model)}
+                self._models.move_to_end(key)
+                evicted_pools = self._evict_locked(keep=key)
+        _stop_pools(evicted_pools)
+        return model, pool
+
+    def close_pools(self):
+        """
+        Stop all multi-process encode pools (e.g. at application shutdown).
+        """
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        _stop_pools(list(pools.values()))
+
+    def preload(self, model_names: List[str], device: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Load models ahead of the first request (e.g. at application startup).
+        """
+        for name in model_names:
+            self.get(name, device, backend)
+
+    def register(self, model_name: str, model, device: Optional[str] = None, backend: Optional[str] = None):
+        """
+        Serve an already constructed model (anything with encode()) under model_name,
+        e.g. a lightweight stand-in for benchmarks.
+        """
+        key = (model_name, device or DEFAULT_DEVICE, backend or EMBED_BACKEND)
+        with self._lock:
+            self._models[key] = {"model": model, "size_bytes": _model_size_bytes(model)}
+            evicted_pools = self._evict_locked(keep=key)
+        _stop_pools(evicted_pools)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the currently loaded models and their estimated memory use.
+        """
+        with self._lock:
+            return {
+                "models": [
+                    {"name": name, "device": device, "backend": backend,
+                     "size_mb": round(entry["size_bytes"] / (1024 * 1024), 1)}
+                    for (name, device, backend), entry in self._models.items()
+                ],
+                "memory_budget_mb": self.memory_budget_bytes / (1024 * 1024),
+            }
+
+    def _evict_locked(self, keep: Tuple[str, str, str]) -> List[Any]:
+        """
+        Drop least-recently-used models (and their encode pools, which hold the model too)
+        until the budget is met. Returns the removed pools for the caller to stop outside the lock.
+        """
+        total = sum(entry["size_bytes"] for entry in self._models.values())
+        pools = []
+        for key in list(self._models.keys()):
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._models.pop(key)["size_bytes"]
+            pool = self._pools.pop(key, None)
+            if pool is not None:
+                pools.append(pool)
+            logger.info("Evicted embedding model %s on %s (%s backend)", *key)
+        return pools
+
+
+def _stop_pools(pools: List[Any]):
+    if not pools:
+        # Nothing to stop; do not import sentence_transformers just to shut down
+        return
+    from sentence_transformers import SentenceTransformer
+    for pool in pools:
+        SentenceTransformer.stop_multi_process_pool(pool)
+
+
+def _model_size_bytes(model) -> int:
+    """
+    Estimated memory of a model's weights: its torch state_dict, which unlike parameters()
+    includes the packed weights of dynamically quantized layers, or for ONNX Runtime
+    models (weights outside torch) the size of the ONNX file the session was loaded from.
+    """
+    try:
+        size = sum(_tensor_bytes(value) for value in model.state_dict().values())
+    except Exception:
+        size = 0
+    return size or _onnx_file_bytes(model)
+
+
+def _tensor_bytes(value) -> int:
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    try:
+        return value.numel() * value.element_size()
+    except AttributeError:
+        return 0
+
+
+def _onnx_file_bytes(model) -> int:
+    modules = model.children() if hasattr(model, "children") else ()
+    for module in modules:
+        # sentence-transformers keeps the optimum ORTModel on its Transformer module
+        path = getattr(getattr(module, "model", None), "model_path", None)
+        if path and os.path.isfile(path):
+            # Large exports keep their weights in an external data file next to the graph
+            return sum(os.path.getsize(p) for p in (str(path), f"{path}_data") if os.path.isfile(p))
+    return 0
+
+
+# Global instance of the model registry
+model_registry = ModelRegistry()
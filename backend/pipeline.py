@@ -0,0 +1,413 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from routes.clean import clean_dataset, clean_file
+from routes.generate import agenerate_data
+from routes.embed import vectorize_data
+from routes.enrich import aenrich_data
+from cleaning import parse_clean_params
+from enrichment import parse_enrich_params
+from generation import parse_generate_params
+from embedding_backends import EMBED_BACKEND
+from index_store import INDEX_PRECISION, index_store, sanitize_index_name
+from ingest import INGEST_COMPACT
+from progress import reset_reporter, set_reporter
+from prompt_templates import prompt_templates
+from result_store import result_store
+from stage_cache import STAGE_CACHE_ENABLED, stage_cache
+from telemetry import bind, span
+
+logger = logging.getLogger(__name__)
+
+# CPU-bound stages (pandas, embedding, FAISS) run in this pool so they do not stall the event loop
+stage_executor = ThreadPoolExecutor(max_workers=int(os.getenv("STAGE_WORKERS", "4")), thread_name_prefix="stage")
+DEFAULT_STAGE_TIMEOUT = float(os.getenv("STAGE_TIMEOUT", "600"))
+
+# Response key for each action
+RESULT_KEYS = {
+    "clean": "cleanedData",
+    "generate": "generatedData",
+    "embed": "vectorizedData",
+    "enrich": "enrichedData",
+}
+
+NO_DATA_MESSAGES = {
+    "clean": "No data provided for cleaning",
+    "embed": "No data provided for vectorization",
+    "enrich": "No data provided for enrichment",
+}
+
+# Bump a stage's version when its output changes for the same data, prompt and options,
+# so outputs cached by the previous code are not reused
+STAGE_VERSIONS = {"clean": 1, "clean_file": 1, "generate": 1, "embed": 1, "enrich": 1}
+EMBED_OPTIONS = ("embed_model", "embed_device", "embed_backend", "index_name", "id_column", "index_type", "index_params")
+CACHED_FRAME_FILE = "data.parquet"
+
+# on_event(event, action, payload) is called on the event loop as stages start ("started"),
+# report progress ("progress": rows done, total, a preview of the first output) and finish ("finished")
+EventCallback = Callable[[str, str, Dict[str, Any]], None]
+
+
+def parse_actions(prompt: str) -> List[str]:
+    """
+    Parse prompt to determine which actions to take.
+    This is a simplified parser - in a real application, you might use an LLM to parse this
+    """
+    actions = []
+    if "clean" in prompt.lower():
+        actions.append("clean")
+    if "generate" in prompt.lower():
+        actions.append("generate")
+    if "vectorize" in prompt.lower() or "embed" in prompt.lower():
+        actions.append("embed")
+    if "enrich" in prompt.lower():
+        actions.append("enrich")
+    return actions
+
+
+def _stage_work(action: str, df: Optional[pd.DataFrame], prompt: str, options: Dict[str, Any]):
+    """
+    Return an awaitable for one action: CPU-bound stages are submitted to the stage
+    thread pool, LLM-bound stages are coroutines on the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if action == "clean":
+        return loop.run_in_executor(stage_executor, bind(clean_dataset, df, prompt, options.get("clean_params")))
+    if action == "generate":
+        return agenerate_data(prompt, df, options.get("generate_params"))
+    if action == "embed":
+        embed = functools.partial(
+            vectorize_data, df, prompt, options.get("embed_model"), options.get("embed_device"),
+            index_name=options.get("index_name"), id_column=options.get("id_column"),
+            index_type=options.get("index_type"), index_params=options.get("index_params"),
+            backend=options.get("embed_backend")
+        )
+        return loop.run_in_executor(stage_executor, bind(embed))
+    if action == "enrich":
+        return aenrich_data(df, prompt, options.get("enrich_params"))
+    raise ValueError(f"Unknown action: {action}")
+
+
+def _progress_callback(action: str, on_event: EventCallback) -> Callable[[Dict[str, Any]], None]:
+    """
+    Forward a stage's report_progress() calls to on_event on this event loop, since stages
+    report from the stage thread pool and the enrichment client's loop too.
+    """
+    loop = asyncio.get_running_loop()
+
+    def forward(payload: Dict[str, Any]):
+        try:
+            loop.call_soon_threadsafe(on_event, "progress", action, payload)
+        except RuntimeError:
+            # The loop is gone: the stage outlived its timeout or a cancelled request
+            pass
+    return forward
+
+
+async def _run_stage(action: str, start_work: Callable[[], Awaitable], on_event: Optional[EventCallback]) -> Tuple[str, Any, float]:
+    """
+    Start one stage's work and await it with its timeout. Failures become an error message
+    for that stage instead of failing the whole request. Returns (output, result, elapsed seconds),
+    where result is the stage's output frame (or stored result ID when streamed), else None.
+    """
+    timeout = float(os.getenv(f"STAGE_TIMEOUT_{action.upper()}", DEFAULT_STAGE_TIMEOUT))
+    if on_event:
+        on_event("started", action, {})
+    # Set before the work starts, so executor calls (bound to this context) report to it too
+    token = set_reporter(_progress_callback(action, on_event) if on_event else None)
+    start = time.perf_counter()
+    frame = None
+    with span(f"stage.{action}") as stage_span:
+        try:
+            output = await asyncio.wait_for(start_work(), timeout)
+            if isinstance(output, tuple):
+                # Stages that transform the data return (summary, frame or result ID)
+                output, frame = output
+            if isinstance(frame, pd.DataFrame):
+                stage_span.set(rows=len(frame))
+        except asyncio.TimeoutError:
+            output = f"Error: {action} timed out after {timeout:.0f}s"
+            stage_span.set(error="timeout")
+        except Exception as e:
+            logger.exception("Stage %s failed", action)
+            output = f"Error: {action} failed: {e}"
+            stage_span.set(error=type(e).__name__)
+        finally:
+            reset_reporter(token)
+    seconds = time.perf_counter() - start
+    if on_event:
+        on_event("finished", action, {"output": output, "seconds": round(seconds, 3)})
+    return output, frame, seconds
+
+
+def _stage_config(stage: str, options: Dict[str, Any]) -> Any:
+    # The options a stage reads, with defaults filled in, so equivalent requests share entries
+    if stage in ("clean", "clean_file"):
+        return parse_clean_params(options.get("clean_params"))
+    if stage == "generate":
+        return parse_generate_params(options.get("generate_params"))
+    if stage == "enrich":
+        return parse_enrich_params(options.get("enrich_params"))
+    config = {name: options.get(name) for name in EMBED_OPTIONS}
+    # Worker defaults that change the vectors or the index
+    config["embed_backend"] = config["embed_backend"] or EMBED_BACKEND
+    config["index_precision"] = INDEX_PRECISION
+    return config
+
+
+def _stage_key(stage: str, prompt: str, options: Dict[str, Any]) -> Optional[str]:
+    """
+    Stage cache key: the uploaded dataset's fingerprint (and the columns read from it), the
+    normalized prompt, the stage, its version, its options and its prompt template.
+    None when the request has no uploaded dataset or the cache is off.
+    """
+    fingerprint = options.get("dataset_fingerprint")
+    if not STAGE_CACHE_ENABLED or fingerprint is None:
+        return None
+    template = prompt_templates.get("clean" if stage == "clean_file" else stage)
+    return stage_cache.key(
+        fingerprint, options.get("columns"), INGEST_COMPACT, " ".join(prompt.split()),
+        stage, STAGE_VERSIONS[stage], _stage_config(stage, options), template.text if template else None,
+    )
+
+
+def _run_key(prompt: str, options: Dict[str, Any]) -> Optional[str]:
+    keys = [_stage_key(action, prompt, options) for action in parse_actions(prompt)]
+    if not keys or None in keys:
+        return None
+    return stage_cache.key("run", keys)
+
+
+def _cacheable(output: Any) -> bool:
+    # Failed stages and LLM fallbacks are retried on the next request rather than replayed
+    return isinstance(output, str) and not output.startswith("Error") and "API call failed" not in output
+
+
+def _cached_result_id(entry: Dict[str, Any]) -> Optional[str]:
+    """
+    The stored result of a cached stage, republished from the cached copy if it was pruned.
+    """
+    result_id = entry["meta"].get("result_id")
+    if result_id is not None and result_store.manifest(result_id) is not None:
+        return result_id
+    path = entry["files"].get(CACHED_FRAME_FILE)
+    if path is None:
+        return None
+    return result_store.publish_file(path, entry["meta"].get("info"))
+
+
+def _load_cached_stage(stage: str, key: str) -> Optional[Tuple[str, Any]]:
+    """
+    (output, frame or result ID) of a cached stage, or None if it is not cached or no longer
+    valid (e.g. the index it built has moved on to a newer version).
+    """
+    entry = stage_cache.get(key)
+    if entry is None:
+        return None
+    meta = entry["meta"]
+    if stage == "embed":
+        manifest = index_store.manifest(meta["index_name"])
+        if manifest is None or manifest["version"] != meta["index_version"]:
+            stage_cache.delete(key)
+            return None
+        return entry["output"], None
+    if stage == "clean":
+        return entry["output"], pd.read_parquet(entry["files"][CACHED_FRAME_FILE])
+    result_id = _cached_result_id(entry)
+    return (entry["output"], result_id) if result_id is not None else None
+
+
+def _store_stage(stage: str, key: str, output: str, result: Any, result_id: Optional[str],
+                 options: Dict[str, Any]):
+    """
+    Cache a stage output. Frames are taken from the result store (hard-linked, not rewritten):
+    the stage's own result, or for cleaning the run's result, which is the cleaned frame.
+    """
+    try:
+        if stage == "embed":
+            index_name = sanitize_index_name(options.get("index_name"))
+            manifest = index_store.manifest(index_name)
+            if manifest is not None:
+                stage_cache.put(key, output, {"index_name": index_name, "index_version": manifest["version"]})
+            return
+        stored_id = result if isinstance(result, str) else result_id
+        if stored_id is None:
+            return
+        stage_cache.put(key, output, {"result_id": stored_id, "info": result_store.info(stored_id)},
+                        {CACHED_FRAME_FILE: result_store.data_path(stored_id)})
+    except Exception:
+        # Caching is best effort; the request already has its results
+        logger.exception("Failed to cache %s stage output", stage)
+
+
+def _load_cached_run(key: str) -> Optional[Dict[str, Any]]:
+    entry = stage_cache.get(key)
+    if entry is None:
+        return None
+    meta = entry["meta"]
+    ids = [meta["result_id"], *meta["stage_results"].values()]
+    if any(result_store.manifest(result_id) is None for result_id in ids):
+        return None
+    if meta.get("index_name") is not None:
+        manifest = index_store.manifest(meta["index_name"])
+        if manifest is None or manifest["version"] != meta["index_version"]:
+            return None
+    return entry["output"]
+
+
+async def cached_run(prompt: str, options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The results of an earlier identical run (same dataset, prompt and options) whose stored
+    results are all still available, without parsing the data or running any stage.
+    """
+    key = _run_key(prompt, options)
+    if key is None:
+        return None
+    start = time.perf_counter()
+    with span("stage_cache.run") as cache_span:
+        results = await asyncio.get_running_loop().run_in_executor(stage_executor, _load_cached_run, key)
+        cache_span.set(cache_hits=int(results is not None), cache_misses=int(results is None))
+    if results is None:
+        return None
+    seconds = round(time.perf_counter() - start, 3)
+    results["timings"] = {action: seconds for action in parse_actions(prompt)}
+    results["stageCache"] = {action: "hit" for action in parse_actions(prompt)}
+    return results
+
+
+def _store_run(key: str, results: Dict[str, Any], options: Dict[str, Any], embedded: bool):
+    stage_results = {name: value for name, value in results.items() if name.endswith("ResultId")}
+    meta = {"result_id": results["resultId"], "stage_results": stage_results}
+    if embedded:
+        meta["index_name"] = sanitize_index_name(options.get("index_name"))
+        manifest = index_store.manifest(meta["index_name"])
+        meta["index_version"] = manifest["version"] if manifest else None
+    output = {name: value for name, value in results.items() if name not in ("timings", "stageCache")}
+    try:
+        stage_cache.put(key, output, meta)
+    except Exception:
+        logger.exception("Failed to cache pipeline run")
+
+
+def streams_from_file(prompt: str) -> bool:
+    """
+    Clean-only runs do not need the data in memory: run_clean_file streams it from disk.
+    """
+    return parse_actions(prompt) == ["clean"]
+
+
+async def run_clean_file(path: str, prompt: str, options: Optional[Dict[str, Any]] = None,
+                         on_event: Optional[EventCallback] = None) -> Dict[str, Any]:
+    """
+    Clean a spooled CSV chunk by chunk straight into the result store, so files larger
+    than memory can be cleaned. Returns the same keys as run_pipeline.
+    """
+    options = options or {}
+    loop = asyncio.get_running_loop()
+    key = _stage_key("clean_file", prompt, options)
+    cached = await loop.run_in_executor(stage_executor, _load_cached_stage, "clean_file", key) if key else None
+    if cached is not None:
+        work = functools.partial(asyncio.sleep, 0, cached)
+    else:
+        work = lambda: loop.run_in_executor(
+            stage_executor, bind(clean_file, path, prompt, options.get("clean_params"), options.get("columns"))
+        )
+    output, result_id, seconds = await _run_stage("clean", work, on_event)
+    results = {RESULT_KEYS["clean"]: output}
+    if result_id is not None:
+        results["resultId"] = result_id
+    results["timings"] = {"clean": round(seconds, 3)}
+    if key is not None:
+        results["stageCache"] = {"clean": "hit" if cached is not None else "miss"}
+        if cached is None and result_id is not None and _cacheable(output):
+            await loop.run_in_executor(stage_executor, _store_stage, "clean_file", key, output, result_id, None, options)
+    return results
+
+
+def _save_result(df: Optional[pd.DataFrame], frame: Optional[pd.DataFrame], options: Dict[str, Any],
+                 embedded: bool) -> Optional[str]:
+    """
+    Store the run's resulting frame (the cleaned data if cleaning ran, else the input)
+    and its FAISS index, so /api/download can serve them by result ID.
+    """
+    result = frame if frame is not None else df
+    if result is None:
+        return None
+    artifacts = {}
+    if embedded and options.get("index_name"):
+        index_path = index_store.current_index_path(options["index_name"])
+        if index_path is not None:
+            artifacts["faiss_index"] = index_path
+    try:
+        return result_store.save(result, artifacts, {"index_name": options.get("index_name")})
+    except Exception:
+        # A result that cannot be stored should not fail the run; it is just not downloadable
+        logger.exception("Failed to store pipeline result")
+        return None
+
+
+async def run_pipeline(df: Optional[pd.DataFrame], prompt: str, options: Optional[Dict[str, Any]] = None,
+                       on_event: Optional[EventCallback] = None) -> Dict[str, Any]:
+    """
+    Run the actions requested by the prompt concurrently and collect their outputs
+    under the response keys, plus per-action timings.
+    """
+    options = options or {}
+    results = {}
+    stages = {}
+    keys = {}
+    cache_status = {}
+    loop = asyncio.get_running_loop()
+    for action in parse_actions(prompt):
+        if df is None and action in NO_DATA_MESSAGES:
+            results[RESULT_KEYS[action]] = NO_DATA_MESSAGES[action]
+            continue
+        key = _stage_key(action, prompt, options)
+        cached = await loop.run_in_executor(stage_executor, _load_cached_stage, action, key) if key else None
+        if key is not None:
+            keys[action] = key
+            cache_status[action] = "hit" if cached is not None else "miss"
+        # A cached stage replays its output instead of running again
+        if cached is not None:
+            stages[action] = functools.partial(asyncio.sleep, 0, cached)
+        else:
+            stages[action] = functools.partial(_stage_work, action, df, prompt, options)
+
+    outcomes = await asyncio.gather(*(_run_stage(action, work, on_event) for action, work in stages.items()))
+    timings = {}
+    frame = None
+    for action, (output, stage_frame, seconds) in zip(stages.keys(), outcomes):
+        results[RESULT_KEYS[action]] = output
+        timings[action] = round(seconds, 3)
+        if isinstance(stage_frame, str):
+            # Stages that write their own result (generation, enrichment) return its ID
+            results[f"{action}ResultId"] = stage_frame
+        elif stage_frame is not None:
+            frame = stage_frame
+
+    # Persist the result off the event loop; Parquet writing is CPU- and disk-bound
+    result_id = await loop.run_in_executor(
+        stage_executor, bind(_save_result, df, frame, options, "embed" in stages)
+    )
+    if result_id is not None:
+        results["resultId"] = result_id
+
+    if keys:
+        # Cache the new stage outputs, and the whole run when every stage can be replayed
+        for action, (output, stage_frame, _) in zip(stages.keys(), outcomes):
+            if cache_status.get(action) == "miss" and _cacheable(output):
+                await loop.run_in_executor(stage_executor, _store_stage, action, keys[action], output, stage_frame,
+                                           result_id if action == "clean" else None, options)
+        run_key = _run_key(prompt, options)
+        if run_key is not None and result_id is not None and all(_cacheable(results[RESULT_KEYS[a]]) for a in keys):
+            await loop.run_in_executor(stage_executor, _store_run, run_key, results, options, "embed" in stages)
+        results["stageCache"] = cache_status
+    results["timings"] = timings
+    return results
@@ -0,0 +1,72 @@
+import contextvars
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+# Rows of a stage's first output chunk sent with its progress, so clients can show them early
+PROGRESS_PREVIEW_ROWS = int(os.getenv("PROGRESS_PREVIEW_ROWS", "10"))
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# The running stage's progress callback; executor work started with telemetry.bind inherits it
+_reporter: contextvars.ContextVar[Optional[ProgressCallback]] = contextvars.ContextVar("progress", default=None)
+# Set when the run is cancelled (e.g. a cancelled job); inherited the same way
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar("cancel", default=None)
+
+
+class StageCancelled(Exception):
+    """
+    Raised inside stage work (e.g. in the stage thread pool, which task cancellation does
+    not reach) once its run has been cancelled.
+    """
+
+
+def set_reporter(callback: Optional[ProgressCallback]) -> contextvars.Token:
+    return _reporter.set(callback)
+
+
+def reset_reporter(token: contextvars.Token):
+    _reporter.reset(token)
+
+
+def set_cancel_event(event: Optional[threading.Event]) -> contextvars.Token:
+    return _cancel_event.set(event)
+
+
+def check_cancelled():
+    """
+    Raise StageCancelled if the current run was cancelled. report_progress checks too, so
+    chunk loops stop at their next report.
+    """
+    event = _cancel_event.get()
+    if event is not None and event.is_set():
+        raise StageCancelled("Cancelled")
+
+
+def current_reporter() -> Optional[ProgressCallback]:
+    """
+    The callback for the current stage, for code that reports from a thread or event loop
+    the context does not reach (e.g. the enrichment client's loop).
+    """
+    return _reporter.get()
+
+
+def report_progress(**payload: Any):
+    """
+    Report progress of the current stage, e.g. `report_progress(rows=done, total=n)`.
+    A no-op outside a stage run with an event callback. Raises StageCancelled once the
+    run has been cancelled.
+    """
+    check_cancelled()
+    reporter = _reporter.get()
+    if reporter is not None:
+        reporter(payload)
+
+
+def preview_csv(chunk: pd.DataFrame) -> str:
+    """
+    The first rows of an output chunk as CSV, for the "preview" of a progress event.
+    """
+    return chunk.head(PROGRESS_PREVIEW_ROWS).to_csv(index=False)
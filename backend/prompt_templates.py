@@ -0,0 +1,173 @@
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts"))
+# Upper bound on a rendered prompt; the {{dataset}} section is truncated to fit
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "6000"))
+# 1 re-reads a template file when it changes on disk, checked at most every PROMPTS_RELOAD_INTERVAL seconds
+PROMPTS_HOT_RELOAD = os.getenv("PROMPTS_HOT_RELOAD", "0") == "1"
+PROMPTS_RELOAD_INTERVAL = 1.0
+
+TEMPLATE_SUFFIX = "_template.txt"
+# The section shortened when a prompt is over budget
+TRUNCATED_FIELD = "dataset"
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough count for budgeting; about 4 characters per token for English and CSV
+    return len(text) // 4 + 1
+
+
+class CompiledTemplate:
+    """
+    A prompt template split once into literal text and {{placeholder}} slots, so rendering is
+    a single join instead of one str.replace pass (and full copy) per placeholder.
+    """
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        pieces = _PLACEHOLDER.split(text)
+        # Even positions are literal text, odd positions are placeholder names
+        self.literals: List[str] = pieces[0::2]
+        self.fields: List[str] = pieces[1::2]
+        self.tokens = estimate_tokens("".join(self.literals))
+
+    def render(self, max_tokens: Optional[int] = None, **values: str) -> str:
+        """
+        Fill the placeholders in one pass. Missing values render as empty strings. If the
+        result would exceed max_tokens (default PROMPT_MAX_TOKENS), the dataset section is
+        shortened to whole CSV rows that fit.
+        """
+        budget = PROMPT_MAX_TOKENS if max_tokens is None else max_tokens
+        if budget > 0 and TRUNCATED_FIELD in values:
+            other = sum(estimate_tokens(values.get(field, "")) for field in self.fields if field != TRUNCATED_FIELD)
+            room = budget - self.tokens - other
+            values[TRUNCATED_FIELD] = truncate_rows(values[TRUNCATED_FIELD], room)
+        parts = [None] * (len(self.literals) + len(self.fields))
+        parts[0::2] = self.literals
+        parts[1::2] = [values.get(field, "") for field in self.fields]
+        return "".join(parts)
+
+
+def truncate_rows(text: str, max_tokens: int) -> str:
+    """
+    Shorten a CSV section to about max_tokens without cutting rows: the header, the first
+    rows and a few of the last rows, with a note of how many rows were left out.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    records = _csv_records(text)
+    if len(records) <= 2:
+        return text[:max(max_tokens, 0) * 4]
+    header, rows = records[0], records[1:]
+    room = max(max_tokens, 0) * 4 - len(header) - 64
+    sizes = [len(row) + 1 for row in rows]
+
+    # Three quarters of the room for rows from the top, the rest for rows from the bottom
+    head, used = 0, 0
+    while head < len(rows) and used + sizes[head] <= room * 3 // 4:
+        used += sizes[head]
+        head += 1
+    tail = 0
+    while tail < len(rows) - head and used + sizes[-1 - tail] <= room:
+        used += sizes[-1 - tail]
+        tail += 1
+    omitted = len(rows) - head - tail
+    kept = [header, *rows[:head], f"... ({omitted} rows omitted) ...", *(rows[len(rows) - tail:] if tail else [])]
+    return "\n".join(kept) + "\n"
+
+
+def _csv_records(text: str) -> List[str]:
+    """
+    Split CSV text into records, keeping quoted fields that span lines in one record.
+    Quotes inside fields are doubled, so a record is complete once its quote count is even.
+    """
+    records = []
+    pending = None
+    for line in text.splitlines():
+        pending = line if pending is None else f"{pending}\n{line}"
+        if pending.count('"') % 2 == 0:
+            records.append(pending)
+            pending = None
+    if pending is not None:
+        records.append(pending)
+    return records
+
+
+class TemplateRegistry:
+    """
+    Prompt templates (prompts/<name>_template.txt) loaded and compiled once, at startup or on
+    first use. With PROMPTS_HOT_RELOAD=1 a template is recompiled when its file changes.
+    """
+
+    def __init__(self, directory: Optional[str] = None, hot_reload: Optional[bool] = None):
+        self.directory = directory or PROMPTS_DIR
+        self.hot_reload = PROMPTS_HOT_RELOAD if hot_reload is None else hot_reload
+        self._templates: Dict[str, Tuple[CompiledTemplate, float]] = {}
+        self._checked: Dict[str, float] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def load(self) -> List[str]:
+        """
+        (Re)load every template in the prompts directory. Returns the loaded names.
+        """
+        with self._lock:
+            self._templates.clear()
+            if os.path.isdir(self.directory):
+                for filename in sorted(os.listdir(self.directory)):
+                    if filename.endswith(TEMPLATE_SUFFIX):
+                        self._load_locked(filename[:-len(TEMPLATE_SUFFIX)])
+            self._loaded = True
+            return sorted(self._templates)
+
+    def get(self, name: str) -> Optional[CompiledTemplate]:
+        """
+        The compiled template, or None if prompts/<name>_template.txt does not exist.
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            if self.hot_reload:
+                now = time.monotonic()
+                if now - self._checked.get(name, 0.0) >= PROMPTS_RELOAD_INTERVAL:
+                    self._checked[name] = now
+                    self._reload_if_changed_locked(name)
+            entry = self._templates.get(name)
+            return entry[0] if entry else None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + TEMPLATE_SUFFIX)
+
+    def _load_locked(self, name: str):
+        path = self._path(name)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "r") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self._templates.pop(name, None)
+            return
+        self._templates[name] = (CompiledTemplate(name, text), mtime)
+
+    def _reload_if_changed_locked(self, name: str):
+        try:
+            mtime = os.path.getmtime(self._path(name))
+        except FileNotFoundError:
+            mtime = None
+        entry = self._templates.get(name)
+        if (entry[1] if entry else None) != mtime:
+            logger.info("Reloading prompt template %s", name)
+            self._load_locked(name)
+
+
+# Global instance of the template registry
+prompt_templates = TemplateRegistry()
@@ -0,0 +1,314 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from storage import data_path
+from telemetry import span
+
+RESULTS_KEEP = int(os.getenv("RESULTS_KEEP", "50"))
+ROW_GROUP_SIZE = 65536
+DOWNLOAD_BATCH_ROWS = 16384
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "json": ("application/json", "json"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COMPRESSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+MANIFEST_FIELDS = ("id", "created", "rows", "columns", "artifacts")
+
+
+class ResultStore:
+    """
+    Each pipeline run's resulting DataFrame (as Parquet) and artifacts (e.g. the FAISS
+    index it built), stored under DATA_DIR/results/<result id>/ so downloads serve real output.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.dirname(data_path("results", "_"))
+
+    def result_dir(self, result_id: str) -> str:
+        # Result IDs are hex UUIDs; reject anything that could escape the results directory
+        if not result_id.isalnum():
+            raise ValueError("Invalid result ID")
+        return os.path.join(self.root, result_id)
+
+    def save(self, df: pd.DataFrame, artifacts: Optional[Dict[str, str]] = None,
+             info: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Store df and hard-link (or copy) artifact files next to it. Returns the result ID.
+        """
+        return self.save_chunks([df], artifacts, info)
+
+    def save_chunks(self, chunks: Iterable[pd.DataFrame], artifacts: Optional[Dict[str, str]] = None,
+                    info: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Like save, but writes the frame one chunk at a time, so results larger than memory
+        can be stored. Every chunk is cast to the schema of the first one.
+        """
+        writer = self.writer()
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close(artifacts, info)
+
+    def publish_file(self, path: str, info: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Publish an existing Parquet file (hard-linked or copied) as a new result, e.g. a
+        stage output kept in the stage cache after its original result was pruned.
+        """
+        writer = self.writer()
+        target = os.path.join(writer.tmp_dir, "data.parquet")
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+        metadata = pq.read_metadata(target)
+        writer.rows = metadata.num_rows
+        writer.columns = list(metadata.schema.to_arrow_schema().names)
+        return writer.close(None, info)
+
+    def info(self, result_id: str) -> Dict[str, Any]:
+        """
+        The extra information stored with a result (e.g. generation stats), without the
+        fields every manifest has.
+        """
+        manifest = self.manifest(result_id) or {}
+        return {key: value for key, value in manifest.items() if key not in MANIFEST_FIELDS}
+
+    def writer(self) -> "ResultWriter":
+        """
+        Start a result that is written incrementally, e.g. as generated rows arrive.
+        """
+        return ResultWriter(self)
+
+    def manifest(self, result_id: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(self.result_dir(result_id), "manifest.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def latest(self) -> Optional[str]:
+        results = self._results()
+        return results[-1] if results else None
+
+    def data_path(self, result_id: str) -> str:
+        return os.path.join(self.result_dir(result_id), "data.parquet")
+
+    def artifact_path(self, result_id: str, name: str) -> Optional[str]:
+        manifest = self.manifest(result_id)
+        if manifest is None or name not in manifest["artifacts"]:
+            return None
+        return os.path.join(self.result_dir(result_id), manifest["artifacts"][name])
+
+    def iter_batches(self, result_id: str, batch_rows: int = DOWNLOAD_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+        """
+        Stream the stored frame as Arrow record batches without loading it whole.
+        """
+        return pq.ParquetFile(self.data_path(result_id)).iter_batches(batch_size=batch_rows)
+
+    def export_path(self, result_id: str, fmt: str, compression: str) -> str:
+        """
+        Materialize an export (e.g. csv.gz) next to the result once, for range requests
+        and repeat downloads. Written chunk by chunk, so memory stays constant.
+        """
+        if fmt == "parquet" and compression == "none":
+            return self.data_path(result_id)
+        path = os.path.join(self.result_dir(result_id), f"export.{FORMATS[fmt][1]}{COMPRESSIONS[compression]}")
+        if not os.path.exists(path):
+            with span("result_store.export", format=fmt, compression=compression) as export_span:
+                # A temp file per writer, so concurrent first downloads never share one
+                fd, tmp_path = tempfile.mkstemp(dir=self.result_dir(result_id), prefix="export.", suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        for chunk in self.export_chunks(result_id, fmt, compression):
+                            f.write(chunk)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    os.remove(tmp_path)
+                    raise
+                export_span.set(bytes=os.path.getsize(path))
+        return path
+
+    def export_chunks(self, result_id: str, fmt: str, compression: str) -> Iterator[bytes]:
+        """
+        Encode the stored frame in the requested format and compression, one batch at a time.
+        """
+        if fmt == "parquet":
+            chunks = _file_chunks(self.data_path(result_id))
+        elif fmt == "csv":
+            chunks = _csv_chunks(self.iter_batches(result_id))
+        elif fmt == "json":
+            chunks = _json_chunks(self.manifest(result_id), self.iter_batches(result_id))
+        else:
+            schema = pq.read_schema(self.data_path(result_id))
+            chunks = _arrow_chunks(schema, self.iter_batches(result_id))
+        return _compress(chunks, compression)
+
+    def _results(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for name in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, name, "manifest.json")
+            if os.path.exists(manifest_path):
+                entries.append((os.path.getmtime(manifest_path), name))
+        return [name for _, name in sorted(entries)]
+
+    def _prune(self):
+        results = self._results()
+        for result_id in results[:max(0, len(results) - RESULTS_KEEP)]:
+            shutil.rmtree(os.path.join(self.root, result_id), ignore_errors=True)
+
+
+class ResultWriter:
+    """
+    One result being written chunk by chunk; close() publishes it under its result ID.
+    """
+
+    def __init__(self, store: ResultStore):
+        self.store = store
+        self.result_id = uuid.uuid4().hex
+        self.tmp_dir = store.result_dir(self.result_id) + ".tmp"
+        os.makedirs(self.tmp_dir)
+        self.rows = 0
+        self.columns: List[str] = []
+        self._writer: Optional[pq.ParquetWriter] = None
+
+    def write(self, chunk: pd.DataFrame):
+        with span("result_store.write", rows=len(chunk)):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(os.path.join(self.tmp_dir, "data.parquet"), table.schema)
+                self.columns = [str(c) for c in chunk.columns]
+            else:
+                table = table.cast(self._writer.schema)
+            self._writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+        self.rows += len(chunk)
+
+    def close(self, artifacts: Optional[Dict[str, str]] = None, info: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Finish the Parquet file, hard-link (or copy) artifact files next to it and publish
+        the result. Returns the result ID.
+        """
+        with span("result_store.close", rows=self.rows):
+            return self._close(artifacts, info)
+
+    def _close(self, artifacts: Optional[Dict[str, str]], info: Optional[Dict[str, Any]]) -> str:
+        if self._writer is not None:
+            self._writer.close()
+        elif not os.path.exists(os.path.join(self.tmp_dir, "data.parquet")):
+            # No rows at all: store an empty file so the result can still be downloaded
+            pq.write_table(pa.table({}), os.path.join(self.tmp_dir, "data.parquet"))
+
+        stored_artifacts = {}
+        for name, path in (artifacts or {}).items():
+            target = os.path.join(self.tmp_dir, os.path.basename(path))
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copyfile(path, target)
+            stored_artifacts[name] = os.path.basename(path)
+
+        manifest = {
+            "id": self.result_id,
+            "created": time.time(),
+            "rows": self.rows,
+            "columns": self.columns,
+            "artifacts": stored_artifacts,
+            **(info or {}),
+        }
+        with open(os.path.join(self.tmp_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+        os.rename(self.tmp_dir, self.store.result_dir(self.result_id))
+
+        self.store._prune()
+        return self.result_id
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _file_chunks(path: str, chunk_bytes: int = 1024 * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _csv_chunks(batches: Iterable[pa.RecordBatch]) -> Iterator[bytes]:
+    first = True
+    for batch in batches:
+        sink = pa.BufferOutputStream()
+        pacsv.write_csv(batch, sink, write_options=pacsv.WriteOptions(include_header=first))
+        first = False
+        yield sink.getvalue().to_pybytes()
+
+
+def _json_chunks(manifest: Dict[str, Any], batches: Iterable[pa.RecordBatch]) -> Iterator[bytes]:
+    info = {"rows": manifest["rows"], "columns": len(manifest["columns"]),
+            "processing_date": time.strftime("%Y-%m-%d", time.localtime(manifest["created"]))}
+    yield ('{"dataset_info": ' + json.dumps(info) + ', "data": [').encode("utf-8")
+    first = True
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        records = batch.to_pandas().to_json(orient="records", date_format="iso")[1:-1]
+        yield (records if first else "," + records).encode("utf-8")
+        first = False
+    yield b"]}"
+
+
+def _arrow_chunks(schema: pa.Schema, batches: Iterable[pa.RecordBatch]) -> Iterator[bytes]:
+    # One IPC stream written into a reusable buffer; each batch's bytes are yielded and dropped
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def _compress(chunks: Iterable[bytes], compression: str) -> Iterator[bytes]:
+    if compression == "none":
+        yield from chunks
+        return
+    if compression == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        flush = compressor.flush
+    else:
+        import zstandard
+        compressor = zstandard.ZstdCompressor().compressobj()
+        flush = compressor.flush
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield flush()
+
+
+# Global instance of the result store
+result_store = ResultStore()
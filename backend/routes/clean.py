@@ -1,55 +1,143 @@
 import pandas as pd
-from typing import Optional
-import os
+from typing import Any, Dict, List, Optional, Tuple
 from cerebras_client import cerebras_client
+from cleaning import CleaningEngine, format_report, frame_chunks
+from ingest import iter_batches
+from llm_cleaning import add_llm_report, format_llm_report, llm_clean
+from progress import preview_csv, report_progress
+from prompt_templates import CompiledTemplate, prompt_templates
+from result_store import result_store
+from telemetry import span
 
-def clean_data(df: Optional[pd.DataFrame], prompt: str) -> str:
+def clean_data(df: Optional[pd.DataFrame], prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     Clean dataset by detecting and removing noisy, missing, or duplicate values.
     Uses the Cerebras API to perform intelligent data cleaning.
     """
+    return clean_dataset(df, prompt, params)[0]
+
+def clean_dataset(df: Optional[pd.DataFrame], prompt: str,
+                  params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[pd.DataFrame]]:
+    """
+    Same as clean_data, but also returns the cleaned frame so it can be stored and downloaded.
+    """
     if df is None:
-        return "No data provided for cleaning"
+        return "No data provided for cleaning", None
     
-    # Remove duplicates
-    initial_rows = len(df)
-    df_cleaned = df.drop_duplicates()
-    removed_duplicates = initial_rows - len(df_cleaned)
+    # Deduplicate, handle missing values and flag outliers chunk by chunk
+    engine = CleaningEngine(params)
+    with span("clean.engine", rows=len(df)):
+        chunks = []
+        for chunk in engine.run(lambda: frame_chunks(df, engine.config["chunk_rows"])):
+            _report_chunk(engine, chunk, len(df), first=not chunks)
+            chunks.append(chunk)
+        df_cleaned = pd.concat(chunks, ignore_index=True) if chunks else df.iloc[0:0]
     
-    # Handle missing values (simple approach - drop rows with any missing values)
-    df_cleaned = df_cleaned.dropna()
-    removed_missing = len(df) - len(df_cleaned) - removed_duplicates
+    template = prompt_templates.get("clean")
+    if template is None:
+        return "Error: Clean template not found", df_cleaned
+    
+    if engine.config["llm"] == "preview":
+        return _summarize(engine.report, df_cleaned.head(10), prompt, template), df_cleaned
+    
+    # Send every row (or a representative sample) to the LLM in parallel batches and merge its corrections
+    report_progress(phase="llm", rows=len(df_cleaned), total=len(df_cleaned))
+    with span("clean.llm", rows=len(df_cleaned)) as llm_span:
+        df_cleaned, llm_report = llm_clean(df_cleaned, prompt, template, engine.config)
+        llm_span.set(llm_calls=llm_report["batches"])
+    return _summarize_llm(engine.report, llm_report, df_cleaned), df_cleaned
+
+def clean_file(path: str, prompt: str, params: Optional[Dict[str, Any]] = None,
+               columns: Optional[List[str]] = None) -> Tuple[str, str]:
+    """
+    Clean a CSV on disk without loading it: batches are streamed from the file through the
+    cleaning engine straight into the result store. Returns (summary, result ID).
+    """
+    engine = CleaningEngine(params)
+    template = prompt_templates.get("clean")
+    use_llm = template is not None and engine.config["llm"] != "preview"
+    llm_report = None
+    preview = []
     
-    # Load the cleaning prompt template
-    template_path = os.path.join(os.path.dirname(__file__), "..", "prompts", "clean_template.txt")
-    try:
-        with open(template_path, "r") as f:
-            template = f.read()
-    except FileNotFoundError:
-        return "Error: Clean template not found"
+    def cleaned_chunks():
+        nonlocal llm_report
+        for chunk in engine.run(lambda: iter_batches(path, columns)):
+            if use_llm:
+                chunk, chunk_report = llm_clean(chunk, prompt, template, engine.config, _chunk_budget(engine, chunk, llm_report))
+                llm_report = add_llm_report(llm_report, chunk_report)
+            # The row total is only known when the statistics pass has read the file already
+            _report_chunk(engine, chunk, engine.fitted_rows or None, first=not preview)
+            if not preview:
+                preview.append(chunk.head(10))
+            yield chunk
     
+    with span("clean.stream") as stream_span:
+        result_id = result_store.save_chunks(cleaned_chunks())
+        stream_span.set(rows=engine.report["final_rows"])
+    preview_df = preview[0] if preview else pd.DataFrame()
+    if template is None:
+        return "Error: Clean template not found", result_id
+    if llm_report is not None:
+        return _summarize_llm(engine.report, llm_report, preview_df), result_id
+    return _summarize(engine.report, preview_df, prompt, template), result_id
+
+def _report_chunk(engine: CleaningEngine, chunk: pd.DataFrame, total: Optional[int], first: bool):
+    """
+    Progress after each cleaned chunk: input rows read so far, and the first cleaned rows.
+    """
+    progress = {"phase": "engine", "rows": engine.report["initial_rows"], "total": total}
+    if first:
+        progress["preview"] = preview_csv(chunk)
+    report_progress(**progress)
+
+def _chunk_budget(engine: CleaningEngine, chunk: pd.DataFrame, llm_report: Optional[Dict[str, Any]]) -> int:
+    """
+    Rows of this chunk to sample for the LLM: its share of llm_max_rows by size when the
+    total row count is known from the statistics pass, otherwise whatever budget is left.
+    """
+    remaining = engine.config["llm_max_rows"] - (llm_report["rows_sent"] if llm_report else 0)
+    if engine.fitted_rows:
+        share = int(round(engine.config["llm_max_rows"] * len(chunk) / engine.fitted_rows))
+        return min(max(share, 1), remaining)
+    return remaining
+
+def _summarize(report: Dict[str, Any], preview: pd.DataFrame, prompt: str, template: CompiledTemplate) -> str:
+    """
+    Ask the LLM to review a sample of the cleaned rows and combine its answer with the per-step counts.
+    """
     # Fill the template with dataset and prompt
-    filled_prompt = template.replace("{{dataset}}", df_cleaned.head(10).to_csv(index=False))
-    filled_prompt = filled_prompt.replace("{{prompt}}", prompt)
+    filled_prompt = template.render(dataset=preview.to_csv(index=False), prompt=prompt)
     
     # Call Cerebras API for intelligent cleaning
-    api_response = cerebras_client.generate(filled_prompt, max_tokens=1024)
+    with span("clean.summary_llm", llm_calls=1):
+        api_response = cerebras_client.generate(filled_prompt, max_tokens=1024)
     
     if api_response["success"]:
         result = f"Data cleaning completed using Cerebras API:\n"
-        result += f"- Initial rows: {initial_rows}\n"
-        result += f"- Removed duplicates: {removed_duplicates}\n"
-        result += f"- Removed rows with missing values: {removed_missing}\n"
+        result += format_report(report)
         result += f"- AI-powered cleaning applied\n"
-        result += f"- Final rows: {len(df_cleaned)}\n\n"
+        result += f"- Final rows: {report['final_rows']}\n\n"
         result += f"Cleaned data:\n{api_response['data']}"
     else:
         # Fallback to basic cleaning if API fails
         result = f"Data cleaning completed (API call failed, using basic cleaning):\n"
-        result += f"- Initial rows: {initial_rows}\n"
-        result += f"- Removed duplicates: {removed_duplicates}\n"
-        result += f"- Removed rows with missing values: {removed_missing}\n"
+        result += format_report(report)
+        result += f"- Final rows: {report['final_rows']}\n"
         result += f"- Error: {api_response['error']}\n\n"
-        result += f"Cleaned data preview:\n{df_cleaned.head().to_string()}"
+        result += f"Cleaned data preview:\n{preview.head().to_string()}"
     
     return result
+
+def _summarize_llm(report: Dict[str, Any], llm_report: Dict[str, Any], df_cleaned: pd.DataFrame) -> str:
+    """
+    Summary for batched or sampled LLM cleaning, where the corrections are already merged into the data.
+    """
+    if llm_report["batches"] and llm_report["failed_batches"] == llm_report["batches"]:
+        result = f"Data cleaning completed (API call failed, using basic cleaning):\n"
+    else:
+        result = f"Data cleaning completed using Cerebras API:\n"
+    result += format_report(report)
+    result += format_llm_report(llm_report)
+    result += f"- Final rows: {report['final_rows']}\n\n"
+    result += f"Cleaned data preview:\n{df_cleaned.head().to_string()}"
+    return result
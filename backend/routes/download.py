@@ -1,81 +1,115 @@
-import pandas as pd
-from fastapi import APIRouter, Response
-from fastapi.responses import FileResponse
-import io
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import os
-import faiss
-import json
+from typing import Optional
+from index_store import index_store, DEFAULT_INDEX_NAME
+from result_store import result_store, FORMATS, COMPRESSIONS
 
 router = APIRouter()
 
+# Compressed downloads are served as .gz/.zst files rather than with Content-Encoding,
+# so browsers save them compressed instead of transparently inflating them
+COMPRESSED_MEDIA_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+
+def _resolve_result(result: Optional[str]) -> Optional[str]:
+    """
+    The requested result ID if it exists, else the most recent result when none was given.
+    """
+    if result is None:
+        return result_store.latest()
+    try:
+        return result if result_store.manifest(result) is not None else None
+    except ValueError:
+        return None
+
+
+def _download_response(request: Request, result: Optional[str], fmt: str, compression: str):
+    if compression not in COMPRESSIONS:
+        return JSONResponse(status_code=400, content={"error": f"compression must be one of {', '.join(COMPRESSIONS)}"})
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return JSONResponse(status_code=400, content={"error": "zstd compression requires the zstandard package"})
+
+    result_id = _resolve_result(result)
+    if result_id is None:
+        return JSONResponse(status_code=404, content={"error": "Processed result not found"})
+
+    media_type, extension = FORMATS[fmt]
+    media_type = COMPRESSED_MEDIA_TYPES.get(compression, media_type)
+    filename = f"processed_data_{result_id[:8]}.{extension}{COMPRESSIONS[compression]}"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+
+    # Range requests (resumed or parallel downloads) need a file with a known length,
+    # so the export is materialized once next to the result and served from disk
+    if request.headers.get("range") or fmt == "parquet":
+        path = result_store.export_path(result_id, fmt, compression)
+        return FileResponse(path=path, media_type=media_type, headers=headers)
+
+    # Otherwise encode batch by batch as the client reads, so memory stays constant
+    return StreamingResponse(result_store.export_chunks(result_id, fmt, compression),
+                             media_type=media_type, headers=headers)
+
+
 @router.get("/api/download/csv")
-async def download_csv():
+async def download_csv(request: Request, result: Optional[str] = None, compression: str = "none"):
     """
     Download processed data as CSV file.
+    Without a result ID, the most recent pipeline result is served.
     """
-    # In a real implementation, this would retrieve the processed data
-    # For this MVP, we'll create a sample CSV
-    
-    # Create sample data
-    data = {
-        "Name": ["John Doe", "Jane Smith", "Bob Johnson"],
-        "Age": [29, 34, 41],
-        "City": ["New York", "London", "Paris"],
-        "Occupation": ["Engineer", "Doctor", "Teacher"]
-    }
-    df = pd.DataFrame(data)
-    
-    # Convert DataFrame to CSV
-    csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_data = csv_buffer.getvalue()
-    
-    return Response(
-        content=csv_data,
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=processed_data.csv"}
-    )
+    return await run_in_threadpool(_download_response, request, result, "csv", compression)
 
 @router.get("/api/download/json")
-async def download_json():
+async def download_json(request: Request, result: Optional[str] = None, compression: str = "none"):
     """
     Download processed data as JSON file.
     """
-    # In a real implementation, this would retrieve the processed data
-    # For this MVP, we'll create a sample JSON
-    
-    # Create sample data
-    data = {
-        "dataset_info": {
-            "rows": 3,
-            "columns": 4,
-            "processing_date": "2025-04-10"
-        },
-        "data": [
-            {"Name": "John Doe", "Age": 29, "City": "New York", "Occupation": "Engineer"},
-            {"Name": "Jane Smith", "Age": 34, "City": "London", "Occupation": "Doctor"},
-            {"Name": "Bob Johnson", "Age": 41, "City": "Paris", "Occupation": "Teacher"}
-        ]
-    }
-    
-    return Response(
-        content=json.dumps(data, indent=2),
-        media_type="application/json",
-        headers={"Content-Disposition": "attachment; filename=processed_data.json"}
-    )
+    return await run_in_threadpool(_download_response, request, result, "json", compression)
+
+@router.get("/api/download/parquet")
+async def download_parquet(request: Request, result: Optional[str] = None, compression: str = "none"):
+    """
+    Download processed data as Parquet file.
+    """
+    return await run_in_threadpool(_download_response, request, result, "parquet", compression)
+
+@router.get("/api/download/arrow")
+async def download_arrow(request: Request, result: Optional[str] = None, compression: str = "none"):
+    """
+    Download processed data as an Arrow IPC stream.
+    """
+    return await run_in_threadpool(_download_response, request, result, "arrow", compression)
 
 @router.get("/api/download/faiss")
-async def download_faiss():
+def download_faiss(result: Optional[str] = None, index: Optional[str] = None):
     """
-    Download FAISS index file.
+    Download the FAISS index built by a pipeline result, or the current version of a named index.
+    Without either, the most recent result's index (or the most recently updated index) is served.
     """
+    if index is None:
+        result_id = _resolve_result(result)
+        faiss_file_path = result_store.artifact_path(result_id, "faiss_index") if result_id else None
+        if faiss_file_path is not None:
+            return FileResponse(
+                path=faiss_file_path,
+                media_type="application/octet-stream",
+                filename=f"{result_store.manifest(result_id).get('index_name') or DEFAULT_INDEX_NAME}_faiss_index.bin"
+            )
+        if result is not None:
+            return JSONResponse(status_code=404, content={"error": "FAISS index file not found"})
+        indexes = index_store.list()
+        index = max(indexes, key=lambda i: i["updated_at"])["name"] if indexes else DEFAULT_INDEX_NAME
+
     # Check if FAISS index file exists
-    faiss_file_path = "faiss_index.bin"
-    if not os.path.exists(faiss_file_path):
+    faiss_file_path = index_store.current_index_path(index)
+    if faiss_file_path is None or not os.path.exists(faiss_file_path):
         return {"error": "FAISS index file not found"}
-    
+
     return FileResponse(
         path=faiss_file_path,
         media_type="application/octet-stream",
-        filename="faiss_index.bin"
+        filename=f"{index}_faiss_index.bin"
     )
@@ -1,81 +1,268 @@
 import pandas as pd
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional
 import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
-import json
 import os
+import time
 from cerebras_client import cerebras_client
+from model_registry import model_registry, DEFAULT_MODEL_NAME
+from embedding_backends import (
+    EMBED_BACKEND, EMBED_BACKENDS, EMBED_COMPARE_ROWS, REFERENCE_BACKEND, cache_model_name, compare_backends,
+    encode_batches, length_batches,
+)
+from embedding_cache import get_embedding_cache, text_hash
+from metadata_store import MetadataStore, metadata_path
+from progress import check_cancelled, report_progress
+from prompt_templates import prompt_templates
+from telemetry import span
+from index_store import (
+    index_store, hash_to_id, sanitize_index_name, choose_index_type, default_ann_params, evaluate_recall
+)
+from lazy_imports import lazy_import
 
-def vectorize_data(df: Optional[pd.DataFrame], prompt: str) -> str:
+# Imported on first use (or at startup via PRELOAD_MODULES)
+faiss = lazy_import("faiss")
+
+# Encoding settings (EMBED_CHUNK_ROWS > 0 enables streaming throughput mode)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "0"))
+EMBED_CHUNK_ROWS = int(os.getenv("EMBED_CHUNK_ROWS", "0"))
+# Index type for new indexes: flat, ivf_flat, ivf_pq, hnsw or auto (chosen by row count and memory budget)
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+
+def build_combined_text(df: pd.DataFrame, text_columns: List[str]) -> pd.Series:
+    """
+    Join the non-missing values of the text columns of each row with spaces,
+    using columnar string operations instead of a per-row Python lambda.
+    """
+    combined = None
+    for column in text_columns:
+        values = df[column].astype("string")
+        if combined is None:
+            combined = values
+        else:
+            # Missing values on either side are skipped rather than joined
+            combined = (combined + " " + values).fillna(combined).fillna(values)
+    return combined.fillna("")
+
+def _make_encoder(model, model_name: str, device: Optional[str], batch_size: int, processes: int,
+                  backend: str, report: bool = True) -> Callable:
+    """
+    Return a function that encodes a list of texts, optionally across a multi-process pool.
+    In-process, texts are encoded in length-sorted, token-budgeted batches (reporting progress).
+    """
+    if processes > 1:
+        model, pool = model_registry.get_pool(model_name, device, processes, backend)
+        return lambda texts: model.encode_multi_process(texts, pool, batch_size=batch_size)
+    
+    def encode(texts: List[str]) -> np.ndarray:
+        batches = length_batches(texts, batch_size, max_seq_length=getattr(model, "max_seq_length", None))
+        on_progress = (lambda done: report_progress(phase="encode", rows=done, total=len(texts))) if report else None
+        return encode_batches(model, texts, batches, on_progress)
+    return encode
+
+def _row_ids(df: pd.DataFrame, content_hashes: np.ndarray, id_column: Optional[str]) -> np.ndarray:
+    """
+    Return a stable int64 row ID per row: the id column if it is integral, a hash of
+    its values otherwise, or the content hash when no id column is given.
+    """
+    if id_column and id_column in df.columns:
+        values = df[id_column]
+        if pd.api.types.is_integer_dtype(values):
+            return values.to_numpy(dtype="int64")
+        return np.array([hash_to_id(text_hash(v)) for v in values.astype(str)], dtype="int64")
+    return content_hashes
+
+def vectorize_data(df: Optional[pd.DataFrame], prompt: str, model_name: Optional[str] = None,
+                   device: Optional[str] = None, batch_size: Optional[int] = None,
+                   processes: Optional[int] = None, chunk_rows: Optional[int] = None,
+                   index_name: Optional[str] = None, id_column: Optional[str] = None,
+                   index_type: Optional[str] = None, index_params: Optional[Dict[str, Any]] = None,
+                   backend: Optional[str] = None) -> str:
     """
     Convert text-based records into embeddings suitable for use in retrieval-augmented generation pipelines.
     Uses sentence-transformers and FAISS to create vector embeddings.
+    The model is taken from the process-wide registry, so it is only loaded once per worker.
+    With chunk_rows set, rows are embedded and indexed in streaming chunks so memory stays flat.
+    Vectors are upserted into a named, versioned index by stable row ID (id_column, or a hash
+    of the row text), so re-embedding a grown dataset only encodes new or changed rows.
+    New indexes can be IVF-Flat, IVF-PQ or HNSW (index_type/index_params), trained on the first chunk,
+    and store float16 or int8 vectors instead of float32 (index_params precision).
+    backend picks the inference backend (EMBED_BACKENDS); for the quantized and ONNX ones, a
+    sample is also encoded in fp32 to report cosine agreement and speedup.
     """
     if df is None:
         return "No data provided for vectorization"
     
-    # Get text columns (simplified approach)
-    text_columns = df.select_dtypes(include=['object']).columns.tolist()
+    # Get text columns: object and pandas/Arrow string dtypes
+    text_columns = [c for c in df.columns if pd.api.types.is_string_dtype(df[c]) or df[c].dtype == object]
     
     if not text_columns:
         return "No text columns found in the dataset for vectorization"
     
-    # Load sentence transformer model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    # Combine text from all text columns for each row
-    df['combined_text'] = df[text_columns].apply(
-        lambda row: ' '.join([str(val) for val in row if pd.notna(val)]), axis=1
-    )
-    
-    # Convert text data to embeddings
-    texts = df['combined_text'].tolist()
-    embeddings = model.encode(texts)
-    
-    # Create FAISS index
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings).astype('float32'))
-    
-    # Save FAISS index to disk
-    faiss.write_index(index, "faiss_index.bin")
-    
-    # Save metadata for the embeddings
-    metadata = []
-    for i, text in enumerate(texts):
-        metadata.append({
-            "id": i,
-            "text": text,
-            "source_row": df.iloc[i].to_dict()
-        })
-    
-    with open("embedding_metadata.json", "w") as f:
-        json.dump(metadata, f, indent=2)
-    
-    # Load the embedding prompt template
-    template_path = os.path.join(os.path.dirname(__file__), "..", "prompts", "embed_template.txt")
-    try:
-        with open(template_path, "r") as f:
-            template = f.read()
-    except FileNotFoundError:
+    if len(df) == 0:
+        return "No rows found in the dataset for vectorization"
+    
+    backend = backend or EMBED_BACKEND
+    if backend not in EMBED_BACKENDS:
+        return f"Error: Unknown embedding backend '{backend}' (expected one of {', '.join(EMBED_BACKENDS)})"
+    
+    # Get the sentence transformer model from the registry (loaded once per worker)
+    model_name = model_name or DEFAULT_MODEL_NAME
+    with span("embed.model_load", model=model_name, backend=backend) as load_span:
+        model, model_info = model_registry.get_with_info(model_name, device, backend)
+        load_span.set(warm=model_info["warm"])
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    processes = EMBED_PROCESSES if processes is None else processes
+    encoder = _make_encoder(model, model_name, device, batch_size, processes, backend)
+    chunk_rows = chunk_rows or EMBED_CHUNK_ROWS or len(df)
+    cache_model = cache_model_name(model_name, backend)
+    comparison = None
+    
+    index_name = sanitize_index_name(index_name)
+    embedding_cache = get_embedding_cache()
+    cache_stats = {"hits": 0, "misses": 0, "encoded": 0, "encode_seconds": 0.0}
+    row_counts = {"added": 0, "updated": 0, "unchanged": 0}
+    sample_embeddings = []
+    build_seconds = 0.0
+    recall = None
+    recall_template = recall_vectors = None
+    
+    # Hold the index lock for the whole build so concurrent requests cannot clobber each other
+    with index_store.lock(index_name):
+        stored = index_store.load(index_name)
+        metadata = MetadataStore(metadata_path(index_store.index_dir(index_name)))
+        if stored is not None and (stored.manifest.get("model") != model_name
+                                   or stored.manifest.get("embed_backend", REFERENCE_BACKEND) != backend):
+            # Vectors from a different model or backend are not comparable, so start a fresh index
+            stored = None
+            metadata.clear()
+        
+        try:
+            for start in range(0, len(df), chunk_rows):
+                chunk = df.iloc[start:start + chunk_rows]
+                
+                # Combine text from all text columns for each row
+                texts = build_combined_text(chunk, text_columns).tolist()
+                content_hashes = np.array([hash_to_id(text_hash(t)) for t in texts], dtype="int64")
+                row_ids = _row_ids(chunk, content_hashes, id_column)
+                
+                # Keep the last occurrence of each row ID within the chunk
+                _, last = np.unique(row_ids[::-1], return_index=True)
+                keep = np.sort(len(row_ids) - 1 - last)
+                
+                # Only new rows and rows whose text changed need to be embedded
+                if stored is None:
+                    is_new = np.ones(len(keep), dtype=bool)
+                    is_changed = np.zeros(len(keep), dtype=bool)
+                else:
+                    is_new, is_changed = stored.diff(row_ids[keep], content_hashes[keep])
+                pending = keep[is_new | is_changed]
+                row_counts["added"] += int(is_new.sum())
+                row_counts["updated"] += int(is_changed.sum())
+                row_counts["unchanged"] += len(keep) - len(pending)
+                
+                if len(pending):
+                    # Convert text data to embeddings
+                    # Only rows whose normalized text is not already cached are sent to the model
+                    with span("embed.encode", rows=len(pending)) as encode_span:
+                        embeddings, chunk_stats = embedding_cache.encode(encoder, cache_model, [texts[i] for i in pending])
+                        encode_span.set(cache_hits=chunk_stats["hits"], cache_misses=chunk_stats["misses"])
+                    for key in cache_stats:
+                        cache_stats[key] += chunk_stats[key]
+                    
+                    # Create (and train) the FAISS index on first use and upsert each chunk as it is encoded
+                    build_start = time.perf_counter()
+                    with span("embed.index_build", rows=len(pending)):
+                        if stored is None:
+                            dimension = embeddings.shape[1]
+                            chosen_type = index_type or INDEX_TYPE
+                            if chosen_type == "auto":
+                                chosen_type = choose_index_type(len(df), dimension)
+                            params = {**default_ann_params(chosen_type, len(df), dimension), **(index_params or {})}
+                            stored = index_store.create(index_name, dimension, model_name, chosen_type, embeddings, params)
+                            if chosen_type != "flat" or stored.manifest["index_params"].get("precision", "float32") != "float32":
+                                # Keep an empty copy of the trained index to measure recall against exact search
+                                recall_template = faiss.clone_index(stored.index.index)
+                                recall_vectors = embeddings[:20000]
+                        stored.upsert(row_ids[pending], content_hashes[pending], embeddings)
+                    build_seconds += time.perf_counter() - build_start
+                    
+                    if len(sample_embeddings) < 3:
+                        sample_embeddings.extend(embeddings[:3 - len(sample_embeddings)])
+                    
+                    if comparison is None and backend != REFERENCE_BACKEND and EMBED_COMPARE_ROWS:
+                        # Quality and speed of this backend against fp32 PyTorch, on rows of the first chunk
+                        with span("embed.compare", rows=min(len(pending), EMBED_COMPARE_ROWS), backend=backend):
+                            reference = model_registry.get(model_name, device, REFERENCE_BACKEND)
+                            comparison = compare_backends(
+                                _make_encoder(model, model_name, device, batch_size, 0, backend, report=False),
+                                _make_encoder(reference, model_name, device, batch_size, 0, REFERENCE_BACKEND, report=False),
+                                [texts[i] for i in pending[:EMBED_COMPARE_ROWS]],
+                            )
+                
+                # Save metadata for the rows of this chunk, keyed by stable row ID
+                # (unchanged rows too, since non-text columns may have changed)
+                with span("embed.metadata", rows=len(keep)):
+                    metadata.upsert(row_ids[keep], [texts[i] for i in keep], chunk.iloc[keep])
+                report_progress(phase="index", rows=start + len(chunk), total=len(df), encoded=cache_stats["encoded"])
+            
+            # Save a new index version atomically (only when something changed)
+            # A cancelled run must not publish a new index version
+            check_cancelled()
+            if row_counts["added"] or row_counts["updated"]:
+                # Indexes that cannot remove vectors (HNSW) drop every replaced one in a single rebuild
+                build_start = time.perf_counter()
+                with span("embed.index_compact"):
+                    stored.compact()
+                build_seconds += time.perf_counter() - build_start
+                index_store.save(stored, {"text_columns": text_columns, "id_column": id_column, "embed_backend": backend})
+            metadata.commit()
+        except Exception:
+            metadata.rollback()
+            raise
+        finally:
+            metadata.close()
+        dimension = stored.manifest["dimension"]
+        version = stored.version
+        total_vectors = int(stored.index.ntotal)
+        index_bytes = os.path.getsize(index_store.current_index_path(index_name))
+    
+    if recall_template is not None:
+        recall = evaluate_recall(recall_template, recall_vectors)
+    
+    template = prompt_templates.get("embed")
+    if template is None:
         return "Error: Embed template not found"
     
     # Fill the template with dataset and prompt
-    filled_prompt = template.replace("{{dataset}}", df.head(5).to_csv(index=False))
-    filled_prompt = filled_prompt.replace("{{prompt}}", prompt)
+    filled_prompt = template.render(dataset=df.head(5).to_csv(index=False), prompt=prompt)
     
     # Call Cerebras API for intelligent vectorization
-    api_response = cerebras_client.generate(filled_prompt, max_tokens=512)
+    with span("embed.llm", llm_calls=1):
+        api_response = cerebras_client.generate(filled_prompt, max_tokens=512)
     
     result = f"Data vectorization completed:\n"
     result += f"- Dataset shape: {df.shape}\n"
     result += f"- Text columns identified: {text_columns}\n"
-    result += f"- Embedding model: sentence-transformers/all-MiniLM-L6-v2\n"
+    result += f"- Embedding model: sentence-transformers/{model_name}\n"
+    result += f"- Inference backend: {backend}\n"
+    result += f"- Model cache: {'warm' if model_info['warm'] else 'cold'} (load time: {model_info['load_seconds']:.2f}s)\n"
+    result += f"- Encode time: {cache_stats['encode_seconds']:.2f}s\n"
+    result += f"- Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['encoded']} texts encoded)\n"
+    result += f"- Batch size: {batch_size}, encode processes: {max(processes, 1)}, chunk rows: {chunk_rows}\n"
+    if comparison is not None:
+        result += (f"- {backend} vs fp32 {REFERENCE_BACKEND} ({comparison['rows']} rows): cosine agreement "
+                   f"{comparison['cosine_mean']:.4f} (min {comparison['cosine_min']:.4f}), "
+                   f"{comparison['rows_per_second']} vs {comparison['reference_rows_per_second']} rows/s "
+                   f"({comparison['speedup']}x)\n")
     result += f"- Vector dimension: {dimension}\n"
-    result += f"- FAISS index created: True\n"
-    result += f"- FAISS index saved to: faiss_index.bin\n"
-    result += f"- Metadata saved to: embedding_metadata.json\n\n"
+    result += f"- FAISS index: {index_name} (version {version}, {total_vectors} vectors)\n"
+    result += f"- Index type: {stored.manifest.get('index_type', 'flat')} {stored.manifest.get('index_params', {})}\n"
+    result += f"- Index build time: {build_seconds:.2f}s, index size: {index_bytes / (1024 * 1024):.1f} MB\n"
+    if recall is not None:
+        result += f"- Recall@10 vs flat baseline (held-out sample): {recall:.3f}\n"
+    result += f"- Rows added: {row_counts['added']}, updated: {row_counts['updated']}, unchanged: {row_counts['unchanged']}\n"
+    result += f"- Metadata saved to: {metadata_path(index_store.index_dir(index_name))}\n\n"
     
     if api_response["success"]:
         result += f"Vectorization summary from Cerebras API:\n{api_response['response']}\n\n"
@@ -85,9 +272,9 @@ def vectorize_data(df: Optional[pd.DataFrame], prompt: str) -> str:
     
     # Show sample embeddings
     result += "Sample embeddings (first 3 rows):\n"
-    for i in range(min(3, len(embeddings))):
+    for i, embedding in enumerate(sample_embeddings):
         # Show first 5 dimensions of the embedding vector
-        sample_vector = embeddings[i][:5]
+        sample_vector = embedding[:5]
         result += f"Row {i+1}: [{', '.join([f'{val:.2f}' for val in sample_vector])}, ...]\n"
     
     return result
@@ -1,57 +1,82 @@
+import asyncio
 import pandas as pd
-from typing import Optional
-import httpx
-import os
+from typing import Any, Dict, Optional, Tuple
 from cerebras_client import cerebras_client
+from enrichment import choose_columns, enrich_frame, format_enrich_report, make_backend, parse_enrich_params
+from prompt_templates import prompt_templates
+from result_store import result_store
+from telemetry import bind, span
 
-def enrich_data(df: Optional[pd.DataFrame], prompt: str) -> str:
+# Distinct values per enriched column shown in the stage summary
+SAMPLE_ENTRIES = 3
+
+def enrich_data(df: Optional[pd.DataFrame], prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
     """
     Use web search APIs to enrich ambiguous fields with relevant context and source links.
-    Uses Brave or Serper.dev APIs for web search.
+    Blocking wrapper around aenrich_data for sync callers.
+    """
+    return asyncio.run(aenrich_data(df, prompt, params))[0]
+
+async def aenrich_data(df: Optional[pd.DataFrame], prompt: str,
+                       params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[str]]:
+    """
+    Look up each distinct value of the chosen columns once through the search backend
+    (Exa, Serper.dev, Brave or the offline stub), join the context and source links back
+    onto the rows and store the enriched frame. Returns (summary, result ID).
     """
     if df is None:
-        return "No data provided for enrichment"
-    
-    # Load the enrichment prompt template
-    template_path = os.path.join(os.path.dirname(__file__), "..", "prompts", "enrich_template.txt")
-    try:
-        with open(template_path, "r") as f:
-            template = f.read()
-    except FileNotFoundError:
-        return "Error: Enrich template not found"
-    
+        return "No data provided for enrichment", None
+
+    filled_prompt = _prepare_prompt(df, prompt)
+    if filled_prompt is None:
+        return "Error: Enrich template not found", None
+
+    config = parse_enrich_params(params)
+    columns = config["columns"] or choose_columns(df, config["max_values"])
+    unknown = [c for c in columns if c not in df.columns]
+    if unknown:
+        return f"Error: Unknown enrich columns: {', '.join(unknown)}", None
+    backend = make_backend(config["backend"])
+
+    # The LLM's enrichment notes and the search lookups run concurrently
+    with span("enrich.lookups", backend=backend.name) as lookup_span:
+        api_response, (enriched, report) = await asyncio.gather(
+            cerebras_client.agenerate(filled_prompt, max_tokens=512),
+            enrich_frame(df, columns, backend, config),
+        )
+        lookup_span.set(rows=len(enriched), cache_hits=report["cache_hits"], llm_calls=1)
+    loop = asyncio.get_running_loop()
+    result_id = await loop.run_in_executor(None, bind(result_store.save, enriched, None, {"enrichment": report}))
+    return _format_result(df, enriched, report, api_response), result_id
+
+def _prepare_prompt(df: pd.DataFrame, prompt: str) -> Optional[str]:
+    """
+    Fill the enrichment template with a sample of the dataset and the user prompt.
+    Returns None if the template is missing.
+    """
+    template = prompt_templates.get("enrich")
+    if template is None:
+        return None
+
     # Fill the template with dataset and prompt
-    filled_prompt = template.replace("{{dataset}}", df.head(5).to_csv(index=False))
-    filled_prompt = filled_prompt.replace("{{prompt}}", prompt)
-    
-    # Call Cerebras API to identify fields to enrich
-    api_response = cerebras_client.generate(filled_prompt, max_tokens=512)
-    
-    # For this MVP, we'll simulate web search results
-    # In a real implementation, you would call Brave API:
-    #   brave_api_key = os.getenv("BRAVE_API_KEY")
-    #   headers = {"X-Subscription-Token": brave_api_key}
-    #   response = httpx.get(f"https://api.search.brave.com/res/v1/web/search?q={query}", headers=headers)
-    #
-    # Or Serper.dev API:
-    #   serper_api_key = os.getenv("SERPER_API_KEY")
-    #   headers = {"X-API-KEY": serper_api_key}
-    #   response = httpx.post("https://google.serper.dev/search", json={"q": query}, headers=headers)
-    
+    return template.render(dataset=df.head(5).to_csv(index=False), prompt=prompt)
+
+def _format_result(df: pd.DataFrame, enriched: pd.DataFrame, report: Dict[str, Any], api_response: dict) -> str:
     result = f"Data enrichment completed:\n"
     result += f"- Dataset shape: {df.shape}\n"
-    result += f"- Enriched fields: {list(df.columns)}\n\n"
-    
+    result += f"- Enriched fields: {report['columns']}\n"
+    result += format_enrich_report(report) + "\n"
+
     if api_response["success"]:
         result += f"Enrichment summary from Cerebras API:\n{api_response['response']}\n\n"
     else:
         result += f"Note: Cerebras API call failed\n"
         result += f"Error: {api_response['error']}\n\n"
-    
-    # Add example enriched data
+
     result += "Sample enriched entries:\n"
-    result += "Name: John Doe | Context: Common placeholder name used in examples | Source: https://en.wikipedia.org/wiki/John_Doe\n"
-    result += "City: New York | Context: Largest city in the United States by population | Source: https://en.wikipedia.org/wiki/New_York_City\n"
-    result += "Occupation: Engineer | Context: Professional who applies scientific principles to design and build structures, machines, or systems | Source: https://en.wikipedia.org/wiki/Engineer\n"
-    
+    for column in report["columns"]:
+        entries = enriched[[column, f"{column}_context", f"{column}_source"]].dropna().drop_duplicates(subset=column)
+        for value, context, source in entries.head(SAMPLE_ENTRIES).itertuples(index=False):
+            result += f"{column}: {value} | Context: {context} | Source: {source}\n"
+
     return result
@@ -1,65 +1,164 @@
+import asyncio
+import json
 import re
-import os
-from cerebras_client import cerebras_client
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 
-def generate_data(prompt: str) -> str:
+import pandas as pd
+from fastapi import APIRouter, UploadFile, File, Form
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from generation import (DEFAULT_SCHEMA, GENERATE_MAX_ROWS, format_generation_stats, generate_chunks,
+                        infer_schema, parse_generate_params)
+from ingest import ingest_upload
+from progress import preview_csv, report_progress
+from prompt_templates import prompt_templates
+from result_store import result_store
+from telemetry import bind, span
+
+router = APIRouter()
+
+# Rows of generated data shown in the stage summary; the full output is in the stored result
+PREVIEW_ROWS = 10
+
+
+def generate_data(prompt: str, df: Optional[pd.DataFrame] = None,
+                  params: Optional[Dict[str, Any]] = None) -> str:
     """
     Generate synthetic data based on schema or prompt.
-    Uses the Cerebras API to generate realistic synthetic data.
+    Blocking wrapper around agenerate_data for sync callers (outside an event loop);
+    use agenerate_data for the stored result ID.
+    """
+    return asyncio.run(agenerate_data(prompt, df, params))[0]
+
+async def agenerate_data(prompt: str, df: Optional[pd.DataFrame] = None,
+                         params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[str]]:
+    """
+    Generate synthetic rows shaped like df (or a default Name/Age/City/Occupation schema)
+    with concurrent LLM calls and the local sampler, writing them straight to the result
+    store. Returns (summary, result ID).
+    """
+    request = _prepare_request(prompt, params)
+    if request is None:
+        return "Error: Generate template not found", None
+
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    with span("generate.schema"):
+        schema = await loop.run_in_executor(None, bind(infer_schema, df)) if df is not None else DEFAULT_SCHEMA
+    stats: Dict[str, Any] = {}
+    preview = []
+    writer = result_store.writer()
+    try:
+        with span("generate.rows", mode=request["config"]["mode"]) as rows_span:
+            async for chunk in generate_chunks(request["template"], prompt, request["count"], schema,
+                                               request["config"], stats, request["noise_requested"]):
+                await loop.run_in_executor(None, bind(writer.write, chunk))
+                progress = {"rows": writer.rows, "total": request["count"]}
+                if not preview:
+                    progress["preview"] = preview_csv(chunk)
+                report_progress(**progress)
+                if sum(len(rows) for rows in preview) < PREVIEW_ROWS:
+                    preview.append(chunk.head(PREVIEW_ROWS))
+            rows_span.set(rows=writer.rows, llm_calls=stats.get("calls", 0))
+    except BaseException:
+        writer.abort()
+        raise
+    _finish_stats(stats, writer.rows, start)
+    result_id = await loop.run_in_executor(None, bind(writer.close, None, {"generation": _public_stats(stats)}))
+    return _format_result(request, stats, preview), result_id
+
+def _prepare_request(prompt: str, params: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    """
+    Parse generation parameters from the prompt and load the template.
+    Returns None if the template is missing.
     """
     # Parse the prompt to extract generation parameters
     # For example: "generate 30 new noisy examples"
+    config = parse_generate_params(params)
     count_match = re.search(r"generate\s+(\d+)", prompt.lower())
     count = int(count_match.group(1)) if count_match else 10
-    
+    if config["count"] is not None:
+        count = config["count"]
+    count = min(count, GENERATE_MAX_ROWS)
+
     noise_requested = "noisy" in prompt.lower()
-    
-    # Load the generation prompt template
-    template_path = os.path.join(os.path.dirname(__file__), "..", "prompts", "generate_template.txt")
-    try:
-        with open(template_path, "r") as f:
-            template = f.read()
-    except FileNotFoundError:
-        return "Error: Generate template not found"
-    
-    # Fill the template with prompt
-    filled_prompt = template.replace("{{prompt}}", prompt)
-    
-    # Call Cerebras API for data generation
-    api_response = cerebras_client.generate(filled_prompt, max_tokens=1024)
-    
-    if api_response["success"]:
-        result = f"Data generation completed using Cerebras API:\n"
-        result += f"- Requested examples: {count}\n"
-        result += f"- Noise requested: {noise_requested}\n\n"
-        result += f"Generated data:\n{api_response['data']}"
+
+    # Get the compiled generation prompt template
+    template = prompt_templates.get("generate")
+    if template is None:
+        return None
+
+    return {"count": count, "noise_requested": noise_requested, "template": template, "config": config}
+
+def _finish_stats(stats: Dict[str, Any], rows: int, start: float):
+    seconds = time.perf_counter() - start
+    stats["rows"] = rows
+    stats["seconds"] = round(seconds, 3)
+    stats["rows_per_second"] = int(rows / seconds) if seconds > 0 else rows
+
+def _public_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in stats.items() if key != "errors"}
+
+def _format_result(request: dict, stats: Dict[str, Any], preview) -> str:
+    if stats["calls"] and stats["failed_calls"] == stats["calls"]:
+        result = "Data generation completed (API call failed, using local generation):\n"
+    elif stats["mode"] == "local":
+        result = "Data generation completed using local sampling:\n"
     else:
-        # Fallback to basic generation if API fails
-        result = f"Data generation completed (API call failed, using basic generation):\n"
-        result += f"- Requested examples: {count}\n"
-        result += f"- Noise requested: {noise_requested}\n"
-        result += f"- Error: {api_response['error']}\n\n"
-        
-        # Generate some example data based on common patterns
-        if noise_requested:
-            result += "Generated noisy example data:\n"
-            result += "Name,Age,City,Occupation\n"
-            result += "John Doe,29,New York,Engineer\n"
-            result += "Jane Smith,34,London,Doctor\n"
-            result += "Bob Johnson,41,Paris,Teacher\n"
-            result += "Alice Brown,27, noisy Tokyo,Designer\n"
-            result += "Charlie Davis,38,Sydney, noisy Accountant\n"
-        else:
-            result += "Generated clean example data:\n"
-            result += "Name,Age,City,Occupation\n"
-            result += "John Doe,29,New York,Engineer\n"
-            result += "Jane Smith,34,London,Doctor\n"
-            result += "Bob Johnson,41,Paris,Teacher\n"
-            result += "Alice Brown,27,Tokyo,Designer\n"
-            result += "Charlie Davis,38,Sydney,Accountant\n"
-        
-        # Add more rows to reach the requested count
-        for i in range(5, min(count, 15)):  # Limiting to 15 for demo purposes
-            result += f"Example Person {i},{20+i},City {i},Occupation {i}\n"
-    
+        result = "Data generation completed using Cerebras API:\n"
+    result += f"- Requested examples: {request['count']}\n"
+    result += f"- Noise requested: {request['noise_requested']}\n"
+    result += format_generation_stats(stats)
+    for error in stats["errors"]:
+        result += f"- Error: {error}\n"
+
+    rows = pd.concat(preview).head(PREVIEW_ROWS) if preview else pd.DataFrame()
+    result += f"\nGenerated data (first {len(rows)} rows):\n{rows.to_csv(index=False)}"
     return result
+
+@router.post("/api/generate/stream")
+async def generate_stream(prompt: str = Form(...), file: UploadFile = File(None),
+                          generate_params: str = Form(None)):
+    """
+    Stream generated rows to the client as CSV while they are produced, and store them as a
+    result (its ID is in the X-Result-Id header) for later download in other formats.
+    """
+    try:
+        params = json.loads(generate_params) if generate_params else None
+        request = _prepare_request(prompt, params)
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid generate_params: {e}"})
+    if request is None:
+        return JSONResponse(status_code=500, content={"error": "Generate template not found"})
+
+    schema = DEFAULT_SCHEMA
+    if file and file.filename:
+        df, _ = await ingest_upload(file)
+        schema = await asyncio.get_running_loop().run_in_executor(None, infer_schema, df)
+        del df
+
+    writer = result_store.writer()
+    return StreamingResponse(_stream_csv(request, prompt, schema, writer), media_type="text/csv",
+                             headers={"X-Result-Id": writer.result_id,
+                                      "Content-Disposition": "attachment; filename=generated_data.csv"})
+
+async def _stream_csv(request: dict, prompt: str, schema: Dict[str, Any], writer) -> AsyncIterator[bytes]:
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    stats: Dict[str, Any] = {}
+    first = True
+    try:
+        async for chunk in generate_chunks(request["template"], prompt, request["count"], schema,
+                                           request["config"], stats, request["noise_requested"]):
+            await loop.run_in_executor(None, writer.write, chunk)
+            yield chunk.to_csv(index=False, header=first).encode("utf-8")
+            first = False
+    except BaseException:
+        # Client disconnected or generation failed: do not publish a partial result
+        writer.abort()
+        raise
+    if first:
+        yield (",".join(column["name"] for column in schema["columns"]) + "\n").encode("utf-8")
+    _finish_stats(stats, writer.rows, start)
+    await loop.run_in_executor(None, writer.close, None, {"generation": _public_stats(stats)})
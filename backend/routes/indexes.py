@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from typing import List
+from index_store import index_store
+
+router = APIRouter()
+
+# Plain def routes: FastAPI runs them in its threadpool, so index locks and file IO
+# (an embed build holds the index lock for its whole run) never block the event loop
+
+@router.get("/api/indexes")
+def list_indexes():
+    """
+    List the named FAISS indexes and their current versions.
+    """
+    return {"indexes": index_store.list()}
+
+@router.post("/api/indexes/{name}/delete")
+def delete_rows(name: str, ids: List[int]):
+    """
+    Delete rows from a named index by stable row ID.
+    """
+    removed = index_store.delete_rows(name, ids)
+    manifest = index_store.manifest(name)
+    return {"index": name, "removed": removed, "version": manifest["version"] if manifest else None}
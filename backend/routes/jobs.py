@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from jobs import job_manager
+
+router = APIRouter()
+
+# Plain def routes: the job store is SQLite, so FastAPI runs these in its threadpool
+
+def _public(job: dict) -> dict:
+    return {key: value for key, value in job.items() if key not in ("input_path", "options")}
+
+@router.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Poll a background job for its status, per-stage progress and (partial) results.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return _public(job)
+
+@router.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """
+    Cancel a queued or running background job.
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return _public(job)
@@ -0,0 +1,41 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from cerebras_client import cerebras_client
+from jobs import job_manager
+from model_registry import model_registry
+from stage_cache import stage_cache
+from telemetry import metrics
+
+router = APIRouter()
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _component_gauges():
+    """
+    Point-in-time values the components already track, read on every scrape.
+    """
+    llm_cache = cerebras_client.cache_stats()
+    jobs = job_manager.stats()
+    stages = stage_cache.snapshot()
+    return {
+        "datasanity_llm_cache_hits": llm_cache["hits"],
+        "datasanity_llm_cache_misses": llm_cache["misses"],
+        "datasanity_llm_cache_entries": llm_cache["entries"],
+        "datasanity_llm_cache_saved_seconds": llm_cache["saved_seconds"],
+        "datasanity_stage_cache_hits": stages["hits"],
+        "datasanity_stage_cache_misses": stages["misses"],
+        "datasanity_stage_cache_size_mb": stages["size_mb"],
+        "datasanity_jobs_queued": jobs["queued"],
+        "datasanity_jobs_running": jobs["running"],
+        "datasanity_embedding_models_loaded": len(model_registry.stats()["models"]),
+    }
+
+metrics.add_collector(_component_gauges)
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Per-step latency histograms, row/byte/cache counters and component gauges for Prometheus.
+    """
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,71 @@
+import os
+import time
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import List
+import numpy as np
+from embedding_backends import REFERENCE_BACKEND
+from index_store import index_store, DEFAULT_INDEX_NAME, sanitize_index_name
+from model_registry import model_registry
+from metadata_store import MetadataStore, metadata_path
+
+router = APIRouter()
+
+# Upper bound on k; larger requests get a 422 instead of reaching FAISS
+SEARCH_MAX_K = int(os.getenv("SEARCH_MAX_K", "1000"))
+
+class SearchRequest(BaseModel):
+    queries: List[str]
+    index: str = DEFAULT_INDEX_NAME
+    k: int = Field(10, ge=1, le=SEARCH_MAX_K)
+
+@router.post("/api/search")
+def search(request: SearchRequest):
+    """
+    Embed one or more queries with the index's model and return the top-k source rows for each.
+    """
+    name = sanitize_index_name(request.index)
+    opened = index_store.open_for_search(name)
+    if opened is None:
+        return JSONResponse(status_code=404, content={"error": f"Index '{name}' not found"})
+    index, manifest = opened
+    if not request.queries:
+        return {"index": name, "results": []}
+    
+    # Embed all queries in one batch with the cached model
+    encode_start = time.perf_counter()
+    model = model_registry.get(manifest.get("model"), None, manifest.get("embed_backend", REFERENCE_BACKEND))
+    vectors = np.asarray(model.encode(request.queries), dtype="float32")
+    encode_ms = (time.perf_counter() - encode_start) * 1000
+    
+    # Look up only the returned IDs in the index's metadata store
+    metadata = MetadataStore(metadata_path(index_store.index_dir(name)))
+    try:
+        results = []
+        for query, vector in zip(request.queries, vectors):
+            search_start = time.perf_counter()
+            distances, ids = index.search(vector.reshape(1, -1), request.k)
+            search_ms = (time.perf_counter() - search_start) * 1000
+            
+            # FAISS pads with -1 when fewer than k vectors match
+            hits = [(float(distance), int(row_id)) for distance, row_id in zip(distances[0], ids[0]) if row_id >= 0]
+            rows = metadata.get(row_id for _, row_id in hits)
+            matches = []
+            for distance, row_id in hits:
+                entry = rows.get(row_id, {})
+                matches.append({
+                    "id": int(row_id),
+                    "distance": distance,
+                    "text": entry.get("text"),
+                    "source_row": entry.get("source_row"),
+                })
+            results.append({
+                "query": query,
+                "matches": matches,
+                "latency_ms": round(search_ms + encode_ms / len(request.queries), 3),
+                "search_ms": round(search_ms, 3),
+            })
+    finally:
+        metadata.close()
+    return {"index": name, "version": manifest["version"], "encode_ms": round(encode_ms, 3), "results": results}
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from storage import data_path
+
+# 0 turns off reuse of stage outputs for repeated datasets and prompts
+STAGE_CACHE_ENABLED = os.getenv("STAGE_CACHE", "1") == "1"
+# Size budget of the stored stage outputs; least recently used entries are evicted beyond it
+STAGE_CACHE_MAX_MB = float(os.getenv("STAGE_CACHE_MAX_MB", "2048"))
+
+MANIFEST_FILE = "manifest.json"
+
+
+class StageCache:
+    """
+    Outputs of pipeline stages keyed by (dataset fingerprint, normalized prompt, stage, stage
+    config version): a directory per entry under DATA_DIR/stage_cache/ with the stage summary,
+    metadata and artifact files (e.g. the cleaned frame as Parquet), and a SQLite index of
+    entry sizes and last use for LRU-by-size eviction.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.root = root or os.path.dirname(data_path("stage_cache", "_"))
+        self.max_bytes = max_bytes if max_bytes is not None else int(STAGE_CACHE_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        The entry stored under key ({"output", "meta", "files": {name: path}}), or None.
+        """
+        with self._lock:
+            conn = self._connect_locked()
+            row = conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+            entry = self._read_locked(key) if row is not None else None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: str, output: Any, meta: Optional[Dict[str, Any]] = None,
+            files: Optional[Dict[str, str]] = None):
+        """
+        Store a stage output. files ({name: path}) are hard-linked (or copied) into the entry,
+        so they survive the original being pruned (e.g. a result in the result store).
+        """
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(tmp_dir)
+        try:
+            for name, path in (files or {}).items():
+                target = os.path.join(tmp_dir, name)
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copyfile(path, target)
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+                json.dump({"output": output, "meta": meta or {}, "files": sorted(files or {})}, f)
+            size = sum(os.path.getsize(os.path.join(tmp_dir, name)) for name in os.listdir(tmp_dir))
+            with self._lock:
+                conn = self._connect_locked()
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.rename(tmp_dir, entry_dir)
+                now = time.time()
+                conn.execute("INSERT OR REPLACE INTO entries (key, size, last_used, created) VALUES (?, ?, ?, ?)",
+                             (key, size, now, now))
+                self.stats["stores"] += 1
+                self._evict_locked(keep=key)
+                conn.commit()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._delete_locked(key)
+            self._connect_locked().commit()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size = self._connect_locked().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            return {**self.stats, "entries": count, "size_mb": round(size / (1024 * 1024), 1)}
+
+    def _connect_locked(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _read_locked(self, key: str) -> Optional[Dict[str, Any]]:
+        entry_dir = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry_dir, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            # Removed or damaged on disk: forget it
+            self._delete_locked(key)
+            return None
+        files = {name: os.path.join(entry_dir, name) for name in manifest["files"]}
+        return {"output": manifest["output"], "meta": manifest["meta"], "files": files}
+
+    def _evict_locked(self, keep: str):
+        conn = self._conn
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM entries WHERE key != ? ORDER BY last_used", (keep,)).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._delete_locked(key)
+            self.stats["evictions"] += 1
+            total -= size
+
+    def _delete_locked(self, key: str):
+        self._connect_locked().execute("DELETE FROM entries WHERE key = ?", (key,))
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+# Global instance of the stage cache
+stage_cache = StageCache()
@@ -0,0 +1,13 @@
+import os
+
+# Root directory for everything the backend persists locally (caches, indexes, results)
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+
+def data_path(*parts: str) -> str:
+    """
+    Return a path under DATA_DIR, creating its parent directory if needed.
+    """
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,209 @@
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 0 turns span timing and metrics off; span() then returns a shared no-op
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+# Request header that asks for the request's trace spans in the response
+TRACE_HEADER = "x-debug-trace"
+
+# Latency buckets in seconds, from sub-millisecond cache hits to multi-minute embeddings
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Span attributes that are also summed into <name>_total counters per span
+COUNTED_ATTRS = ("rows", "bytes", "cache_hits", "cache_misses", "llm_calls")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# The current request's trace (a list of finished spans) and the innermost open span
+_trace: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("trace", default=None)
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("span", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series: Dict[LabelKey, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Bucket counts, then +Inf, sum and count
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key, le=bound)} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {values[-1]:g}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._series: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{_labels(key)} {value:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics in the Prometheus text format. Collectors add gauges computed at
+    scrape time (e.g. cache sizes) from the components that already track them.
+    """
+
+    def __init__(self):
+        self.span_seconds = Histogram("datasanity_span_seconds", "Time spent in each instrumented step")
+        self.request_seconds = Histogram("datasanity_http_request_seconds", "HTTP request latency")
+        self.span_counters = {name: Counter(f"datasanity_span_{name}_total", f"{name.replace('_', ' ').capitalize()} handled per step")
+                              for name in COUNTED_ATTRS}
+        self._collectors: List[Callable[[], Dict[str, float]]] = []
+
+    def add_collector(self, collect: Callable[[], Dict[str, float]]):
+        """
+        collect() returns {metric name: value}, rendered as gauges on every scrape.
+        """
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = self.span_seconds.render() + self.request_seconds.render()
+        for counter in self.span_counters.values():
+            lines += counter.render()
+        for collect in self._collectors:
+            for name, value in collect().items():
+                lines += [f"# TYPE {name} gauge", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+class Span:
+    """
+    One timed step. Attributes set with set() (rows, bytes, cache hits, ...) go to the trace,
+    and the COUNTED_ATTRS among them to the per-step counters.
+    """
+    __slots__ = ("name", "attrs", "start", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _current.reset(self._token)
+        metrics.span_seconds.observe(seconds, span=self.name)
+        for name in COUNTED_ATTRS:
+            value = self.attrs.get(name)
+            if value:
+                metrics.span_counters[name].inc(value, span=self.name)
+        trace = _trace.get()
+        if trace is not None:
+            entry = {"name": self.name, "seconds": round(seconds, 6), **self.attrs}
+            if exc_type is not None:
+                entry["error"] = exc_type.__name__
+            trace.append(entry)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any):
+        pass
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, **attrs: Any):
+    """
+    Time a step: `with span("embed.encode", rows=n) as s: ...; s.set(cache_hits=h)`.
+    """
+    if not TELEMETRY_ENABLED:
+        return _NO_SPAN
+    return Span(name, attrs)
+
+
+def annotate(**attrs: Any):
+    """
+    Add attributes to the innermost open span, if any.
+    """
+    current = _current.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def start_trace() -> List[Dict[str, Any]]:
+    """
+    Collect the spans finished from here on in this context (the request) into the returned list.
+    """
+    trace: List[Dict[str, Any]] = []
+    _trace.set(trace)
+    return trace
+
+
+def bind(fn: Callable, *args, **kwargs) -> Callable[[], Any]:
+    """
+    fn bound to the caller's context, for run_in_executor, which does not carry context
+    variables into the worker thread; spans inside fn then join the caller's trace.
+    """
+    return functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _labels(key: LabelKey, **extra: Any) -> str:
+    pairs = list(key) + [(name, value) for name, value in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Global instance of the metrics registry
+metrics = MetricsRegistry()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Backend modules import each other by bare name (from storage import data_path)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep anything a module persists on import or through its global instance out of backend/data
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="datasanity-tests-"))
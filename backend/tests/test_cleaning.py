@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+from cleaning import CleaningEngine, frame_chunks, parse_clean_params
+
+
+def clean(df, params=None, chunk_rows=None):
+    engine = CleaningEngine(params)
+    make_chunks = (lambda: frame_chunks(df, chunk_rows)) if chunk_rows else (lambda: [df])
+    chunks = list(engine.run(make_chunks))
+    return (pd.concat(chunks, ignore_index=True) if chunks else df.iloc[:0]), engine.report
+
+
+def test_exact_duplicates_are_removed_across_chunks():
+    df = pd.DataFrame({"name": ["ann", "bob", "ann", "cy", "bob"], "age": [1, 2, 1, 3, 2]})
+    cleaned, report = clean(df, {"outliers": "none", "near_dup_threshold": 0}, chunk_rows=2)
+    assert cleaned["name"].tolist() == ["ann", "bob", "cy"]
+    assert report["exact_duplicates"] == 2
+    assert (report["initial_rows"], report["final_rows"], report["chunks"]) == (5, 3, 3)
+
+
+def test_near_duplicates_are_removed_despite_distinct_ids():
+    text = "The quick brown fox jumps over the lazy dog near the river bank"
+    df = pd.DataFrame({
+        "id": [1, 2, 3],
+        "review": [text, text.upper() + "  ", "Something else entirely, nothing alike at all"],
+    })
+    cleaned, report = clean(df, {"outliers": "none", "text_columns": ["review"]})
+    assert cleaned["id"].tolist() == [1, 3]
+    assert report["near_duplicates"] == 1
+
+
+def test_near_duplicates_only_match_within_their_group():
+    text = "The quick brown fox jumps over the lazy dog near the river bank"
+    df = pd.DataFrame({"city": ["Oslo", "Rome", "Oslo"], "review": [text, text, text + "!"]})
+    cleaned, report = clean(df, {"outliers": "none", "text_columns": ["review"], "group_columns": ["city"]})
+    assert cleaned["city"].tolist() == ["Oslo", "Rome"]
+    assert report["near_duplicates"] == 1
+
+
+@pytest.mark.parametrize("chunk_rows", [None, 2])
+def test_imputation_uses_statistics_of_the_whole_frame(chunk_rows):
+    df = pd.DataFrame({
+        "age": [10.0, None, 30.0, 40.0, None],
+        "city": ["Oslo", "Rome", None, "Oslo", "Oslo"],
+        "note": [None, "a", "b", "c", "d"],
+    })
+    params = {"missing": {"age": "median", "city": "mode", "note": "constant:none"}, "outliers": "none",
+              "near_dup_threshold": 0}
+    cleaned, report = clean(df, params, chunk_rows)
+    assert cleaned["age"].tolist() == [10.0, 30.0, 30.0, 40.0, 30.0]
+    assert cleaned["city"].tolist() == ["Oslo", "Rome", "Oslo", "Oslo", "Oslo"]
+    assert cleaned["note"].tolist() == ["none", "a", "b", "c", "d"]
+    assert report["imputed"] == {"age": 2, "city": 1, "note": 1}
+
+
+def test_rows_missing_a_drop_column_are_dropped():
+    df = pd.DataFrame({"a": [1.0, None, 3.0], "b": ["x", "y", None]})
+    cleaned, report = clean(df, {"missing": {"b": "keep"}, "outliers": "none", "near_dup_threshold": 0})
+    assert cleaned["a"].tolist() == [1.0, 3.0]
+    assert report["dropped_missing"] == 1
+
+
+def test_outliers_are_flagged_and_existing_flags_kept():
+    df = pd.DataFrame({
+        "value": [10, 11, 12, 10, 11, 12, 10, 500],
+        "is_outlier": ["no", "yes", "false", "", "0", "1", "False", "false"],
+    })
+    cleaned, report = clean(df, {"missing": "keep", "outliers": "iqr", "near_dup_threshold": 0})
+    assert cleaned["is_outlier"].tolist() == [False, True, False, False, False, True, False, True]
+    assert report["outliers"] == {"value": 1}
+
+
+def test_unknown_options_are_rejected():
+    with pytest.raises(ValueError):
+        parse_clean_params({"missing": {"a": "guess"}})
+    with pytest.raises(ValueError):
+        parse_clean_params({"outliers": "mad"})
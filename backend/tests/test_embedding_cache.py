@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, text_hash
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return np.array([[len(t), i] for i, t in enumerate(texts)], dtype=np.float32)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(path=str(tmp_path / "embeddings.sqlite3"), max_entries=10)
+
+
+def test_misses_are_encoded_once_and_then_hit(cache):
+    encode = CountingEncoder()
+    vectors, stats = cache.encode(encode, "m", ["a", "bb", "a"])
+    assert encode.texts == ["a", "bb"]
+    assert stats == {"hits": 0, "misses": 3, "encoded": 2, "encode_seconds": stats["encode_seconds"]}
+    assert np.array_equal(vectors[0], vectors[2])
+
+    again, stats = cache.encode(encode, "m", ["bb", "  a "])
+    assert encode.texts == ["a", "bb"]
+    assert (stats["hits"], stats["encoded"]) == (2, 0)
+    assert np.array_equal(again, vectors[[1, 0]])
+
+
+def test_entries_are_kept_per_model(cache):
+    cache.put_many("m", [(text_hash("a"), np.ones(2, dtype=np.float32))])
+    assert cache.get_many("other", [text_hash("a")]) == {}
+    assert list(cache.get_many("m", [text_hash("a")])) == [text_hash("a")]
+
+
+def test_eviction_drops_least_recently_used(cache):
+    encode = CountingEncoder()
+    cache.encode(encode, "m", [f"old {i}" for i in range(5)])
+    cache.encode(encode, "m", [f"new {i}" for i in range(5)])
+    # Reading the old entries makes the new ones the least recently used
+    cache.get_many("m", [text_hash(f"old {i}") for i in range(5)])
+    cache.encode(encode, "m", ["extra"])
+
+    texts = [f"old {i}" for i in range(5)] + [f"new {i}" for i in range(5)] + ["extra"]
+    kept = cache.get_many("m", [text_hash(t) for t in texts])
+    # Going over max_entries trims the cache to 90% of it
+    assert len(kept) == int(cache.max_entries * 0.9)
+    assert all(text_hash(f"old {i}") in kept for i in range(5))
+    assert text_hash("extra") in kept
+
+
+def test_clear(cache):
+    cache.encode(CountingEncoder(), "m", ["a"])
+    cache.clear()
+    assert cache.get_many("m", [text_hash("a")]) == {}
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from generation import DEFAULT_SCHEMA, _Deduplicator, infer_schema, normalize_dtypes, sample_frame, validate_rows
+
+SCHEMA = infer_schema(pd.DataFrame({
+    "name": ["ann", "bob", "cy"],
+    "age": [31, 42, 27],
+    "score": [0.5, None, 2.0],
+    "active": [True, False, True],
+}))
+
+
+def raw(**columns):
+    return pd.DataFrame(columns, dtype=str)
+
+
+def test_validate_rows_coerces_valid_rows():
+    frame, rejected = validate_rows(
+        raw(name=[" dee "], age=["40"], score=[""], active=["yes"]), SCHEMA)
+    assert rejected == 0
+    assert frame["name"].tolist() == ["dee"]
+    assert frame["age"].tolist() == [40] and str(frame["age"].dtype) == "Int64"
+    assert frame["score"].isna().all()
+    assert frame["active"].tolist() == [True]
+
+
+def test_validate_rows_rejects_wrong_types_and_required_blanks():
+    frame, rejected = validate_rows(raw(
+        name=["ok", "bad int", "fraction", "blank age", "bad bool"],
+        age=["1", "ten", "2.5", "", "3"],
+        score=["1.0", "1.0", "1.0", "1.0", "1.0"],
+        active=["true", "true", "true", "true", "maybe"],
+    ), SCHEMA)
+    assert frame["name"].tolist() == ["ok"]
+    assert rejected == 4
+
+
+def test_validate_rows_rejects_everything_when_a_column_is_missing():
+    frame, rejected = validate_rows(raw(name=["a", "b"], age=["1", "2"]), SCHEMA)
+    assert frame is None and rejected == 2
+
+
+def test_deduplicator_drops_repeats_within_and_across_chunks():
+    dedup = _Deduplicator()
+    first, dropped = dedup.filter(pd.DataFrame({"a": [1, 2, 1]}))
+    assert first["a"].tolist() == [1, 2] and dropped == 1
+    second, dropped = dedup.filter(pd.DataFrame({"a": [2, 3]}))
+    assert second["a"].tolist() == [3] and dropped == 1
+    assert dedup.filter(pd.DataFrame({"a": []}))[1] == 0
+
+
+def test_sampled_chunks_share_dtypes_and_are_deterministic():
+    first = normalize_dtypes(sample_frame(DEFAULT_SCHEMA, 50, np.random.default_rng(7)), DEFAULT_SCHEMA)
+    again = normalize_dtypes(sample_frame(DEFAULT_SCHEMA, 50, np.random.default_rng(7)), DEFAULT_SCHEMA)
+    pd.testing.assert_frame_equal(first, again)
+    noisy = normalize_dtypes(sample_frame(DEFAULT_SCHEMA, 50, np.random.default_rng(8), noisy=True), DEFAULT_SCHEMA)
+    assert noisy.dtypes.to_dict() == first.dtypes.to_dict()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from index_store import IndexStore
+
+DIM = 8
+
+
+def vectors(ids):
+    rng = np.random.default_rng(0)
+    return rng.random((len(ids), DIM), dtype=np.float32) + np.asarray(ids, dtype=np.float32)[:, None]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IndexStore(root=str(tmp_path / "indexes"))
+
+
+def stored_index(store, index_type="flat", ids=(1, 2, 3), hashes=("a", "b", "c")):
+    stored = store.create("people.csv", DIM, "m", index_type, params={"precision": "float32"})
+    ids = np.asarray(ids, dtype="int64")
+    stored.upsert(ids, np.asarray(hashes), vectors(ids))
+    return stored
+
+
+def test_diff_marks_new_and_changed_rows(store):
+    stored = stored_index(store)
+    is_new, is_changed = stored.diff(np.array([1, 2, 4]), np.array(["a", "B", "d"]))
+    assert is_new.tolist() == [False, False, True]
+    assert is_changed.tolist() == [False, True, False]
+
+
+def test_diff_against_empty_index_is_all_new(store):
+    stored = store.create("empty", DIM, "m")
+    is_new, is_changed = stored.diff(np.array([5, 6]), np.array(["x", "y"]))
+    assert is_new.all() and not is_changed.any()
+
+
+def test_upsert_replaces_existing_ids(store):
+    stored = stored_index(store)
+    stored.upsert(np.array([2, 4]), np.array(["B", "d"]), vectors([20, 4]))
+    assert stored.ids.tolist() == [1, 2, 3, 4]
+    assert stored.hashes.tolist() == ["a", "B", "c", "d"]
+    assert stored.index.ntotal == 4
+    _, found = stored.index.search(vectors([20])[:1], 1)
+    assert found[0, 0] == 2
+
+
+def test_remove_drops_only_present_ids(store):
+    stored = stored_index(store)
+    assert stored.remove(np.array([2, 99])) == 1
+    assert stored.ids.tolist() == [1, 3]
+    assert stored.index.ntotal == 2
+    assert stored.remove(np.array([99])) == 0
+
+
+def test_hnsw_removal_is_compacted_on_save(store):
+    stored = stored_index(store, "hnsw")
+    stored.upsert(np.array([2]), np.array(["B"]), vectors([20]))
+    assert stored.remove(np.array([3])) == 1
+    # HNSW cannot remove in place, so replaced and removed vectors linger until save
+    assert stored.index.ntotal == 4
+
+    version = store.save(stored)
+    assert version == 1 and stored.index.ntotal == 2
+    reloaded = store.load("people.csv")
+    assert reloaded.ids.tolist() == [1, 2]
+    assert reloaded.hashes.tolist() == ["a", "B"]
+    _, found = reloaded.index.search(vectors([20])[:1], 2)
+    assert sorted(found[0].tolist()) == [1, 2] and found[0, 0] == 2
+
+
+def test_delete_rows_saves_a_new_version(store):
+    stored = stored_index(store)
+    with store.lock("people.csv"):
+        store.save(stored)
+    assert store.delete_rows("people.csv", [1]) == 1
+    assert store.manifest("people.csv")["version"] == 2
+    assert store.load("people.csv").ids.tolist() == [2, 3]
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+import jobs
+from jobs import JobManager, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(path=str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def manager(store):
+    # Workers are not started; tests drive _execute directly
+    manager = JobManager(workers=0)
+    manager.store = store
+    return manager
+
+
+def test_update_with_expected_status_only_applies_in_that_status(store):
+    job = store.create("clean", {}, None, 0, {"clean": {"status": "queued"}})
+    assert store.update(job["id"], expected_status=("queued",), status="running")
+    assert not store.update(job["id"], expected_status=("queued",), status="done")
+    assert store.get(job["id"])["status"] == "running"
+    assert store.update(job["id"], progress={"clean": {"status": "done"}})
+    assert store.get(job["id"])["progress"] == {"clean": {"status": "done"}}
+
+
+def test_incomplete_lists_queued_and_running_by_priority(store):
+    low = store.create("clean", {}, None, 0, {})
+    high = store.create("clean", {}, None, 5, {})
+    done = store.create("clean", {}, None, 9, {})
+    store.update(done["id"], status="done")
+    store.update(low["id"], status="running")
+    assert [job["id"] for job in store.incomplete()] == [high["id"], low["id"]]
+
+
+def test_submit_before_start_raises():
+    with pytest.raises(RuntimeError):
+        JobManager(workers=0).submit("clean", {}, None)
+
+
+def test_cancel_after_dequeue_keeps_job_cancelled(manager):
+    job = manager.submit("clean", {}, None)
+    manager.cancel(job["id"])
+    asyncio.run(manager._execute(job))
+    assert manager.store.get(job["id"])["status"] == "cancelled"
+
+
+def test_cancel_of_finished_job_is_a_no_op(manager):
+    job = manager.submit("clean", {}, None)
+    manager.store.update(job["id"], status="done")
+    assert manager.cancel(job["id"])["status"] == "done"
+
+
+def test_cancel_stops_a_running_job(manager, monkeypatch):
+    started = threading.Event()
+
+    async def slow_pipeline(df, prompt, options, on_event):
+        started.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(jobs, "run_pipeline", slow_pipeline)
+    job = manager.submit("clean", {}, None)
+    worker = threading.Thread(target=asyncio.run, args=(manager._execute(job),))
+    worker.start()
+    assert started.wait(5)
+    manager.cancel(job["id"])
+    worker.join(5)
+    assert not worker.is_alive()
+    assert manager.store.get(job["id"])["status"] == "cancelled"
+    assert manager.stats()["running"] == 0
+
+
+def test_finished_job_records_results(manager, monkeypatch):
+    async def pipeline(df, prompt, options, on_event):
+        on_event("started", "clean", {})
+        on_event("finished", "clean", {"output": "ok", "seconds": 0.1})
+        return {"cleanedData": "ok"}
+
+    monkeypatch.setattr(jobs, "run_pipeline", pipeline)
+    job = manager.submit("clean", {}, None)
+    asyncio.run(manager._execute(job))
+    saved = manager.store.get(job["id"])
+    assert saved["status"] == "done"
+    assert saved["progress"]["clean"]["status"] == "done"
+    assert saved["results"] == {"cleanedData": "ok"}
@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from result_store import ResultStore
+
+FRAME = pd.DataFrame({"name": ["ann", "bob, jr", None], "age": [31, 42, 27], "score": [0.5, 1.25, 2.0]})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(root=str(tmp_path / "results"))
+
+
+def decompress(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    return data
+
+
+def read_export(data, fmt):
+    if fmt == "csv":
+        return pd.read_csv(io.BytesIO(data))
+    if fmt == "json":
+        payload = json.loads(data)
+        assert payload["dataset_info"]["rows"] == len(FRAME)
+        return pd.DataFrame(payload["data"])
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+@pytest.mark.parametrize("fmt", ["csv", "json", "arrow"])
+def test_export_round_trip(store, fmt, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    result_id = store.save(FRAME)
+    data = b"".join(store.export_chunks(result_id, fmt, compression))
+    restored = read_export(decompress(data, compression), fmt)
+    pd.testing.assert_frame_equal(restored, FRAME, check_dtype=False)
+
+
+def test_export_path_is_written_once(store):
+    result_id = store.save(FRAME)
+    path = store.export_path(result_id, "csv", "gzip")
+    assert path.endswith("export.csv.gz")
+    with open(path, "rb") as f:
+        pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(gzip.decompress(f.read()))), FRAME)
+    assert store.export_path(result_id, "csv", "gzip") == path
+
+
+def test_chunked_save_keeps_the_first_schema(store):
+    result_id = store.save_chunks([FRAME.iloc[:2], FRAME.iloc[2:]])
+    assert store.manifest(result_id)["rows"] == 3
+    restored = pa.ipc.open_stream(b"".join(store.export_chunks(result_id, "arrow", "none"))).read_all()
+    assert restored.num_rows == 3
+    assert restored.schema.field("age").type == pa.int64()
+
+
+def test_empty_result_exports_an_empty_json_array(store):
+    result_id = store.save_chunks([])
+    payload = json.loads(b"".join(store.export_chunks(result_id, "json", "none")))
+    assert payload["data"] == []
+
+
+def test_result_ids_cannot_escape_the_store(store):
+    with pytest.raises(ValueError):
+        store.result_dir("../etc")
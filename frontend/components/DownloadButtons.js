@@ -1,6 +1,6 @@
 import React from 'react';
 
-const DownloadButtons = () => {
+const DownloadButtons = ({ resultId }) => {
   const handleDownload = (type) => {
     // In a real implementation, this would call the appropriate backend endpoint
     // For this MVP, we'll just log the action
@@ -8,8 +8,9 @@ const DownloadButtons = () => {
     
     // Create a temporary link element to trigger download
     const link = document.createElement('a');
-    link.href = `/api/download/${type}`;
-    link.download = `processed_data.${type}`;
+    // Downloads the stored output of this run; without a result ID the latest run is served
+    link.href = resultId ? `/api/download/${type}?result=${resultId}` : `/api/download/${type}`;
+    link.download = `processed_data.${type === 'arrow' ? 'arrows' : type}`;
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
@@ -29,6 +30,18 @@ const DownloadButtons = () => {
       >
         Download JSON
       </button>
+      <button 
+        onClick={() => handleDownload('parquet')}
+        className="bg-yellow-500 hover:bg-yellow-700 text-white font-bold py-2 px-4 rounded"
+      >
+        Download Parquet
+      </button>
+      <button 
+        onClick={() => handleDownload('arrow')}
+        className="bg-indigo-500 hover:bg-indigo-700 text-white font-bold py-2 px-4 rounded"
+      >
+        Download Arrow
+      </button>
       <button 
         onClick={() => handleDownload('faiss')}
         className="bg-red-500 hover:bg-red-700 text-white font-bold py-2 px-4 rounded"
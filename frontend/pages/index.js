@@ -3,19 +3,49 @@ import { useState } from 'react';
 import DataTable from '../components/DataTable';
 import DownloadButtons from '../components/DownloadButtons';
 
+// Results key of each action's output in the /api/process response
+const RESULT_KEYS = {
+  clean: 'cleanedData',
+  generate: 'generatedData',
+  embed: 'vectorizedData',
+  enrich: 'enrichedData',
+};
+
 export default function Home() {
   const [prompt, setPrompt] = useState('');
   const [file, setFile] = useState(null);
   const [results, setResults] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [progress, setProgress] = useState({});
+
+  // Apply one event of the streamed response: stage progress, partial and final results
+  const handleEvent = ({ event, data }) => {
+    if (event === 'started' || event === 'progress') {
+      setProgress((current) => ({ ...current, [data.action]: { ...current[data.action], ...data, status: 'running' } }));
+      if (data.preview) {
+        // Show the first rows of a stage while the rest is still computing
+        setResults((current) => ({ ...current, [RESULT_KEYS[data.action]]: data.preview }));
+      }
+    } else if (event === 'finished') {
+      setProgress((current) => ({ ...current, [data.action]: { ...current[data.action], status: 'done' } }));
+      setResults((current) => ({ ...current, [RESULT_KEYS[data.action]]: data.output }));
+    } else if (event === 'result') {
+      setResults(data);
+    } else if (event === 'error') {
+      throw new Error(data.error);
+    }
+  };
 
   const handleSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
+    setResults(null);
+    setProgress({});
 
     try {
       const formData = new FormData();
       formData.append('prompt', prompt);
+      formData.append('stream', 'ndjson');
       console.log('Prompt entered:', prompt);
 
       if (file) {
@@ -34,8 +64,18 @@ export default function Home() {
         throw new Error(`Server responded with status ${response.status}`);
       }
 
-      const data = await response.json();
-      setResults(data);
+      // Newline-delimited JSON events arrive as the stages start, progress and finish
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.filter((line) => line.trim()).forEach((line) => handleEvent(JSON.parse(line)));
+      }
     } catch (error) {
       console.error('Error processing request:', error);
       alert('An error occurred while processing the request. See console for details.');
@@ -102,6 +142,18 @@ export default function Home() {
           </form>
         </div>
 
+        {loading && Object.keys(progress).length > 0 && (
+          <div className="bg-white rounded-lg shadow-md p-6 mb-8">
+            {Object.entries(progress).map(([action, stage]) => (
+              <p key={action} className="text-gray-700 text-sm">
+                {action}: {stage.status}
+                {stage.status === 'running' && stage.rows !== undefined &&
+                  ` (${stage.phase ? `${stage.phase}, ` : ''}${stage.rows}${stage.total ? ` / ${stage.total}` : ''})`}
+              </p>
+            ))}
+          </div>
+        )}
+
         {results && (
           <div className="bg-white rounded-lg shadow-md p-6">
             <h2 className="text-xl font-bold mb-4">Results</h2>
@@ -111,7 +163,7 @@ export default function Home() {
             {results.vectorizedData && <DataTable data={results.vectorizedData} title="Vectorized Data" />}
             {results.enrichedData && <DataTable data={results.enrichedData} title="Enriched Data" />}
 
-            <DownloadButtons />
+            {!loading && <DownloadButtons resultId={results.resultId} />}
           </div>
         )}
       </main>
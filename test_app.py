@@ -11,7 +11,7 @@ FRONTEND_URL = "http://localhost:3000"
 def test_backend_health():
     """Test if backend is running and healthy"""
     try:
-        response = requests.get(f"{BASE_URL}/health")
+        response = requests.get(f"{BASE_URL}/")
         return response.status_code == 200
     except requests.exceptions.ConnectionError:
         return False
@@ -39,7 +39,7 @@ def test_data_cleaning():
     
     if response.status_code == 200:
         result = response.json()
-        return "cleaned_data" in result
+        return "cleanedData" in result
     return False
 
 def test_data_generation():
@@ -50,11 +50,11 @@ def test_data_generation():
     }
     
     # Send request
-    response = requests.post(f"{BASE_URL}/api/process", json=data)
+    response = requests.post(f"{BASE_URL}/api/process", data=data)
     
     if response.status_code == 200:
         result = response.json()
-        return "generated_data" in result and len(result["generated_data"]) >= 5
+        return "generatedData" in result and "generateResultId" in result
     return False
 
 def test_data_vectorization():
@@ -72,7 +72,7 @@ def test_data_vectorization():
     
     if response.status_code == 200:
         result = response.json()
-        return "embedding_info" in result
+        return "vectorizedData" in result
     return False
 
 def test_data_enrichment():
@@ -90,7 +90,7 @@ def test_data_enrichment():
     
     if response.status_code == 200:
         result = response.json()
-        return "enriched_data" in result
+        return "enrichedData" in result
     return False
 
 def test_downloads():